@@ -1,7 +1,11 @@
-from .find_matches import find_matches
+from .find_matches import find_matches, stream_matches
+from .all_vs_all import all_vs_all
 from .create_db import create_db
+from .convert_db import convert_db
+from .serve import serve, query_server
 from .evaluate_protfin import evaluate_protfin
 from .select_samples import select_samples
+from .evaluate_lsh import evaluate_lsh
 from .print_hash_counts import print_hash_counts
 from .print_prots_per_hash import print_prots_per_hash
 from .plot_frequencies import plot_frequencies
@@ -1,11 +1,11 @@
 from tools import *
-from .kidera import get_aa_vector
-from .constellation import create_constellation
-from .hash_gen import create_hashes
+from .kidera import get_aa_vector, get_aa_vectors
+from .constellation import create_constellation, create_constellations
+from .hash_gen import create_hashes, create_hash_arrays, dedupe_hashes, hash_layout
 from os import environ as env
 
 
-def hashes_from_seq(seq: str, prot_id: str, db_config: DBConfig) -> Hashes:
+def hashes_from_seq(seq: str, prot_id: str, db_config: DBConfig, layout=None) -> Hashes:
     """
     Generate the combinatorial hashes from an amino acid sequence
 
@@ -18,12 +18,51 @@ def hashes_from_seq(seq: str, prot_id: str, db_config: DBConfig) -> Hashes:
     prot_id : ProteinID
         The identifier for the protein of the passed sequence. If unknown,
         just pass a custom
+    db_config : DBConfig
+        The configuration used for generating the hashes
+    layout : HashLayout, optional
+        The bit layout of the hashes, e.g. the one stored in the database.
+        Defaults to the one sized to db_config
     """
 
     hashes = {}
     kf = 0 
+    layout = layout or hash_layout(db_config)
     # start the pipeline
     aa_vec = get_aa_vector(seq, kf)
     constellation = create_constellation(aa_vec, db_config)
-    hashes = {**hashes, **create_hashes(constellation, prot_id, kf)[0]}
+    hashes = {**hashes, **create_hashes(constellation, prot_id, kf, layout)[0]}
     return hashes
+
+
+def hashes_from_seqs(seqs: List[Union[str, bytes]], db_config: DBConfig, layout=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Generate the combinatorial hashes for a batch of amino acid sequences,
+    like hashes_from_seq does for a single one
+
+    ...
+
+    Parameters
+    ----------
+    seqs : List[str or bytes]
+        The sequences of amino acids in their one letter codes, see
+        get_aa_vectors
+    db_config : DBConfig
+        The configuration used for generating the hashes
+    layout : HashLayout, optional
+        The bit layout of the hashes, e.g. the one stored in the database.
+        Defaults to the one sized to db_config
+
+    Returns
+    -------
+    The distinct hashes of all sequences one after another, in the order of
+    the dictionaries hashes_from_seq returns, the window indexes they point
+    to, and the len(seqs) + 1 offsets of the hashes per sequence
+    """
+
+    kf = 0
+    layout = layout or hash_layout(db_config)
+    constellations = create_constellations(*get_aa_vectors(seqs, kf), db_config)
+    hashes, windows, offsets = create_hash_arrays(constellations, kf, layout)
+    hashes, windows, _, offsets = dedupe_hashes(hashes, windows, offsets)
+    return hashes, windows, offsets
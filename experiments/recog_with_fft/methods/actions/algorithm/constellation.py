@@ -1,13 +1,17 @@
-from scipy import signal
+from scipy import signal, fft
 import numpy as np
 from tools import *
 from os import environ as env
 import pandas as pd
 from operator import gt, lt
+from functools import lru_cache
 
 WINDOW_TYPE = env.get("WINDOW_TYPE", ["boxcar", "triang", "blackman", "hamming", "hann", "bartlett", "flattop", "parzen", "bohman", "blackmanharris", "nuttall", "barthann", "cosine", "exponential", "tukey", "taylor", "lanczos"]\
                                      [0])
 
+# number of STFT windows transformed at once by stft_batch
+STFT_CHUNK_SIZE = 2**11
+
 AMPL_QUANTILES = {
     10: {
         5: [ 0.844, 0.54312, 0.0482, 0.1085, 0.04832, 0.025],
@@ -136,7 +140,7 @@ def create_constellation(
         aa_vec: np.ndarray,
         config: DBConfig,
         window=WINDOW_TYPE
-        ) -> ConstellationMap:
+        ) -> Constellation:
     """
     The function carries out a windowed fast fourier transformation,
     often called short time FFT (STFT), on the given vector and creates a list
@@ -161,23 +165,128 @@ def create_constellation(
 
     Returns
     -------
-     A ConstellationMap, a list of coordinates, meaning the pairs of
+     A Constellation, the array of coordinates, meaning the pairs of
      window index and prominent frequency peak of the window
     """
 
-    if len(aa_vec) < config.window_size:
-        aa_vec = np.pad(aa_vec, (0, config.window_size - len(aa_vec)))
-        assert len(aa_vec) == config.window_size
+    stft, _ = stft_batch(aa_vec, np.array([0, len(aa_vec)]), config, window)
+
+    frequencies = fft.rfftfreq(config.window_size)
+    window_indexes = np.arange(len(stft)) * (config.window_size - config.overlap)
+
+    return stft_to_constellation(frequencies, window_indexes, stft.T, config)
+
+
+def create_constellations(
+        values: np.ndarray,
+        offsets: np.ndarray,
+        config: DBConfig,
+        window=WINDOW_TYPE
+        ) -> ConstellationBatch:
+    """
+    Creates the constellations for a batch of vectors at once, like
+    create_constellation does for a single one
+
+    ...
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The concatenated vectors, e.g. the result of get_aa_vectors
+    offsets : np.ndarray
+        The len(vectors) + 1 offsets of the vectors in values
+    config : DBConfig
+        The configuration for STFT and peak selection
+    """
+
+    stft, window_offsets = stft_batch(values, offsets, config, window)
+    return ConstellationBatch(spectra_to_peaks(abs(stft), config), window_offsets)
+
+
+def stft_batch(
+        values: np.ndarray,
+        offsets: np.ndarray,
+        config: DBConfig,
+        window=WINDOW_TYPE
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Carries out the STFT for a batch of vectors at once, with the same result
+    as scipy.signal.stft with default parameters for each of them
+
+    ...
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The concatenated vectors, e.g. the result of get_aa_vectors
+    offsets : np.ndarray
+        The len(vectors) + 1 offsets of the vectors in values
+    config : DBConfig
+        Defines window size and overlap
+    window : str
+        The window type for the STFT (defaults to WINDOW_TYPE)
+
+    Returns
+    -------
+    A tuple of the STFT windows of all vectors one after another, shaped
+    (windows, frequencies), and the len(vectors) + 1 offsets of the windows
+    belonging to each vector
+    """
+
+    window_size = config.window_size
+    step = window_size - config.overlap
+    assert step > 0, "overlap must be less than the window size"
+
+    out_dtype = np.result_type(values, np.complex64)
+    win, scale = get_stft_window(window, window_size, out_dtype)
+
+    # vectors shorter than a window are padded to the window size
+    vec_lens = np.diff(offsets)
+    padded_lens = np.maximum(vec_lens, window_size)
+
+    # scipy extends the vectors with half a window of zeros on both sides,
+    # and appends zeros to fill the last window
+    extended_lens = padded_lens + 2 * (window_size // 2)
+    extended_lens += (-(extended_lens - window_size) % step) % window_size
+    window_counts = (extended_lens - window_size) // step + 1
+
+    # all extended vectors are placed into one flat buffer, so the windows
+    # can be taken from a strided view without padding to a common length
+    extended_starts = np.cumsum(extended_lens) - extended_lens
+    buffer = np.zeros(extended_lens.sum())
+    for start, end, ext_start in zip(offsets[:-1].tolist(), offsets[1:].tolist(), (extended_starts + window_size // 2).tolist()):
+        buffer[ext_start:ext_start + end - start] = values[start:end]
 
-    # executing the STFT
-    stft_result = signal.stft(
-        aa_vec,
-        nperseg=config.window_size,
-        noverlap=config.overlap,
-        window=window
-    )
+    window_offsets = np.zeros(len(vec_lens) + 1, dtype=np.int64)
+    np.cumsum(window_counts, out=window_offsets[1:])
+    window_starts = np.arange(window_offsets[-1]) * step
+    window_starts += np.repeat(extended_starts - window_offsets[:-1] * step, window_counts)
 
-    return stft_to_constellation(*stft_result, config)
+    frames = np.lib.stride_tricks.sliding_window_view(buffer, window_size)
+    stft = np.empty((len(window_starts), window_size // 2 + 1), dtype=out_dtype)
+    win = win.real.astype(frames.dtype)
+
+    # the windows are transformed chunkwise to keep the frame matrix small
+    for chunk in range(0, len(window_starts), STFT_CHUNK_SIZE):
+        chunk_frames = frames[window_starts[chunk:chunk + STFT_CHUNK_SIZE]]
+
+        # scipy multiplies by the complex window and drops the imaginary part,
+        # which is the same as multiplying by its real part
+        chunk_frames *= win
+        chunk_stft = fft.rfft(chunk_frames, axis=-1)
+        chunk_stft *= scale
+        stft[chunk:chunk + STFT_CHUNK_SIZE] = chunk_stft
+
+    return stft, window_offsets
+
+
+@lru_cache(maxsize=None)
+def get_stft_window(window: str, window_size: int, dtype: np.dtype) -> Tuple[np.ndarray, np.number]:
+    win = signal.get_window(window, window_size)
+    if np.result_type(win, np.complex64) != dtype:
+        win = win.astype(dtype)
+
+    return win, np.sqrt(1.0 / win.sum()**2)
 
 
 def stft_to_constellation(
@@ -185,47 +294,115 @@ def stft_to_constellation(
         window_indexes: np.ndarray,
         stft: np.ndarray,
         config: DBConfig
-        ) -> ConstellationMap:
-    constellation_map: ConstellationMap = []
+        ) -> Constellation:
+    # get rid of complex values to make them comparable
+    spectra: np.ndarray = abs(stft.T)
 
-    # find and collect the most prominent frequencies from STFT per window
-    for amplitudes in stft.T:
+    return Constellation(spectra_to_peaks(spectra, config), len(spectra))
 
-        # get rid of complex values to make them comparable
-        spectrum: np.ndarray = abs(amplitudes)
 
-        peaks: List[Tuple[int, int]] = find_peaks(spectrum, config)
+def spectra_to_peaks(spectra: np.ndarray, config: DBConfig) -> np.ndarray:
+    # find and collect the most prominent frequencies from STFT for all windows
+    windows, freq_idx, quantiles = find_peaks_2d(spectra, config)
 
-        constellation_map.append(tuple((int(freq_idx), float(spectrum[freq_idx]), quantile) for freq_idx, quantile in peaks))
+    peaks = np.empty(len(windows), dtype=CONSTELLATION_DTYPE)
+    peaks["window"] = windows
+    peaks["freq"] = freq_idx
+    peaks["amplitude"] = spectra[windows, freq_idx]
+    peaks["quantile"] = quantiles
 
-    return constellation_map
+    return peaks
 
 
 def find_peaks(spectrum: np.ndarray, config: DBConfig) -> List[Tuple[int, int]]:
+    _, freq_idx, quantiles = find_peaks_2d(spectrum[np.newaxis], config)
+    return list(zip(freq_idx.tolist(), quantiles.tolist()))
+
+
+def find_peaks_2d(spectra: np.ndarray, config: DBConfig) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Selects the peaks of the spectra of many STFT windows at once
+
+    ...
+
+    Parameters
+    ----------
+    spectra : np.ndarray
+        The absolute STFT amplitudes, shaped (windows, frequencies)
+    config : DBConfig
+        Defines the selection of the peaks
+
+    Returns
+    -------
+    The window indexes, frequency indexes and quantile flags of the selected
+    peaks, ordered by window and, inside of a window, descending by their
+    deviation from the quantile
+    """
+
     lower, upper = sorted((config.significance, 100 - config.significance))
-    peaks = []
+    quantiles = AMPL_QUANTILES[config.window_size]
 
+    windows, freq_idx, deviations, quantile_flags = [], [], [], []
     for quantile, (tail, op, spectrum_mult) in enumerate(((upper, gt, 1), (lower, lt, -1))):
-        quantile_deviations = abs(spectrum - AMPL_QUANTILES[config.window_size][tail]) / AMPL_QUANTILES[config.window_size]["std_dev"]
+        quantile_deviations = abs(spectra - np.array(quantiles[tail])) / np.array(quantiles["std_dev"])
 
         if config.selection_method == "none":
-            peak_idx = list(range(len(spectrum)))
+            selection = np.ones(spectra.shape, dtype=bool)
         elif config.selection_method == "deviation":
-            peak_idx, _ = signal.find_peaks(quantile_deviations)
+            selection = local_maxima_2d(quantile_deviations)
         elif config.selection_method == "absolute":
-            peak_idx, _ = signal.find_peaks(spectrum * spectrum_mult)
+            selection = local_maxima_2d(spectra * spectrum_mult)
 
-        tail_idx = np.argwhere(op(spectrum, AMPL_QUANTILES[config.window_size][tail])).flatten()
-        selection_idx = np.intersect1d(tail_idx, peak_idx)
+        selection &= op(spectra, np.array(quantiles[tail]))
 
-        if not len(selection_idx):
-            continue
+        tail_windows, tail_freq_idx = np.nonzero(selection)
+        windows.append(tail_windows)
+        freq_idx.append(tail_freq_idx)
+        deviations.append(quantile_deviations[selection])
+        quantile_flags.append(np.full(len(tail_windows), quantile))
 
-        selected_deviations = quantile_deviations[selection_idx]
-        peaks += [*zip(selected_deviations.tolist(), selection_idx.tolist(), [quantile] * len(selected_deviations))]
+    windows, freq_idx, deviations, quantile_flags = map(np.concatenate, (windows, freq_idx, deviations, quantile_flags))
 
-    peaks = sorted(peaks, reverse=True)
+    # descending by deviation, frequency index and quantile per window
+    order = np.lexsort((-quantile_flags, -freq_idx, -deviations, windows))
+    windows, freq_idx, quantile_flags = windows[order], freq_idx[order], quantile_flags[order]
+
+    keep = freq_idx >= config.skip_first_k_freqs
     if config.n_peaks:
-        peaks = peaks[:config.n_peaks]
+        window_starts = np.searchsorted(windows, windows)
+        keep &= np.arange(len(windows)) - window_starts < config.n_peaks
+
+    return windows[keep], freq_idx[keep], quantile_flags[keep]
+
+
+def local_maxima_2d(x: np.ndarray) -> np.ndarray:
+    """
+    Finds the local maxima in each row of x, like scipy.signal.find_peaks
+    without further conditions does for a single one, so for flat peaks the
+    middle index (rounded down) is taken
+
+    Returns
+    -------
+    A boolean mask of the shape of x marking the peaks
+    """
+
+    peaks = np.zeros(x.shape, dtype=bool)
+    cols = x.shape[1]
+    if cols < 3:
+        return peaks
+
+    # runs of equal values, every row begins a new one
+    run_start_mask = np.ones(x.shape, dtype=bool)
+    run_start_mask[:, 1:] = x[:, 1:] != x[:, :-1]
+    run_starts = np.flatnonzero(run_start_mask)
+    run_ends = np.append(run_starts[1:], x.size) - 1
+
+    # a run is a peak if it is enclosed by smaller values in its row
+    flat = x.ravel()
+    inner = (run_starts % cols > 0) & (run_ends % cols < cols - 1)
+    run_starts, run_ends = run_starts[inner], run_ends[inner]
+    is_peak = (flat[run_starts - 1] < flat[run_starts]) & (flat[run_ends + 1] < flat[run_starts])
+
+    peaks.ravel()[(run_starts[is_peak] + run_ends[is_peak]) // 2] = True
 
-    return [(idx, q) for _, idx, q in peaks if not idx < config.skip_first_k_freqs]
+    return peaks
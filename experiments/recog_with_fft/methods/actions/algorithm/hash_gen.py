@@ -1,14 +1,60 @@
 from tools import *
 from os import environ as env
+from functools import lru_cache
 
-FREQUENCY_BITS = 5
-DIFFERENCE_BITS = 3
+FREQUENCY_BITS = HASH_LAYOUT.bits("freq")
+DIFFERENCE_BITS = HASH_LAYOUT.bits("diff")
+
+
+@lru_cache
+def hash_layout(config: DBConfig) -> HashLayout:
+    """
+    Sizes the hash layout to the database configuration
+
+    The frequency fields get as many bits as the frequency indexes of the
+    window size need, at least FREQUENCY_BITS, and the window distance covers
+    all windows overlapping the anchor's one, at least 2**DIFFERENCE_BITS - 1,
+    so the default configuration keeps HASH_LAYOUT. With amplitude_bits, the
+    amplitudes of the paired peaks are compared, for more selective hashes.
+    The hashes are stored in the narrowest of 32 and 64 bit holding them,
+    which mustn't exceed the configuration's hash_width.
+
+    ...
+
+    Parameters
+    ----------
+    config : DBConfig
+        The configuration the hashes are generated for
+
+    Returns
+    -------
+    The HashLayout to generate the hashes with
+    """
+
+    freq_bits = max(FREQUENCY_BITS, (config.window_size // 2 + 1).bit_length())
+    # the later windows overlapping a window
+    step = max(1, config.window_size - config.overlap)
+    overlapping_windows = -(-config.window_size // step) - 1
+
+    fields = [("kidera_factor", 4), ("quantile", 1), ("other_quantile", 1)]
+    if config.amplitude_bits:
+        fields.append(("amplitude_ratio", config.amplitude_bits))
+    fields += [
+        ("diff", max(DIFFERENCE_BITS, overlapping_windows.bit_length())),
+        ("other_freq", freq_bits),
+        ("freq", freq_bits)
+    ]
+
+    layout = HashLayout(fields)
+    assert layout.width <= config.hash_width, "The hashes need %s bit, more than the hash width of %s" % (layout.bits(), config.hash_width)
+    return layout
 
 
 def create_hashes(
-        constellation_map: ConstellationMap,
+        constellation_map: Union[Constellation, ConstellationMap],
         prot_id: ProteinID,
-        kidera_factor: int
+        kidera_factor: int,
+        layout=HASH_LAYOUT
         ) -> Tuple[Hashes, HashCounts]:
     """
     Creates combinatorial Hashes from a constellation map for efficient
@@ -18,44 +64,240 @@ def create_hashes(
 
     Parameters
     ----------
-    constellation_map : ConstellationMap
-        A list of coordinates, index-frequency pairs, the result of the STFT
+    constellation_map : Constellation | ConstellationMap
+        The coordinates, index-frequency pairs, the result of the STFT
         in create_constellation. It is assumed as pre-sorted by index
     prot_id : ProteinID
         The identifier for the protein the hashes are generated for. If it is
         unknown, just pass a custom
+    layout : HashLayout, optional
+        The bit layout of the hashes
 
     Returns
     -------
     A dictionary of hashes pointing to the index of their occurence
     """
 
-    hashes: Hashes = {}
-
-    position_counts = {}
-
-    # Iterate through the constellation map
-    for idx, freqs in enumerate(constellation_map):
-        occ = (idx, prot_id)
-        # Iterate through the next pairs to produce combinatorial hashes
-        for freq, _, quantile in freqs:
-            hash_count = len(hashes)
-
-            def add_hash(diff, other_freq, other_quantile):
-                hash_: Hash = create_hash((kidera_factor, 4), (quantile, 1), (other_quantile, 1), (diff, DIFFERENCE_BITS), (other_freq, FREQUENCY_BITS), (freq, FREQUENCY_BITS))
-                hashes[hash_] = occ
-                position_counts[hash_] = position_counts.get(hash_, 0) + 1
-
-            for diff, other_freqs in enumerate(constellation_map[idx + 1:idx + 2**DIFFERENCE_BITS]):
-                for other_freq, _, other_quantile in other_freqs:
-                    # Produce a 32 bit hash
-                    add_hash(diff, other_freq, other_quantile)
-            if len(hashes) == hash_count:  # -> no hashes created for the quantile's frequency -> combining with foo frequency
-                other_freq = 2 ** FREQUENCY_BITS - 1
-                other_quantile = 0
-                diff = 0
-                add_hash(diff, other_freq, other_quantile)
-    return hashes, position_counts
+    constellation = as_constellation(constellation_map)
+    batch = ConstellationBatch(constellation.peaks, np.array([0, constellation.window_count]))
+
+    hashes, windows, _ = create_hash_arrays(batch, kidera_factor, layout)
+    hashes, windows, counts, _ = dedupe_hashes(hashes, windows)
+
+    hashes = hashes.tolist()
+    position_counts: HashCounts = dict(zip(hashes, counts.tolist()))
+    return dict(zip(hashes, ((window, prot_id) for window in windows.tolist()))), position_counts
+
+
+def create_hash_arrays(
+        constellations: ConstellationBatch,
+        kidera_factor: int,
+        layout=HASH_LAYOUT
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Creates the combinatorial hashes for a batch of constellations at once
+
+    Each peak is combined with all peaks of the next 2**bits - 1 windows of
+    its sequence, by the bits of the layout's window distance field. If that
+    doesn't add a hash the sequence didn't have yet, the peak is combined
+    with a dummy frequency instead.
+
+    ...
+
+    Parameters
+    ----------
+    constellations : ConstellationBatch
+        The constellations of the sequences, e.g. from create_constellations
+    kidera_factor : int
+        The Kidera factor the constellations are created for
+    layout : HashLayout, optional
+        The bit layout of the hashes
+
+    Returns
+    -------
+    The hashes in the order create_hashes generates them, including
+    duplicates, the window indexes of their anchor peaks inside of their
+    sequences, and the len(batch) + 1 offsets of the hashes per sequence
+    """
+
+    peaks = constellations.peaks
+    window_offsets = constellations.window_offsets
+    windows = peaks["window"].astype(np.int64)
+    dummy_freq = 2**layout.bits("other_freq") - 1
+    assert np.all(peaks["freq"] < dummy_freq), "frequency index collides with the dummy frequency"
+
+    # the sequence of each peak, and the range of its target peaks
+    seq_idx = np.searchsorted(window_offsets, windows, side="right") - 1
+    target_starts = np.searchsorted(windows, windows + 1)
+    target_ends = np.searchsorted(windows, np.minimum(windows + 2**layout.bits("diff"), window_offsets[seq_idx + 1]))
+    target_counts = target_ends - target_starts
+
+    # all anchor-target pairs, ordered by anchor and target
+    pair_offsets = np.cumsum(target_counts)
+    anchors = np.repeat(np.arange(len(peaks)), target_counts)
+    targets = np.arange(pair_offsets[-1] if len(peaks) else 0) - np.repeat(pair_offsets - target_counts - target_starts, target_counts)
+
+    pair_fields = dict(
+        kidera_factor=kidera_factor,
+        quantile=peaks["quantile"][anchors],
+        other_quantile=peaks["quantile"][targets],
+        diff=windows[targets] - windows[anchors] - 1,
+        other_freq=peaks["freq"][targets],
+        freq=peaks["freq"][anchors]
+    )
+    if "amplitude_ratio" in layout:
+        pair_fields["amplitude_ratio"] = amplitude_ratios(peaks["amplitude"][anchors], peaks["amplitude"][targets], layout.bits("amplitude_ratio"))
+    pair_hashes = layout.pack(**pair_fields)
+
+    # anchors that create no hash their sequence doesn't have yet get a dummy
+    first = first_occurrences(seq_idx[anchors], pair_hashes)
+    has_new_hash = np.zeros(len(peaks), dtype=bool)
+    has_new_hash[anchors[first]] = True
+    dummies = np.flatnonzero(~has_new_hash)
+    dummy_fields = dict(
+        kidera_factor=kidera_factor,
+        quantile=peaks["quantile"][dummies],
+        other_quantile=0,
+        diff=0,
+        other_freq=dummy_freq,
+        freq=peaks["freq"][dummies]
+    )
+    if "amplitude_ratio" in layout:
+        dummy_fields["amplitude_ratio"] = 0
+    dummy_hashes = layout.pack(**dummy_fields)
+
+    # merge pairs and dummies, a dummy directly follows the pairs of its anchor
+    dummies_before = np.cumsum(~has_new_hash) - ~has_new_hash
+    hashes = np.empty(len(pair_hashes) + len(dummies), dtype=layout.dtype)
+    anchor_idx = np.empty(len(hashes), dtype=np.int64)
+    pair_pos = np.arange(len(pair_hashes)) + dummies_before[anchors]
+    dummy_pos = pair_offsets[dummies] + dummies_before[dummies]
+    hashes[pair_pos], anchor_idx[pair_pos] = pair_hashes, anchors
+    hashes[dummy_pos], anchor_idx[dummy_pos] = dummy_hashes, dummies
+
+    hash_offsets = np.zeros(len(window_offsets), dtype=np.int64)
+    np.cumsum(np.bincount(seq_idx[anchor_idx], minlength=len(window_offsets) - 1), out=hash_offsets[1:])
+
+    return hashes, (windows - window_offsets[seq_idx])[anchor_idx].astype(np.uint32), hash_offsets
+
+
+def amplitude_ratios(amplitudes: np.ndarray, other_amplitudes: np.ndarray, bits: int) -> np.ndarray:
+    """
+    Compares the amplitudes of paired peaks by binning the binary logarithm
+    of their ratio, centered around equal amplitudes
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratios = np.floor(np.log2(other_amplitudes / amplitudes))
+    log_ratios = np.nan_to_num(log_ratios, nan=0, posinf=2**bits, neginf=-2**bits)
+    return np.clip(log_ratios + 2**(bits - 1), 0, 2**bits - 1).astype(np.int64)
+
+
+def dedupe_hashes(
+        hashes: np.ndarray,
+        windows: np.ndarray,
+        offsets=None
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reproduces the dictionary semantics of create_hashes for arrays of hashes,
+    optionally for many sequences at once
+
+    ...
+
+    Parameters
+    ----------
+    hashes : np.ndarray
+        The hashes in the order of their generation, e.g. from
+        create_hash_arrays
+    windows : np.ndarray
+        The window index for each hash
+    offsets : np.ndarray, optional
+        The offsets of the hashes per sequence, defaults to a single sequence
+
+    Returns
+    -------
+    The distinct hashes per sequence in order of their first occurrence, the
+    window of their last occurrence, their occurrence counts and the offsets
+    of the distinct hashes per sequence
+    """
+
+    if offsets is None:
+        offsets = np.array([0, len(hashes)])
+    seq_idx = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    first, last, counts = equal_runs(seq_idx, hashes)
+
+    by_first = np.argsort(first)
+    first, last, counts = first[by_first], last[by_first], counts[by_first]
+
+    distinct_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(seq_idx[first], minlength=len(offsets) - 1), out=distinct_offsets[1:])
+
+    return hashes[first], windows[last], counts, distinct_offsets
+
+
+def first_occurrences(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Returns the indexes of the first occurrence of each value per group
+    """
+    first, _, _ = equal_runs(groups, values)
+    return first
+
+
+def equal_runs(groups: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the runs of equal values per group, by sorting the values by group
+    and value
+
+    Returns
+    -------
+    For each run the index of its first and its last occurrence, and its
+    length
+    """
+    if len(values) and values.dtype.kind == "u" and groups.dtype.kind in "ui" and groups.min() >= 0:
+        index_bits = max(1, (len(values) - 1).bit_length())
+        value_bits = max(1, int(values.max()).bit_length())
+        if int(groups.max()).bit_length() + value_bits + index_bits <= 64:
+            return _packed_equal_runs(groups, values, value_bits, index_bits)
+
+    if values.dtype.itemsize <= 4 and values.dtype.kind == "u" and (not len(groups) or groups.max() < 2**32):
+        # sorting combined keys is much faster than lexsort, and as the first
+        # and last occurrences are reduced per run, the sort needn't be stable
+        order = np.argsort(groups.astype(np.uint64) << np.uint64(32) | values)
+    else:
+        order = np.lexsort((values, groups))
+    sorted_values, sorted_groups = values[order], groups[order]
+
+    run_start_mask = np.ones(len(order), dtype=bool)
+    run_start_mask[1:] = (sorted_values[1:] != sorted_values[:-1]) | (sorted_groups[1:] != sorted_groups[:-1])
+    run_starts = np.flatnonzero(run_start_mask)
+    if not len(run_starts):
+        return order, order, order
+
+    first = np.minimum.reduceat(order, run_starts)
+    last = np.maximum.reduceat(order, run_starts)
+    return first, last, np.diff(np.append(run_starts, len(order)))
+
+
+def _packed_equal_runs(groups: np.ndarray, values: np.ndarray, value_bits: int, index_bits: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    equal_runs for keys of group, value and index fitting into 64 bit, sorting
+    the keys themselves instead of their order, which is much faster. As the
+    index is in the lowest bits, the first and last key of each run hold its
+    first and last occurrence
+    """
+    keys = groups.astype(np.uint64) << np.uint64(value_bits + index_bits)
+    keys |= values.astype(np.uint64) << np.uint64(index_bits)
+    keys |= np.arange(len(values), dtype=np.uint64)
+    keys.sort()
+
+    runs = keys >> np.uint64(index_bits)
+    run_start_mask = np.ones(len(keys), dtype=bool)
+    run_start_mask[1:] = runs[1:] != runs[:-1]
+    run_starts = np.flatnonzero(run_start_mask)
+    run_ends = np.append(run_starts[1:], len(keys))
+
+    indexes = (keys & np.uint64(2**index_bits - 1)).astype(np.int64)
+    return indexes[run_starts], indexes[run_ends - 1], run_ends - run_starts
 
 
 def create_hash(*args) -> Hash:
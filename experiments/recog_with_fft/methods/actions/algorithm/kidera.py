@@ -33,7 +33,7 @@ KIDERA_MIN = abs(KIDERA_TABLE.to_numpy().min())
 
 
 def get_aa_vector(
-        seq: str,
+        seq: Union[str, bytes],
         normalize=True,
         ignore_warnings=False
         ) -> np.ndarray:
@@ -41,10 +41,14 @@ def get_aa_vector(
     Transform an amino acid sequence into a concatenated vector of floats from
     the Kidera factor table for all factors.
 
+    The values are taken from the precomputed KIDERA_LOOKUP, so the whole
+    sequence is encoded with one translation into residue codes and one
+    fancy-index into the table.
+
     Parameters
     ----------
-    seq : str
-        The amino acid sequence to be transformed.
+    seq : str or bytes
+        The amino acid sequence to be transformed, bytes only of ASCII letters.
     normalize : bool, optional
         Whether to normalize the values to non-negatives by adding the absolute
         value of the global minimum of the Kidera factor table. Default is True.
@@ -58,23 +62,95 @@ def get_aa_vector(
         all Kidera factors.
     """
 
-    concatenated_sequence = []
+    codes = encode_residues(seq)
 
-    for factor in range(KIDERA_TABLE.shape[0]):
-        sel_factor: pd.Series = KIDERA_TABLE.iloc[factor]
+    if not ignore_warnings:
+        warn_unknown_residues(seq, codes)
 
-        # normalizing to non-negatives by adding the absolute of the global minimum
-        if normalize:
-            sel_factor = sel_factor + KIDERA_MIN + 1
+    return KIDERA_LOOKUP[bool(normalize)][:, codes].ravel()
 
-        # define symbols representing multiple amino acids
-        extend_selected_factor(sel_factor)
 
-        # transform the sequence for this factor
-        transformed_seq = transform_seq(seq, sel_factor, ignore_warnings)
-        concatenated_sequence.extend(transformed_seq)
+def get_aa_vectors(
+        seqs: List[Union[str, bytes]],
+        normalize=True,
+        ignore_warnings=False
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transform a batch of amino acid sequences at once, like get_aa_vector
+    does for a single one.
+
+    ...
+
+    Parameters
+    ----------
+    seqs : List[str or bytes]
+        The amino acid sequences to be transformed, bytes only of ASCII
+        letters, like Fasta yields them without decode.
+    normalize : bool, optional
+        Whether to normalize the values to non-negatives, see get_aa_vector.
+        Default is True.
+    ignore_warnings : bool, optional
+        Whether to suppress warnings for unknown amino acids. Default is False.
+
+    Returns
+    -------
+    A tuple of one contiguous array of 32-bit floats holding the vectors of
+    all sequences one after another, and an array of len(seqs) + 1 offsets,
+    so the vector of the i-th sequence is values[offsets[i]:offsets[i + 1]]
+    """
+
+    seqs = list(seqs)
+    lookup = KIDERA_LOOKUP[bool(normalize)]
+    factor_count = lookup.shape[0]
+
+    seq_lens = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+    seq_starts = np.cumsum(seq_lens) - seq_lens
+    if all(isinstance(seq, bytes) for seq in seqs):
+        codes = encode_residues(b"".join(seqs))
+    else:
+        codes = encode_residues("".join(seq if isinstance(seq, str) else seq.decode() for seq in seqs))
+
+    if not ignore_warnings and not codes.all():
+        for i in np.unique(np.searchsorted(seq_starts, np.flatnonzero(codes == 0), side="right") - 1).tolist():
+            warn_unknown_residues(seqs[i], codes[seq_starts[i]:seq_starts[i] + seq_lens[i]])
+
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum(seq_lens * factor_count, out=offsets[1:])
+
+    # for each value of the output: the sequence it belongs to, and its
+    # factor and residue inside of that sequence's vector
+    seq_idx = np.repeat(np.arange(len(seqs)), seq_lens * factor_count)
+    factor, residue = np.divmod(np.arange(offsets[-1]) - offsets[seq_idx], seq_lens[seq_idx])
+
+    return lookup[factor, codes[seq_starts[seq_idx] + residue]], offsets
+
+
+def encode_residues(seq: Union[str, bytes]) -> np.ndarray:
+    """
+    Translate an amino acid sequence into the residue codes indexing the
+    columns of KIDERA_LOOKUP, unknown amino acids are mapped to code 0.
+    Sequences of ASCII letters given as bytes are looked up as they are
+    """
+    if isinstance(seq, str):
+        if not seq.isascii():
+            seq = seq.translate(_NON_ASCII_TRANSLATION)
+
+        # every character is encoded into exactly one byte, the ones not
+        # representable in latin-1 are replaced by '?', an unknown symbol
+        seq = seq.encode("latin-1", errors="replace")
+
+    return _BYTE_CODES[np.frombuffer(seq, dtype=np.uint8)]
+
 
-    return np.array(concatenated_sequence, dtype=np.float32)
+def warn_unknown_residues(seq: Union[str, bytes], codes: np.ndarray):
+    unknown = np.flatnonzero(codes == 0)
+    if len(unknown):
+        if isinstance(seq, bytes):
+            seq = seq.decode()
+        # one warning per factor and occurrence, like transforming each factor on its own
+        for _ in range(KIDERA_TABLE.shape[0]):
+            for i in unknown.tolist():
+                warn(f"No known values for Kidera factors for {seq[i]} -> treating as zero")
 
 
 def extend_selected_factor(sel_factor: pd.Series):
@@ -109,4 +185,55 @@ def transform_seq(seq, sel_factor, ignore_warnings=False) -> List[np.float32]:
                 warn(f"No known values for Kidera factors for {aa} -> treating as zero")
         transformed_seq.append(np.float32(value))
 
-    return transformed_seq
\ No newline at end of file
+    return transformed_seq
+
+
+def _build_lookup(normalize: bool) -> np.ndarray:
+    factors = []
+    for factor in range(KIDERA_TABLE.shape[0]):
+        sel_factor: pd.Series = KIDERA_TABLE.iloc[factor]
+        if normalize:
+            sel_factor = sel_factor + KIDERA_MIN + 1
+        extend_selected_factor(sel_factor)
+        factors.append(sel_factor)
+
+    # column 0 is reserved for unknown amino acids and stays zero
+    lookup = np.zeros((len(factors), len(KIDERA_SYMBOLS) + 1), dtype=np.float32)
+    for factor, sel_factor in enumerate(factors):
+        lookup[factor, 1:] = [np.float32(sel_factor[aa]) for aa in KIDERA_SYMBOLS]
+
+    return lookup
+
+
+def _build_byte_codes() -> np.ndarray:
+    byte_codes = np.zeros(256, dtype=np.uint8)
+    for code, aa in enumerate(KIDERA_SYMBOLS, 1):
+        if aa.isascii():
+            byte_codes[ord(aa)] = code
+        else:
+            byte_codes[0x80 + _NON_ASCII_SYMBOLS.index(aa)] = code
+
+    return byte_codes
+
+
+# all symbols with known values, including the ones representing multiple
+# amino acids, in the order of the columns of KIDERA_LOOKUP (shifted by one)
+_extended: pd.Series = KIDERA_TABLE.iloc[0].copy()
+extend_selected_factor(_extended)
+KIDERA_SYMBOLS = "".join(_extended.keys())
+del _extended
+
+# the non-ASCII symbols are translated to the upper half of latin-1, every
+# other non-ASCII character becomes unknown
+_NON_ASCII_SYMBOLS = [aa for aa in KIDERA_SYMBOLS if not aa.isascii()]
+_NON_ASCII_TRANSLATION = {
+    **{i: "?" for i in range(0x80, 0x100)},
+    **{ord(aa): chr(0x80 + i) for i, aa in enumerate(_NON_ASCII_SYMBOLS)}
+}
+_BYTE_CODES = _build_byte_codes()
+
+# residue code -> value for each factor, with and without normalization
+KIDERA_LOOKUP = {
+    False: _build_lookup(normalize=False),
+    True: _build_lookup(normalize=True)
+}
@@ -3,6 +3,43 @@ from .kidera import *
 from .hash_gen import *
 from .constellation import *
 from tools import *
+from scipy import signal
+from operator import gt, lt
+import pickle
+
+
+def window_peaks(spectrum: np.ndarray, config: DBConfig) -> List[Tuple[int, int]]:
+    """
+    Selects the peaks of a single STFT window, the way find_peaks did before
+    it was based on find_peaks_2d, as reference for it
+    """
+    lower, upper = sorted((config.significance, 100 - config.significance))
+    peaks = []
+
+    for quantile, (tail, op, spectrum_mult) in enumerate(((upper, gt, 1), (lower, lt, -1))):
+        quantile_deviations = abs(spectrum - AMPL_QUANTILES[config.window_size][tail]) / AMPL_QUANTILES[config.window_size]["std_dev"]
+
+        if config.selection_method == "none":
+            peak_idx = list(range(len(spectrum)))
+        elif config.selection_method == "deviation":
+            peak_idx, _ = signal.find_peaks(quantile_deviations)
+        elif config.selection_method == "absolute":
+            peak_idx, _ = signal.find_peaks(spectrum * spectrum_mult)
+
+        tail_idx = np.argwhere(op(spectrum, AMPL_QUANTILES[config.window_size][tail])).flatten()
+        selection_idx = np.intersect1d(tail_idx, peak_idx)
+
+        if not len(selection_idx):
+            continue
+
+        selected_deviations = quantile_deviations[selection_idx]
+        peaks += [*zip(selected_deviations.tolist(), selection_idx.tolist(), [quantile] * len(selected_deviations))]
+
+    peaks = sorted(peaks, reverse=True)
+    if config.n_peaks:
+        peaks = peaks[:config.n_peaks]
+
+    return [(idx, q) for _, idx, q in peaks if not idx < config.skip_first_k_freqs]
 
 
 class TestKidera(TestCase):
@@ -31,11 +68,127 @@ class TestKidera(TestCase):
         for aa, val in zip(seq, transformed_seq):
             self.assertEqual(val, np.float32(extended.get(aa, np.float32(0))), "Sequence falsey transformed")
 
+    def test_get_aa_vector(self):
+        seq = "ACDXBZJΨΩΦζΠ+-OU" + "234567"  # numbers represent unknown amino acids
+        for normalize in (True, False):
+            expected = []
+            for factor in range(KIDERA_TABLE.shape[0]):
+                sel_factor = KIDERA_TABLE.iloc[factor]
+                if normalize:
+                    sel_factor = sel_factor + KIDERA_MIN + 1
+                extend_selected_factor(sel_factor)
+                expected.extend(transform_seq(seq, sel_factor, True))
+
+            aa_vec = self.create_valid(
+                np.ndarray,
+                get_aa_vector(seq, normalize, ignore_warnings=True)
+            )
+            self.assertEqual(aa_vec.dtype, np.float32, "Expected 32 bit floats")
+            self.assertTrue(np.array_equal(aa_vec, np.array(expected, dtype=np.float32)), "Sequence falsey transformed")
+
+    def test_get_aa_vectors(self):
+        seqs = ["ACDX", "", "Ψ+O", "MKLVA"]
+        values, offsets = self.create_valid(
+            Tuple[np.ndarray, np.ndarray],
+            get_aa_vectors(seqs, ignore_warnings=True)
+        )
+        self.assertEqual(len(offsets), len(seqs) + 1, "Expected an offset per sequence and the end")
+        self.assertEqual(offsets[-1], len(values), "Offsets don't cover the values")
+        for i, seq in enumerate(seqs):
+            self.assertTrue(
+                np.array_equal(values[offsets[i]:offsets[i + 1]], get_aa_vector(seq, ignore_warnings=True)),
+                "Batch transformed differently than single sequence"
+            )
+
+        # ASCII sequences as bytes, alone or along with str ones
+        for batch in ([seq.encode() for seq in seqs if seq.isascii()], [seq.encode() if seq.isascii() else seq for seq in seqs]):
+            expected = get_aa_vectors([seq.decode() if isinstance(seq, bytes) else seq for seq in batch], ignore_warnings=True)
+            for array, expected_array in zip(get_aa_vectors(batch, ignore_warnings=True), expected):
+                self.assertTrue(np.array_equal(array, expected_array), "Bytes transformed differently than str")
+
 
 class TestConstellation(TestCase):
     def test_find_peaks(self):
         ...
 
+    def test_find_peaks_2d(self):
+        window_size = 30
+        lower, upper = (np.array(AMPL_QUANTILES[window_size][tail]) for tail in (5, 95))
+
+        # amplitudes beyond both quantiles, rounded to also get flat peaks
+        rng = np.random.default_rng(0)
+        spectra = np.round(5 * (lower + (upper - lower) * rng.uniform(-.5, 1.5, (100, len(lower))))) / 5
+
+        for selection_method in ("none", "deviation", "absolute"):
+            for n_peaks, skip_first_k_freqs in ((0, 0), (2, 0), (0, 2), (3, 1)):
+                config = DBConfig(
+                    window_size=window_size, n_peaks=n_peaks, selection_method=selection_method,
+                    skip_first_k_freqs=skip_first_k_freqs
+                )
+                windows, freq_idx, quantiles = self.create_valid(
+                    Tuple[np.ndarray, np.ndarray, np.ndarray],
+                    find_peaks_2d(spectra, config)
+                )
+                self.assertEqual(set(quantiles.tolist()), {0, 1}, "Expected peaks of both quantiles")
+                for window, spectrum in enumerate(spectra):
+                    selected = windows == window
+                    self.assertEqual(
+                        list(zip(freq_idx[selected].tolist(), quantiles[selected].tolist())),
+                        window_peaks(spectrum, config),
+                        "Peaks of window differ from single window selection with %s" % (config,)
+                    )
+
+    def test_create_constellations(self):
+        config = DBConfig(window_size=10, overlap=5)
+        seqs = ["MKLVAGHEDWWY" * 3, "ACD", ""]
+        batch = self.create_valid(
+            ConstellationBatch,
+            create_constellations(*get_aa_vectors(seqs, ignore_warnings=True), config)
+        )
+        constellations = batch.split()
+        self.assertEqual(len(constellations), len(seqs), "Expected a constellation per sequence")
+        for seq, constellation in zip(seqs, constellations):
+            expected = create_constellation(get_aa_vector(seq, ignore_warnings=True), config)
+            self.assertEqual(constellation.window_count, expected.window_count, "Different window counts")
+            self.assertTrue(np.array_equal(constellation.peaks, expected.peaks), "Different peaks in batch")
+
+            constellation_map = self.create_valid(
+                ConstellationMap,
+                expected.to_map()
+            )
+            self.assertEqual(len(constellation_map), expected.window_count, "Tuple view misses windows")
+            self.assertTrue(np.array_equal(Constellation.from_map(constellation_map).peaks, expected.peaks), "Tuple view is lossy")
+
+    def test_local_maxima_2d(self):
+        x = np.array([
+            [0, 1, 0, 2, 2, 0, 3, 3],
+            [1, 1, 2, 2, 2, 1, 0, 1]
+        ])
+        peaks = self.create_valid(
+            np.ndarray,
+            local_maxima_2d(x)
+        )
+        for row, row_peaks in zip(x, peaks):
+            expected, _ = signal.find_peaks(row)
+            self.assertEqual(np.flatnonzero(row_peaks).tolist(), expected.tolist(), "Peaks differ from scipy")
+
+    def test_stft_batch(self):
+        config = DBConfig(window_size=10, overlap=7)
+        values, offsets = get_aa_vectors(["MKLVAGHEDWWY" * 3, "ACD", ""], ignore_warnings=True)
+        stft, window_offsets = self.create_valid(
+            Tuple[np.ndarray, np.ndarray],
+            stft_batch(values, offsets, config)
+        )
+        self.assertEqual(len(window_offsets), len(offsets), "Expected window offsets per vector")
+        for i in range(len(offsets) - 1):
+            aa_vec = values[offsets[i]:offsets[i + 1]]
+            aa_vec = np.pad(aa_vec, (0, max(0, config.window_size - len(aa_vec))))
+            *_, expected = signal.stft(aa_vec, nperseg=config.window_size, noverlap=config.overlap, window=WINDOW_TYPE)
+            self.assertTrue(
+                np.array_equal(stft[window_offsets[i]:window_offsets[i + 1]].T, expected),
+                "STFT differs from scipy"
+            )
+
 
 class TestHashGen(TestCase):
     def test_create_hash(self):
@@ -67,3 +220,66 @@ class TestHashGen(TestCase):
         for i, expected_hash in enumerate(expected_hashes):
             self.assertIn(expected_hash, hashes, "Wrong hash")
             self.assertEqual(hashes[expected_hash], (i, ProteinID()))
+
+    def test_create_hash_arrays(self):
+        config = DBConfig(window_size=10, overlap=5)
+        seqs = ["MKLVAGHEDWWY" * 3, "ACD", "", "WWWWWWWWWWWWWWWWWWWWW"]
+        constellations = create_constellations(*get_aa_vectors(seqs, ignore_warnings=True), config)
+        hashes, windows, offsets = self.create_valid(
+            Tuple[np.ndarray, np.ndarray, np.ndarray],
+            create_hash_arrays(constellations, 0)
+        )
+        self.assertEqual(hashes.dtype, np.uint32, "Expected 32 bit hashes")
+        self.assertEqual(len(offsets), len(seqs) + 1, "Expected hash offsets per sequence")
+
+        distinct, last_windows, counts, distinct_offsets = dedupe_hashes(hashes, windows, offsets)
+        for i, constellation in enumerate(constellations.split()):
+            expected_hashes, expected_counts = create_hashes(constellation, ProteinID(), 0)
+            seq_hashes = slice(distinct_offsets[i], distinct_offsets[i + 1])
+            self.assertEqual(distinct[seq_hashes].tolist(), list(expected_hashes), "Different hashes or order")
+            self.assertEqual(last_windows[seq_hashes].tolist(), [idx for idx, _ in expected_hashes.values()], "Not the last occurrence")
+            self.assertEqual(counts[seq_hashes].tolist(), list(expected_counts.values()), "Wrong hash counts")
+
+    def test_hash_layout(self):
+        layout = self.create_valid(
+            HashLayout,
+            HashLayout((("a", 10), ("b", 20)))
+        )
+        hashes = layout.pack(a=np.array([10, 0, 1]), b=20)
+        self.assertEqual(hashes.dtype, np.uint32, "Expected 32 bit hashes")
+        self.assertEqual(hashes[0], create_hash((10, 10), (20, 20)), "Falsey hash creation")
+        self.assertEqual(layout.unpack(hashes, "a").tolist(), [10, 0, 1], "Falsey hash decoding")
+        self.assertEqual(layout.unpack_all(hashes)["b"].tolist(), [20] * 3, "Falsey hash decoding")
+        self.assertEqual(pickle.loads(pickle.dumps(layout)), layout, "Layout changed by pickling")
+
+        self.assertRaisesRegex(AssertionError, "exceeds 32 bit", HashLayout, (("a", 33),), 32)
+        self.assertRaisesRegex(AssertionError, "too big for 10 bit", layout.pack, a=2**10, b=0)
+        self.assertEqual(HashLayout((("a", 33),)).width, 64, "Expected the narrowest width holding the fields")
+        self.assertEqual(HashLayout((("a", 33),)).pack(a=2**32), 2**32, "Falsey 64 bit hash creation")
+        self.assertEqual(layout.bits(), 30, "Falsey bits of all fields")
+
+    def test_hash_layout_for_config(self):
+        self.assertEqual(hash_layout(DBConfig()), HASH_LAYOUT, "Default configuration changes the hash layout")
+
+        seq = "MKLVAGHEDWWYACDEFGHIKLMNPQRSTVWY" * 8
+        for amplitude_bits in (0, 2):
+            config = DBConfig(window_size=100, overlap=90, amplitude_bits=amplitude_bits)
+            layout = self.create_valid(
+                HashLayout,
+                hash_layout(config)
+            )
+            self.assertEqual(layout, hash_layout(config._replace(hash_width=64)), "Hash width changes the layout")
+            self.assertEqual(layout.dtype, np.uint32, "Expected 32 bit hashes for 32 bit layouts")
+            self.assertEqual("amplitude_ratio" in layout, bool(amplitude_bits), "Amplitude comparison not configured")
+            self.assertGreaterEqual(2**layout.bits("freq") - 1, config.window_size // 2 + 1, "Frequency bits too small for window")
+            self.assertGreater(layout.bits("diff"), DIFFERENCE_BITS, "Expected window distances of all overlapping windows")
+
+            constellation = create_constellation(get_aa_vector(seq, ignore_warnings=True), config)
+            hashes, _ = create_hashes(constellation, ProteinID(), 0, layout)
+            decoded = layout.unpack(list(hashes), "freq")
+            self.assertEqual(set(decoded.tolist()), set(constellation.peaks["freq"].tolist()), "Frequencies not decodable")
+
+        # wider layouts need 64 bit hashes
+        config = DBConfig(window_size=100, overlap=90, amplitude_bits=16)
+        self.assertRaisesRegex(AssertionError, "more than the hash width of 32", hash_layout, config)
+        self.assertEqual(hash_layout(config._replace(hash_width=64)).dtype, np.uint64, "Expected 64 bit hashes")
@@ -0,0 +1,122 @@
+from tools import *
+from .find_matches import get_filtered_db, share_db
+from scipy import sparse
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+from functools import partial
+import csv
+import sys
+
+TILE_SIZE = 256  # proteins whose similarities are computed at once
+EDGE_COLUMNS = ("Protein_ID", "Match_Protein_ID", "Intersection", "JSI")
+
+
+def all_vs_all(
+        db_in: str,
+        filter_quantile=1.0,
+        min_jsi=0.,
+        cpu_count=1,
+        tile_size=TILE_SIZE
+        ):
+    """
+    Compares all proteins of the database with each other and prints the
+    pairs sharing hashes to stdout, as an edge list of the similarity graph
+    with the number of shared hashes and the Jaccard Similarity Index
+
+    The shared hashes of all pairs are the product of the protein x hash
+    incidence matrix of the database with its transpose. It is computed in
+    tiles of tile_size proteins against all others, by cpu_count processes,
+    and only the pairs of a protein with the ones after it are printed
+
+    ...
+
+    Parameters
+    ----------
+    db_in : str
+        Name of the file storing the trained database
+    filter_quantile : float
+        Quantile of hashes to be kept in database
+    min_jsi : float, optional
+        The minimal JSI of the pairs to be printed
+    cpu_count : int, optional
+        The number of processes computing the tiles
+    tile_size : int, optional
+        The number of proteins compared with all others at once
+    """
+    assert filter_quantile > 0 and filter_quantile <= 1
+    assert cpu_count > 0, "cpu count must be positive"
+    assert tile_size > 0, "tile size must be positive"
+
+    database, _ = get_filtered_db(db_in, filter_quantile)
+    protein_ids = database.lookup.ids
+    tiles = range(0, len(protein_ids), tile_size)
+    compare_tile = partial(tile_edges, tile_size=tile_size, min_jsi=min_jsi)
+
+    out = csv.writer(sys.stdout, lineterminator="\n")
+    out.writerow(EDGE_COLUMNS)
+
+    with TemporaryDirectory() as tmp_dir:
+        if cpu_count == 1:
+            _init_worker(database)
+            pool = None
+            edge_tiles = map(compare_tile, tiles)
+        else:
+            # the workers memory-map the database, like the ones of find_matches
+            pool = Pool(cpu_count, _init_worker, (share_db(database, db_in, filter_quantile, tmp_dir),))
+            edge_tiles = pool.imap(compare_tile, tiles)
+        del database
+
+        try:
+            for proteins, match_proteins, intersection_cardinality, jsi in tqdm(edge_tiles, total=len(tiles)):
+                out.writerows(zip(
+                    protein_ids[proteins].tolist(),
+                    protein_ids[match_proteins].tolist(),
+                    intersection_cardinality.tolist(),
+                    ("%g" % value for value in jsi.tolist())
+                ))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+
+def tile_edges(first: int, tile_size=TILE_SIZE, min_jsi=0.) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compares the tile of proteins starting at first with the proteins after
+    each of them, using the incidence matrix of the worker process
+
+    Returns
+    -------
+    The protein indexes of the pairs reaching min_jsi, ordered by protein and
+    match, their number of shared hashes and their Jaccard Similarity Index
+    """
+    incidence, transposed, hash_counts = _worker_matrices
+    last = min(first + tile_size, incidence.shape[0])
+
+    # the shared hashes of the tile's proteins with the proteins from the tile
+    # on, the ones before it were compared to the tile by their own tiles
+    shared = incidence[first:last] @ transposed[:, first:]
+    shared.sort_indices()
+    shared = shared.tocoo()
+
+    proteins = shared.row.astype(np.int64) + first
+    match_proteins = shared.col.astype(np.int64) + first
+    intersection_cardinality = shared.data.astype(np.int64)
+
+    jsi = intersection_cardinality / (hash_counts[proteins] + hash_counts[match_proteins] - intersection_cardinality)
+    keep = (match_proteins > proteins) & (jsi >= min_jsi)
+    return proteins[keep], match_proteins[keep], intersection_cardinality[keep], jsi[keep]
+
+
+# the incidence matrix, its transpose and the hash counts of the proteins of
+# a worker process' database, set by _init_worker
+_worker_matrices: Tuple[sparse.csr_matrix, sparse.csr_matrix, np.ndarray] = None
+
+
+def _init_worker(db: Union[DB, str]):
+    global _worker_matrices
+    if isinstance(db, str):
+        db = load_db(db)
+
+    incidence = db.db.incidence()
+    _worker_matrices = incidence, incidence.T.tocsr(), incidence.getnnz(axis=1).astype(np.int64)
+
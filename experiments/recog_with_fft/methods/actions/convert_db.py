@@ -0,0 +1,21 @@
+from tools import *
+
+
+def convert_db(db_in: str, db_out: str):
+    """
+    Converts a database between the pickled and the memory-mapped format,
+    also upgrading databases written by previous versions
+
+    ...
+
+    Parameters
+    ----------
+    db_in : str
+        Name of the file or directory storing the database
+    db_out : str
+        Name of the file or directory to write the database to, a directory
+        of memory-mappable arrays unless it ends with '.pickle'
+    """
+    assert os.path.abspath(db_in) != os.path.abspath(db_out), "Can't convert a database in place"
+
+    save_db(load_db(db_in), db_out)
@@ -1,15 +1,16 @@
 from tools import *
-from .algorithm import hashes_from_seq
+from .algorithm import hashes_from_seqs, hash_layout
 from multiprocessing import Pool
-from sys import getsizeof as objsize
-from os.path import getsize as filesize
-import pickle
+from itertools import islice
+
+CHUNK_SIZE = 256  # sequences hashed at once
 
 
 def create_db(
         prot_file: str,
         db_out: str,
         cpu_count=1,
+        sketch_size=0,
         **kwargs
         ):
     """
@@ -25,61 +26,85 @@ def create_db(
         The path to the FASTA formatted file containing all train sequences of
         known protein sequences
     db_out : str
-        Name of the file to write the databases to
+        Name of the file to write the databases to, a directory of
+        memory-mappable arrays unless it ends with '.pickle'
+    cpu_count : int, optional
+        The number of processes hashing the sequences
+    sketch_size : int, optional
+        The number of MinHash values sketching the hash set of each protein,
+        used by find_matches with lsh_bands. 0 for no sketches
     """
+    assert sketch_size >= 0, "sketch size must not be negative"
     db_config = DBConfig(**kwargs)
 
-    fasta = Fasta(prot_file)
+    fasta = Fasta(prot_file, persist_index=True, decode=False)
 
     if cpu_count > 1:
+        # contiguous ranges of records, so each process reads its own part of the file
+        first, *others = fasta.split(cpu_count)
         with Pool(cpu_count - 1) as p:
-            subprocesses = p.map_async(_process, ((fasta, slice(i, None, cpu_count, db_config)) for i in range(1, cpu_count)))
-            database, protein_lookup = _process((fasta, slice(0, None, cpu_count, db_config)))
-
-            for sub_db, sub_lookup in subprocesses.get():
-                protein_lookup = {**protein_lookup, **sub_lookup}
-
-                for hash_, occs in sub_db.items():
-                    if hash_ not in database:
-                        database[hash_] = occs
-                    else:
-                        database[hash_].extend(occs)
+            subprocesses = p.map_async(_process, ((fasta, slc, db_config) for slc in others))
+            postings = [_process((fasta, first, db_config))]
+            postings.extend(subprocesses.get())
 
     else:
-        database, protein_lookup = _process((fasta, slice(None), db_config))
+        postings = [_process((fasta, slice(None), db_config))]
+
+    database, protein_lookup = _build_index(postings)
+    if sketch_size:
+        database.sketch(sketch_size)
 
     # write the databases into files
-    with open(db_out, 'wb') as db:
-        pickle.dump(DB(database, protein_lookup, db_config), db, pickle.HIGHEST_PROTOCOL)
+    save_db(DB(database, protein_lookup, db_config, hash_layout(db_config)), db_out)
 
 
-def _process(args) -> Tuple[Database, ProteinLookup]:
+def _process(args) -> Tuple[List[ProteinID], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     fasta, slc, db_config = args
-    cores = slc.indices(1)[-1]
+    layout = hash_layout(db_config)
 
-    database: Database = {}
-    protein_lookup: ProteinLookup = {}
+    prot_ids: List[ProteinID] = []
+    seq_lens: List[int] = []
+    hashes = [np.array([], dtype=layout.dtype)]
+    windows = [np.array([], dtype=np.uint32)]
+    hash_counts = [np.array([], dtype=np.int64)]
 
-    fasta_size = filesize(fasta.file_name)
+    # train the database with hashes pointing to their matching proteins,
+    # generating the combinatorial hashes for many sequences at once
+    entries = iter(fasta[slc])
+    while (chunk := list(islice(entries, CHUNK_SIZE))):
+        chunk_ids, _, seqs = zip(*chunk)
+        chunk_hashes, chunk_windows, offsets = hashes_from_seqs(seqs, db_config, layout)
 
-    # train the database with hashes pointing to their matching proteins
-    for i, (prot_id, _, seq) in enumerate(fasta[slc], 1):
+        prot_ids.extend(chunk_ids)
+        seq_lens.extend(map(len, seqs))
+        hashes.append(chunk_hashes)
+        windows.append(chunk_windows)
+        hash_counts.append(np.diff(offsets))
 
-        # calculate the combinatorial hashes for the sequence
-        hashes: Hashes = hashes_from_seq(seq, prot_id, db_config)
+    return prot_ids, np.array(seq_lens, dtype=np.int64), np.concatenate(hashes), np.concatenate(windows), np.concatenate(hash_counts)
 
-        # save the protein related data
-        protein_lookup[prot_id] = (len(seq), len(hashes))
 
-        # sort the hashes into the database by using them as key pointing to
-        # their matching proteins
-        for hash_, occ in hashes.items():
-            if hash_ not in database:
-                database[hash_] = []
-            database[hash_].append(occ)
-
-        #if i % 100 == 0:
-        #if objsize(pickle.dumps(DB(database, protein_lookup, db_config), pickle.HIGHEST_PROTOCOL)) > 6 * fasta_size / cores:
-        #raise MemoryError("database too big")
-
-    return database, protein_lookup
+def _build_index(postings) -> Tuple[HashIndex, ProteinTable]:
+    """
+    Joins the hashes of all processes into the index, keeping the order of
+    the proteins as they were processed
+    """
+    prot_ids = [prot_id for prot_ids, *_ in postings for prot_id in prot_ids]
+    seq_lens = np.concatenate([seq_lens for _, seq_lens, *_ in postings])
+    hashes = np.concatenate([hashes for _, _, hashes, *_ in postings])
+    windows = np.concatenate([windows for *_, windows, _ in postings])
+    hash_counts = np.concatenate([hash_counts for *_, hash_counts in postings])
+
+    # a protein identifier occurring multiple times refers to one protein,
+    # described by its last occurrence
+    positions: Dict[ProteinID, int] = {}
+    for i, prot_id in enumerate(prot_ids):
+        positions.setdefault(prot_id, len(positions))
+    prot_idx = np.fromiter((positions[prot_id] for prot_id in prot_ids), dtype=np.int64, count=len(prot_ids))
+    last = np.zeros(len(positions), dtype=np.int64)
+    last[prot_idx] = np.arange(len(prot_ids))
+
+    protein_lookup = ProteinTable(list(positions), seq_lens[last], hash_counts[last])
+    proteins = np.repeat(prot_idx, hash_counts)
+
+    return HashIndex.from_postings(hashes, proteins, windows, protein_lookup.ids), protein_lookup
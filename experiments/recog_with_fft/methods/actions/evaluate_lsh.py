@@ -0,0 +1,93 @@
+from tools import *
+from .find_matches import get_filtered_db, fasta_batches, remove_hashes, score_batch, rank_matches, BATCH_SIZE
+from .algorithm import hashes_from_seqs
+import csv
+import sys
+import time
+
+LSH_BANDS = (4, 8, 16, 32)  # the band counts evaluated by default
+
+
+def evaluate_lsh(
+        fasta_file: str,
+        db_in: str,
+        bands=LSH_BANDS,
+        filter_quantile=1.0,
+        top_k=10,
+        batch_size=BATCH_SIZE
+        ):
+    """
+    Compares the matches found with the LSH candidates of the database's
+    MinHash sketches to the ones of exhaustive scoring, for choosing the
+    number of bands of 'find-matches --lsh-bands'. For each number of bands
+    it prints as csv to stdout:
+      - number of bands and of sketch values per band -> Bands, Rows
+      - share of the exhaustive top k matches found   -> Recall
+      - proteins scored per sample                    -> Scored
+      - seconds needed for scoring all samples        -> Seconds
+      - speedup over exhaustive scoring               -> Speedup
+
+    The first row, with 0 bands, is the exhaustive scoring. The samples are
+    hashed beforehand and the LSH indexes are built before measuring
+
+    ...
+
+    Parameters
+    ----------
+    fasta_file : str
+        The path to the FASTA formatted file containing the samples, e.g. the
+        ones selected by select_samples
+    db_in : str
+        Name of the file storing the database, created with sketches
+    bands : Iterable[int], optional
+        The numbers of bands to be evaluated, dividing the sketch size
+    filter_quantile : float
+        Quantile of hashes to be kept in database
+    top_k : int, optional
+        The number of best matches per sample the recall refers to
+    batch_size : int, optional
+        The number of samples hashed and scored together
+    """
+    assert top_k > 0, "top k must be positive"
+
+    database, hash_blacklist = get_filtered_db(db_in, filter_quantile)
+    assert database.db.sketch_size, "the database has no MinHash sketches, create it with --minhash"
+    hash_blacklist = np.array(hash_blacklist, dtype=database.layout.dtype)
+
+    hashed_batches = []
+    for batch in fasta_batches(fasta_file, batch_size):
+        _, _, seqs = zip(*batch)
+        hashed = hashes_from_seqs(seqs, database.config, database.layout)
+        hashed_batches.append(remove_hashes(*hashed, hash_blacklist) if len(hash_blacklist) else hashed)
+
+    out = csv.writer(sys.stdout, lineterminator="\n")
+    out.writerow(("Bands", "Rows", "Recall", "Scored", "Seconds", "Speedup"))
+
+    exhaustive_matches = exhaustive_time = None
+    for lsh_bands in (0, *bands):
+        if lsh_bands:
+            database.db.lsh(lsh_bands)
+            database.db.protein_postings()
+
+        scored_counts: List[int] = []
+        top_matches: List[set] = []
+        start = time.perf_counter()
+        for hashes, windows, hash_offsets in tqdm(hashed_batches):
+            for scored_matches in score_batch(hashes, windows, hash_offsets, database.db, database.lookup, top_k, lsh_bands=lsh_bands):
+                scored_counts.append(len(scored_matches))
+                top_matches.append(set(rank_matches(scored_matches, top_k).match_ids))
+        seconds = time.perf_counter() - start
+
+        if not lsh_bands:
+            exhaustive_matches, exhaustive_time = top_matches, seconds
+        found = sum(len(matches & exhaustive) for matches, exhaustive in zip(top_matches, exhaustive_matches))
+        expected = sum(map(len, exhaustive_matches))
+
+        out.writerow((
+            lsh_bands,
+            database.db.sketch_size // lsh_bands if lsh_bands else 0,
+            "%g" % (found / expected if expected else 1.),
+            "%g" % (np.mean(scored_counts) if scored_counts else 0.),
+            "%.3f" % seconds,
+            "%.2f" % (exhaustive_time / seconds if seconds else 0.)
+        ))
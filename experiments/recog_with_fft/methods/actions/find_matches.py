@@ -1,16 +1,78 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union, Iterator, AsyncIterator
 import pandas as pd
 from tools import *
-from .algorithm import hashes_from_seq
-import pickle
+from itertools import repeat, islice
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+import asyncio
+import csv
+import io
 import sys
-import os
+from .algorithm import hashes_from_seqs
+from .algorithm.hash_gen import equal_runs
+from .result_cache import ResultCache, db_fingerprint, CACHE_SIZE
 
 Matches = List[Tuple[WindowIndex, WindowIndex]]
 ScoresByOffset = Dict[WindowIndex, Score]
 MatchesPerProt = Dict[ProteinID, ScoresByOffset]
 ScoresMap = Dict[ProteinID, Tuple[WindowIndex, Score, JSI]]
 
+BATCH_SIZE = 256  # samples scored at once
+POSTINGS_PER_BLOCK = 2**18  # postings expanded and reduced at once, as long as a sample has fewer
+BATCHES_AHEAD = 4  # batches read and scored ahead of the output, per process
+PRUNING_POSTINGS = 2**12  # postings of the rarest hashes expanded first when pruning
+PRUNING_LIMIT = 0.5  # share of a sample's postings expanded at most for pruning
+PRUNING_CANDIDATES = 4  # best proteins by the rarest hashes scored exactly for the threshold, if k is at most that
+CANDIDATE_LOOKUP_COST = 4  # cost of looking up a hash of an LSH candidate relative to resolving a posting
+
+
+class RankedMatches(NamedTuple):
+    """
+    The scored matches of a sample, ordered by their rank
+
+    ...
+
+    Attributes
+    ----------
+    match_ids : List[ProteinID]
+        The identifiers of the matching proteins
+    jsi : np.ndarray
+        The Jaccard Similarity Index of each match
+    scores : np.ndarray
+        The score of each match
+    ranks : np.ndarray
+        The dense rank of each match by JSI * Score, starting at 1
+    """
+    match_ids: List[ProteinID]
+    jsi: np.ndarray
+    scores: np.ndarray
+    ranks: np.ndarray
+
+
+class MatchResult(NamedTuple):
+    """
+    The ranked matches of a sample, as yielded by stream_matches
+
+    ...
+
+    Attributes
+    ----------
+    input_id : ProteinID
+        The identifier of the sample
+    seq_len : int
+        The sequence length of the sample
+    hash_count : int
+        The number of hashes of the sample
+    matches : RankedMatches
+        The matches of the sample, ordered by their rank
+    """
+    input_id: ProteinID
+    seq_len: int
+    hash_count: int
+    matches: RankedMatches
+
+
 COLUMNS = [
     "Rank",
     "Match_Protein_ID",
@@ -25,7 +87,14 @@ COLUMNS = [
 def find_matches(
         fasta_file: str,
         db_in: str,
-        filter_quantile=1.0
+        filter_quantile=1.0,
+        top_k=0,
+        min_rank_score=0.,
+        batch_size=BATCH_SIZE,
+        cpu_count=1,
+        cache_file=None,
+        cache_size=CACHE_SIZE,
+        lsh_bands=0
         ):
     """
     Find matches for the proteins defined in the FASTA file
@@ -42,66 +111,415 @@ def find_matches(
         Name of the file storing the trained database
     filter_quantile : float
         Quantile of hashes to be kept in database
+    top_k : int, optional
+        The number of best matches to print per sample, including the ones
+        sharing the rank of the last one. 0 prints all matches
+    min_rank_score : float, optional
+        The minimal JSI * Score of a match to be printed
+    batch_size : int, optional
+        The number of samples hashed and scored together
+    cpu_count : int, optional
+        The number of processes scoring the batches, the matches are printed
+        in the order of the FASTA file anyways
+    cache_file : str, optional
+        The path of a ResultCache file, whose results of already scored
+        sequences are printed instead of scoring them again
+    cache_size : float, optional
+        The size of the cached results in MB, beyond which the least recently
+        used ones are evicted
+    lsh_bands : int, optional
+        The number of bands of the LSHIndex of the database's MinHash
+        sketches, whose candidates are the only proteins scored, see
+        score_candidates. 0 scores all proteins sharing hashes
+    """
+
+    out = csv.writer(sys.stdout, lineterminator="\n")
+    out.writerow(COLUMNS)
+
+    # print the matches with description and score, while the next batches
+    # are read and scored
+    asyncio.run(_write_results(out, stream_matches(
+        fasta_file,
+        db_in,
+        filter_quantile,
+        top_k,
+        min_rank_score,
+        batch_size,
+        cpu_count,
+        cache_file,
+        cache_size,
+        lsh_bands
+    )))
+
+
+async def _write_results(out, results: AsyncIterator[MatchResult]):
+    async for input_id, seq_len, hash_count, ranked in results:
+        write_matches(out, ranked, input_id, seq_len, hash_count)
+
+
+async def stream_matches(
+        fasta_file: str,
+        db_in: str,
+        filter_quantile=1.0,
+        top_k=0,
+        min_rank_score=0.,
+        batch_size=BATCH_SIZE,
+        cpu_count=1,
+        cache_file=None,
+        cache_size=CACHE_SIZE,
+        lsh_bands=0
+        ) -> AsyncIterator[MatchResult]:
+    """
+    Yields the matches for the proteins defined in the FASTA file, in its
+    order, like find_matches prints them:
+
+        async for result in stream_matches(fasta_file, db_in):
+            ...
+
+    The FASTA file is read in a thread and the batches of samples are hashed
+    and scored by an executor of cpu_count threads or processes, while the
+    results are consumed. At most BATCHES_AHEAD batches per process are read
+    and scored ahead of the consumer, so the memory usage is independent of
+    the size of the FASTA file. With a cache_file, only the sequences not
+    cached are scored, and the cache statistics are printed to stderr at the
+    end
+
+    ...
+
+    Parameters
+    ----------
+    see find_matches
+
+    Returns
+    -------
+    An asynchronous iterator of the ranked matches of each sample
     """
 
     assert filter_quantile > 0 and filter_quantile <= 1
+    assert top_k >= 0, "top k must not be negative"
+    assert batch_size > 0, "batch size must be positive"
+    assert cpu_count > 0, "cpu count must be positive"
+    assert lsh_bands >= 0, "LSH bands must not be negative"
 
-    database, hash_blacklist = get_filtered_db(db_in, filter_quantile)
+    loop = asyncio.get_running_loop()
+    database, hash_blacklist = await loop.run_in_executor(None, get_filtered_db, db_in, filter_quantile)
     if filter_quantile == 1:
         assert len(hash_blacklist) == 0
+    hash_blacklist = np.array(hash_blacklist, dtype=database.layout.dtype)
+
+    options = {"filter_quantile": filter_quantile, "top_k": top_k, "min_rank_score": min_rank_score}
+    if lsh_bands:
+        # fails early for databases without sketches or unsuitable bands
+        database.db.lsh(lsh_bands)
+        if not database.db.ascending_proteins():
+            warn("The database has duplicate proteins, all of them are scored instead of LSH candidates")
+        options.update(lsh_bands=lsh_bands, sketch_size=database.db.sketch_size)
+
+    cache = None
+    if cache_file is not None:
+        fingerprint = await loop.run_in_executor(None, partial(db_fingerprint, db_in, database, **options))
+        cache = ResultCache(cache_file, fingerprint, cache_size)
+
+    with TemporaryDirectory() as tmp_dir:
+        if cpu_count == 1:
+            # hashing and scoring mostly runs in NumPy, which releases the GIL
+            executor = ThreadPoolExecutor(1)
+            score = partial(rank_batch, database=database, hash_blacklist=hash_blacklist, top_k=top_k, min_rank_score=min_rank_score, lsh_bands=lsh_bands)
+        else:
+            executor = ProcessPoolExecutor(cpu_count, initializer=init_worker, initargs=(share_db(database, db_in, filter_quantile, tmp_dir), hash_blacklist))
+            score = partial(rank_worker_batch, top_k=top_k, min_rank_score=min_rank_score, lsh_bands=lsh_bands)
+        del database
+
+        submit = partial(loop.run_in_executor, executor, score)
+        if cache is not None:
+            submit = partial(_submit_uncached, cache=cache, submit=submit)
+
+        # the futures of the scored batches in the order of the file, its
+        # bound stops reading when the consumer falls behind
+        pending: asyncio.Queue = asyncio.Queue(BATCHES_AHEAD * cpu_count)
+        scheduler = asyncio.create_task(_schedule_batches(fasta_batches(fasta_file, batch_size), pending, submit))
+        try:
+            while (scored := await pending.get()) is not None:
+                for result in await scored:
+                    yield result
+            await scheduler
+        finally:
+            scheduler.cancel()
+            while not pending.empty():
+                if (scored := pending.get_nowait()) is not None:
+                    scored.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            if cache is not None:
+                cache.report()
+                cache.close()
+
+
+async def _schedule_batches(batches: Iterator, pending: asyncio.Queue, submit):
+    """
+    Reads the batches in a thread and submits them for scoring, queueing the
+    futures of their results. None marks the end of the batches
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while (batch := await loop.run_in_executor(None, next, batches, None)) is not None:
+            await pending.put(submit(batch))
+    except Exception as e:
+        # hand the failure to the consumer
+        failed = loop.create_future()
+        failed.set_exception(e)
+        await pending.put(failed)
+    await pending.put(None)
+
+
+def _submit_uncached(batch: List[Tuple[ProteinID, str, str]], cache: ResultCache, submit) -> asyncio.Future:
+    """
+    Submits only the samples of the batch whose sequences aren't cached,
+    returning the future of the results of the whole batch
+    """
+    cached = cache.get([seq for *_, seq in batch])
+    uncached = [entry for entry, result in zip(batch, cached) if result is None]
+    return asyncio.ensure_future(_merge_cached(batch, cached, submit(uncached) if uncached else None, cache))
+
+
+async def _merge_cached(batch: List[Tuple[ProteinID, str, str]], cached: list, scored, cache: ResultCache) -> List[MatchResult]:
+    """
+    Caches the results of the scored samples and returns the results of the
+    batch, the cached ones with the batch's identifiers
+    """
+    scored: List[MatchResult] = await scored if scored is not None else []
+    cache.put([seq for (*_, seq), result in zip(batch, cached) if result is None], [result[1:] for result in scored])
+
+    scored = iter(scored)
+    return [next(scored) if result is None else MatchResult(input_id, *result) for (input_id, *_), result in zip(batch, cached)]
+
+
+def fasta_batches(fasta_file: str, batch_size: int) -> Iterator[List[Tuple[ProteinID, str, Union[str, bytes]]]]:
+    # the sequences are hashed from bytes, see get_aa_vectors
+    entries = iter(Fasta(fasta_file, check=False, decode=False))
+    return iter(lambda: list(islice(entries, batch_size)), [])
+
+
+def share_db(database: DB, db_in: str, filter_quantile: float, tmp_dir: str) -> str:
+    """
+    Returns the path of a database directory for worker processes, which
+    memory-map it and so share its pages instead of loading a copy each.
+    Pickled or filtered databases are written to tmp_dir for that
+    """
+    if os.path.isdir(db_in) and filter_quantile == 1:
+        return db_in
+
+    db_dir = os.path.join(tmp_dir, "database")
+    save_db(database, db_dir)
+    return db_dir
+
+
+def match_batch(
+        out,
+        batch: List[Tuple[ProteinID, str, str]],
+        database: DB,
+        hash_blacklist: np.ndarray,
+        top_k=0,
+        min_rank_score=0.,
+        lsh_bands=0
+        ):
+    """
+    Finds and writes the matches for a batch of FASTA entries, see
+    find_matches
+    """
+    for input_id, seq_len, hash_count, ranked in rank_batch(batch, database, hash_blacklist, top_k, min_rank_score, lsh_bands):
+        write_matches(out, ranked, input_id, seq_len, hash_count)
+
 
-    print(*COLUMNS, sep=",")
+def rank_batch(
+        batch: List[Tuple[ProteinID, str, str]],
+        database: DB,
+        hash_blacklist: np.ndarray,
+        top_k=0,
+        min_rank_score=0.,
+        lsh_bands=0
+        ) -> List[MatchResult]:
+    """
+    Finds and ranks the matches for a batch of FASTA entries
+    """
+    input_ids, _, seqs = zip(*batch)
+
+    # create the combinatorial hashes for the sequences
+    hashes, windows, hash_offsets = hashes_from_seqs(seqs, database.config, database.layout)
+    if len(hash_blacklist):
+        hashes, windows, hash_offsets = remove_hashes(hashes, windows, hash_offsets, hash_blacklist)
+
+    # calculate the scores for proteins in the database, only for the ones
+    # which may be kept by rank_matches
+    scored_batch: List[ScoresMap] = score_batch(hashes, windows, hash_offsets, database.db, database.lookup, top_k, min_rank_score, lsh_bands)
 
-    # print the matches with description and score
-    for input_id, _, seq in Fasta(fasta_file):
-        # create the combinatorial hashes for the sequence
-        hashes: Hashes = hashes_from_seq(seq, None, database.config)
-        hashes = {k: v for k, v in hashes.items() if k not in hash_blacklist}
+    return [
+        MatchResult(input_id, len(seq), hash_count, rank_matches(scored_matches, top_k, min_rank_score))
+        for input_id, seq, hash_count, scored_matches in zip(input_ids, seqs, np.diff(hash_offsets).tolist(), scored_batch)
+    ]
 
-        # calculate the scores for proteins in the database
-        scored_matches: ScoresMap = score_prots(hashes, database.db, database.lookup)
 
-        result = get_result_frame(scored_matches, input_id, len(seq), len(hashes))
+# the database of a worker process, set by init_worker
+_worker_db: Tuple[DB, np.ndarray] = None
 
-        result.loc[len(result.index)] = None
-        print(result.sort_values("Rank").to_csv(index=False, header=False, float_format="%g"), end="")
+
+def init_worker(db_in: str, hash_blacklist: np.ndarray):
+    """
+    Initializes a worker process of match_batch_rows or rank_worker_batch
+    with the database, memory-mapped from a directory like share_db returns
+    """
+    global _worker_db
+    _worker_db = load_db(db_in), hash_blacklist
+
+
+def match_batch_rows(batch: List[Tuple[ProteinID, str, str]], top_k=0, min_rank_score=0., lsh_bands=0) -> str:
+    """
+    Returns the csv rows match_batch writes for the batch, using the database
+    of the worker process
+    """
+    rows = io.StringIO()
+    match_batch(csv.writer(rows, lineterminator="\n"), batch, *_worker_db, top_k, min_rank_score, lsh_bands)
+    return rows.getvalue()
+
+
+def rank_worker_batch(batch: List[Tuple[ProteinID, str, str]], top_k=0, min_rank_score=0., lsh_bands=0) -> List[MatchResult]:
+    """
+    Returns the matches rank_batch finds for the batch, using the database of
+    the worker process
+    """
+    return rank_batch(batch, *_worker_db, top_k, min_rank_score, lsh_bands)
+
+
+def remove_hashes(
+        hashes: np.ndarray,
+        windows: np.ndarray,
+        hash_offsets: np.ndarray,
+        hash_blacklist: np.ndarray
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Removes the blacklisted hashes from the hashes of a batch of samples, as
+    returned by hashes_from_seqs
+    """
+    keep = ~np.isin(hashes, hash_blacklist)
+    samples = np.repeat(np.arange(len(hash_offsets) - 1), np.diff(hash_offsets))
+    kept_counts = np.bincount(samples[keep], minlength=len(hash_offsets) - 1)
+    kept_offsets = np.zeros(len(hash_offsets), dtype=np.int64)
+    np.cumsum(kept_counts, out=kept_offsets[1:])
+    return hashes[keep], windows[keep], kept_offsets
 
 
 def get_filtered_db(db_in: str, filter_quantile: float) -> Tuple[DB, List[Hash]]:
-    # load databases
-    with open(db_in, 'rb') as f:
-        db = pickle.load(f)
+    # load databases, memory-mapped ones are only read on access
+    db = load_db(db_in)
 
-    prev_size = os.path.getsize(db_in)
+    prev_size = db.db.nbytes + db.lookup.nbytes
 
     db, hash_blacklist = filter_db(db, filter_quantile)
 
-    size_now = sys.getsizeof(pickle.dumps(db, pickle.HIGHEST_PROTOCOL))
+    size_now = db.db.nbytes + db.lookup.nbytes
     eprint(int(size_now / prev_size * 100), r"%", " (%.2fMB) of database size used by quantile filter" % (size_now / (1024**2)), sep="")
 
     return db, hash_blacklist
 
 
-def filter_db(db: DB, filter_quantile: float) -> Tuple[Tuple[Database, ProteinLookup], List[Hash]]:
+def filter_db(db: DB, filter_quantile: float) -> Tuple[DB, List[Hash]]:
+    if filter_quantile == 1:
+        return db, []  # keeps all hashes, without touching the postings
+
     # filter db
-    hash_frequencies = np.array(sorted(len(v) for v in db.db.values()))
+    posting_counts = db.db.posting_counts()
+    hash_frequencies = np.sort(posting_counts)
     f = np.cumsum(hash_frequencies)
     quantile_value = hash_frequencies[np.searchsorted(f, filter_quantile * f[-1])]
 
-    hash_blacklist = [hash_ for hash_, v in db.db.items() if len(v) > quantile_value]
-    database = {k: v for k, v in db.db.items() if k not in hash_blacklist}
+    blacklisted = posting_counts > quantile_value
+    hash_blacklist = db.db.hashes[blacklisted].tolist()
+    database = db.db.select(~blacklisted)
 
-    # update lookup
-    hash_counts = {k: 0 for k in db.lookup}
-    for prots in database.values():
-        for _, p in prots:
-            hash_counts[p] += 1
+    # update lookup, the hash counts are the row sums of the incidence matrix
+    hash_counts = database.incidence().getnnz(axis=1).astype(np.int64)
+    protein_lookup = ProteinTable(db.lookup.ids, db.lookup.seq_lens, hash_counts)
 
-    protein_lookup = {}
-    for p, val in db.lookup.items():
-        protein_lookup[p] = (val[0], hash_counts[p])
+    return DB(database, protein_lookup, db.config, db.layout), hash_blacklist
 
-    return DB(database, protein_lookup, db.config), hash_blacklist
+
+def rank_matches(scored_matches: ScoresMap, top_k=0, min_rank_score=0.) -> RankedMatches:
+    """
+    Ranks the scored matches of a sample densely by JSI * Score, optionally
+    keeping only the top k matches and the ones reaching min_rank_score
+
+    ...
+
+    Parameters
+    ----------
+    scored_matches : ScoresMap
+        The scores of the matching proteins, e.g. from score_prots
+    top_k : int, optional
+        The number of best matches to keep, including the ones sharing the
+        rank of the last one. 0 keeps all matches
+    min_rank_score : float, optional
+        The minimal JSI * Score of a match to be kept
+
+    Returns
+    -------
+    The kept matches, ordered by rank
+    """
+
+    match_ids = np.array(list(scored_matches), dtype=object)
+    _, scores, jsi = zip(*scored_matches.values()) if scored_matches else ((), (), ())
+    scores, jsi = np.array(scores, dtype=np.int64), np.array(jsi, dtype=np.float64)
+    rank_scores = jsi * scores
+
+    keep = rank_scores >= min_rank_score
+    if top_k and keep.sum() > top_k:
+        kept_scores = rank_scores[keep]
+        threshold = np.partition(kept_scores, len(kept_scores) - top_k)[len(kept_scores) - top_k]
+        keep &= rank_scores >= threshold
+    if not keep.all():
+        match_ids, scores, jsi, rank_scores = match_ids[keep], scores[keep], jsi[keep], rank_scores[keep]
+
+    ranks = dense_ranks(rank_scores)
+    order = np.argsort(ranks, kind="quicksort")
+    return RankedMatches(match_ids[order].tolist(), jsi[order], scores[order], ranks[order].astype(np.int64))
+
+
+def dense_ranks(rank_scores: np.ndarray) -> np.ndarray:
+    """
+    Ranks the values descending like pandas' rank(method="dense"), as floats
+    """
+    _, inverse = np.unique(-rank_scores, return_inverse=True)
+    return inverse.reshape(-1) + 1.
+
+
+def write_matches(out, ranked: RankedMatches, input_id: str, seq_len: int, hash_count: int):
+    """
+    Writes the ranked matches of a sample as csv rows of COLUMNS, followed by
+    an empty row
+
+    ...
+
+    Parameters
+    ----------
+    out : csv writer
+        The writer to write the rows to
+    ranked : RankedMatches
+        The matches of the sample, e.g. from rank_matches
+    input_id : str
+        The identifier of the sample
+    seq_len : int
+        The sequence length of the sample
+    hash_count : int
+        The number of hashes of the sample
+    """
+    out.writerows(zip(
+        ranked.ranks.tolist(),
+        ranked.match_ids,
+        ("%g" % jsi for jsi in ranked.jsi.tolist()),
+        ranked.scores.tolist(),
+        repeat(input_id),
+        repeat(seq_len),
+        repeat(hash_count)
+    ))
+    out.writerow([""] * len(COLUMNS))
 
 
 def get_result_frame(
@@ -122,7 +540,7 @@ def get_result_frame(
         result["Input_Sequence_Length"] = seq_len
         result["Input_Found_Hashes"] = hash_count
 
-        result["Rank"] = result[["JSI", "Score"]].apply(lambda x: x[0] * x[1], axis=1).rank(method="dense", ascending=False)
+        result["Rank"] = dense_ranks(result["JSI"].to_numpy(dtype=np.float64) * result["Score"].to_numpy(dtype=np.int64))
 
     return result
 
@@ -162,6 +580,9 @@ def score_prots(
         original position in the protein sequence
     """
 
+    if isinstance(database, HashIndex):
+        return score_index(hashes, database, protein_lookup)
+
     matches_per_prot: MatchesPerProt = get_matches_per_prot(hashes, database)
 
     # stores all identifiers of proteins that have matching hashes, pointing
@@ -195,6 +616,563 @@ def score_prots(
     return scores_map
 
 
+def score_index(
+        hashes: Hashes,
+        database: HashIndex,
+        protein_lookup: ProteinTable
+        ) -> ScoresMap:
+    """
+    Scores the proteins of a columnar database like score_prots, by
+    histogramming the offsets of all matching postings at once
+
+    ...
+
+    Parameters
+    ----------
+    hashes : Hashes
+        A dictionary of combinatorial hashes generated from a sample protein
+        sequence pointing to the index of their occurence
+    database: HashIndex
+        The inverted index of the hashes of known protein sequences
+    protein_lookup: ProteinTable
+        The protein lookup of the database, providing the hash counts
+
+    Returns
+    -------
+    The same scores as score_prots, in the same order
+    """
+
+    sample_indexes = np.fromiter((sample_index for sample_index, _ in hashes.values()), dtype=np.int64, count=len(hashes))
+    sample_hashes = np.fromiter(hashes, dtype=database.hashes.dtype, count=len(hashes))
+    return score_batch(sample_hashes, sample_indexes, np.array([0, len(hashes)]), database, protein_lookup)[0]
+
+
+def score_batch(
+        hashes: np.ndarray,
+        windows: np.ndarray,
+        hash_offsets: np.ndarray,
+        database: HashIndex,
+        protein_lookup: ProteinTable,
+        top_k=0,
+        min_rank_score=0.,
+        lsh_bands=0
+        ) -> List[ScoresMap]:
+    """
+    Scores the proteins of a columnar database for a batch of samples, like
+    score_index does for each of them. The posting ranges of all samples are
+    resolved by one merge-join against the index, and the postings of blocks
+    of samples having up to POSTINGS_PER_BLOCK postings are expanded and
+    their offsets histogrammed per sample and protein in one segmented
+    reduction
+
+    With top_k or min_rank_score, only the proteins which may be among the
+    top k matches, or reach min_rank_score, are scored, see prune_postings.
+    Their scores and order are the same, so rank_matches keeps the same
+    matches. With lsh_bands, only the candidates found by the LSHIndex of
+    the database are scored instead, with their same scores, either by the
+    postings of their sample or by score_candidates, if the candidates have
+    fewer hashes than the samples have postings
+
+    ...
+
+    Parameters
+    ----------
+    hashes : np.ndarray
+        The distinct hashes of all samples one after another, as returned by
+        hashes_from_seqs
+    windows : np.ndarray
+        The window index each hash points to
+    hash_offsets : np.ndarray
+        The offsets of the hashes of each sample
+    database: HashIndex
+        The inverted index of the hashes of known protein sequences
+    protein_lookup: ProteinTable
+        The protein lookup of the database, providing the hash counts
+    top_k : int, optional
+        The number of best matches needed per sample, 0 for all
+    min_rank_score : float, optional
+        The minimal JSI * Score of the matches needed
+    lsh_bands : int, optional
+        The number of bands of the LSHIndex finding the candidates, 0 scores
+        all proteins
+
+    Returns
+    -------
+    The scores of each sample, the same as score_prots
+    """
+
+    sample_count = len(hash_offsets) - 1
+    starts, ends = database.join_ranges(hashes)
+
+    candidates = None
+    if lsh_bands and database.ascending_proteins():
+        candidates = database.lsh(lsh_bands).candidates(minhash_sketches(hashes, hash_offsets, database.sketch_size))
+        if protein_lookup.hash_counts[candidates[1]].sum() * CANDIDATE_LOOKUP_COST < (ends - starts).sum():
+            return score_candidates(hashes, windows, hash_offsets, *candidates, database, protein_lookup)
+
+    # expand, prune and reduce the postings of blocks of whole samples, so
+    # the postings alive at once are bounded, and the temporary arrays of the
+    # segmented reduction small enough for the caches
+    hash_counts = np.diff(hash_offsets)
+    cumulative_postings = np.zeros(len(hashes) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=cumulative_postings[1:])
+    sample_posting_offsets = cumulative_postings[hash_offsets]
+
+    scored_batch: List[ScoresMap] = []
+    first = 0
+    while first < sample_count:
+        last = np.searchsorted(sample_posting_offsets, sample_posting_offsets[first] + POSTINGS_PER_BLOCK, side="right") - 1
+        last = min(max(last, first + 1), sample_count)
+        block = slice(hash_offsets[first], hash_offsets[last])
+        block_counts = hash_counts[first:last]
+
+        # the postings are ordered by sample and then like
+        # get_matches_per_prot iterates them
+        query, proteins, source_indexes = database.expand(starts[block], ends[block])
+        samples = np.repeat(np.arange(last - first), block_counts)[query]
+        offsets = windows[block][query].astype(np.int64) - source_indexes
+        posting_offsets = np.searchsorted(samples, np.arange(last - first + 1))
+
+        kept: List[Union[np.ndarray, None]] = [None] * (last - first)
+        if candidates is not None:
+            candidate_first, candidate_last = np.searchsorted(candidates[0], [first, last])
+            kept = candidate_postings(
+                candidates[0][candidate_first:candidate_last] - first,
+                candidates[1][candidate_first:candidate_last],
+                posting_offsets,
+                proteins,
+                database
+            )
+        elif (top_k or min_rank_score > 0) and database.ascending_proteins():
+            kept = prune_postings(
+                starts[block],
+                ends[block],
+                windows[block],
+                hash_offsets[first:last + 1] - hash_offsets[first],
+                posting_offsets,
+                query,
+                proteins,
+                source_indexes,
+                database,
+                protein_lookup,
+                top_k,
+                min_rank_score
+            )
+
+        postings = slice(None)
+        if any(sample_postings is not None for sample_postings in kept):
+            # only the kept postings of pruned samples, in their order
+            postings = np.concatenate([
+                np.arange(posting_offsets[i], posting_offsets[i + 1]) if sample_postings is None else sample_postings + posting_offsets[i]
+                for i, sample_postings in enumerate(kept)
+            ])
+        scored_batch.extend(_score_postings(
+            samples[postings],
+            proteins[postings],
+            offsets[postings],
+            block_counts,
+            database,
+            protein_lookup
+        ))
+        first = last
+
+    return scored_batch
+
+
+def score_candidates(
+        hashes: np.ndarray,
+        windows: np.ndarray,
+        hash_offsets: np.ndarray,
+        candidate_samples: np.ndarray,
+        candidate_proteins: np.ndarray,
+        database: HashIndex,
+        protein_lookup: ProteinTable
+        ) -> List[ScoresMap]:
+    """
+    Scores the candidate proteins of the samples like score_batch, but
+    instead of resolving the postings of the samples' hashes, the hashes of
+    the candidates are looked up among the ones of their sample, using the
+    incidence matrix
+
+    ...
+
+    Parameters
+    ----------
+    candidate_samples : np.ndarray
+        The sample of each candidate, ascending, as returned by
+        LSHIndex.candidates
+    candidate_proteins : np.ndarray
+        The protein of each candidate, see candidate_samples
+    see score_batch for the others
+
+    Returns
+    -------
+    The scores of the candidates of each sample
+    """
+
+    sample_count = len(hash_offsets) - 1
+    hash_counts = np.diff(hash_offsets)
+    incidence = database.incidence()
+    pairs, entries = database.posting_indexes(incidence.indptr[candidate_proteins], incidence.indptr[candidate_proteins + 1])
+    entry_offsets = np.searchsorted(candidate_samples[pairs], np.arange(sample_count + 1))
+
+    # the hash of each sample at the index of the hash in the database
+    hash_indexes = database.find(hashes)
+    sample_hashes = np.full(len(database), -1, dtype=np.int64)
+    queries = [np.array([], dtype=np.int64)]
+    matches = [np.array([], dtype=np.int64)]
+    for i in range(sample_count):
+        sample = slice(hash_offsets[i], hash_offsets[i + 1])
+        contained = hash_indexes[sample] >= 0
+        sample_hashes[hash_indexes[sample][contained]] = np.arange(hash_offsets[i], hash_offsets[i + 1])[contained]
+
+        sample_entries = entries[entry_offsets[i]:entry_offsets[i + 1]]
+        query = sample_hashes[incidence.indices[sample_entries]]
+        queries.append(query[query >= 0])
+        matches.append(sample_entries[query >= 0])
+        sample_hashes[hash_indexes[sample][contained]] = -1
+
+    # order the postings like score_batch, by the hashes of the samples and
+    # then by protein
+    query, entries = np.concatenate(queries), np.concatenate(matches)
+    proteins = database.proteins[database.protein_postings()[entries]]
+    order = np.lexsort((proteins, query))
+    query, proteins, postings = query[order], proteins[order], database.protein_postings()[entries[order]]
+
+    return _score_postings(
+        np.repeat(np.arange(sample_count), hash_counts)[query],
+        proteins,
+        windows[query].astype(np.int64) - database.windows[postings],
+        hash_counts,
+        database,
+        protein_lookup
+    )
+
+
+def candidate_postings(
+        candidate_samples: np.ndarray,
+        candidate_proteins: np.ndarray,
+        posting_offsets: np.ndarray,
+        proteins: np.ndarray,
+        database: HashIndex
+        ) -> List[np.ndarray]:
+    """
+    Selects the postings of the candidate proteins of each sample, like
+    prune_postings does for the proteins which may be among the top k
+
+    ...
+
+    Parameters
+    ----------
+    candidate_samples : np.ndarray
+        The sample of each candidate, ascending, as returned by
+        LSHIndex.candidates
+    candidate_proteins : np.ndarray
+        The protein of each candidate, see candidate_samples
+    posting_offsets : np.ndarray
+        The offsets of the postings of each sample
+    proteins : np.ndarray
+        The protein of each posting of the samples
+
+    Returns
+    -------
+    For each sample the indexes of its candidates' postings among its
+    postings
+    """
+    candidate_offsets = np.searchsorted(candidate_samples, np.arange(len(posting_offsets)))
+    is_candidate = np.zeros(len(database.protein_ids), dtype=bool)
+    kept: List[np.ndarray] = []
+    for i in range(len(posting_offsets) - 1):
+        candidates = candidate_proteins[candidate_offsets[i]:candidate_offsets[i + 1]]
+        is_candidate[candidates] = True
+        kept.append(np.flatnonzero(is_candidate[proteins[posting_offsets[i]:posting_offsets[i + 1]]]))
+        is_candidate[candidates] = False
+
+    return kept
+
+
+def prune_postings(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        windows: np.ndarray,
+        hash_offsets: np.ndarray,
+        posting_offsets: np.ndarray,
+        query: np.ndarray,
+        proteins: np.ndarray,
+        source_indexes: np.ndarray,
+        database: HashIndex,
+        protein_lookup: ProteinTable,
+        top_k=0,
+        min_rank_score=0.
+        ) -> List[Union[np.ndarray, None]]:
+    """
+    Selects the postings of the proteins which may be among the top k matches
+    of their sample, or reach min_rank_score
+
+    The JSI * Score of a protein can only grow with further matching hashes,
+    so the scores by the rarest hashes of a sample are lower bounds, and the
+    k-th best of them is a lower bound of the final k-th best one. For small
+    k, the best of these proteins are scored exactly to raise it. A protein
+    can match each hash at most once, so matching none of the rarest hashes
+    bounds its JSI * Score from above by the remaining ones. The rarest
+    hashes are expanded until that bound falls below the k-th lower bound or
+    min_rank_score, and only the proteins found which may still reach it are
+    kept. Samples needing more than PRUNING_LIMIT of their postings for that
+    are kept whole, as pruning would cost more than it saves
+
+    ...
+
+    Parameters
+    ----------
+    starts : np.ndarray
+        The posting ranges of the hashes, as returned by
+        HashIndex.join_ranges
+    ends : np.ndarray
+        see starts
+    windows : np.ndarray
+        The window index each hash points to
+    hash_offsets : np.ndarray
+        The offsets of the hashes of each sample
+    posting_offsets : np.ndarray
+        The offsets of the postings of each sample
+    query : np.ndarray
+        The postings of the hashes as returned by HashIndex.expand for the
+        ranges
+    proteins : np.ndarray
+        see query
+    source_indexes : np.ndarray
+        see query
+    see score_batch for the others
+
+    Returns
+    -------
+    For each sample the indexes of its kept postings among its postings, or
+    None if all are kept
+    """
+
+    hash_count_levels = np.unique(protein_lookup.hash_counts)
+    is_candidate = np.zeros(len(database.protein_ids), dtype=bool)
+    kept: List[Union[np.ndarray, None]] = []
+    for i, (first, last) in enumerate(zip(hash_offsets[:-1].tolist(), hash_offsets[1:].tolist())):
+        sample = slice(first, last)
+        sample_postings = slice(posting_offsets[i], posting_offsets[i + 1])
+        candidates = _top_candidates(
+            starts[sample],
+            ends[sample],
+            windows[sample],
+            query[sample_postings] - first,
+            proteins[sample_postings],
+            source_indexes[sample_postings],
+            database,
+            protein_lookup.hash_counts,
+            hash_count_levels,
+            top_k,
+            min_rank_score
+        )
+
+        if candidates is None:
+            kept.append(None)
+            continue
+
+        is_candidate[candidates] = True
+        kept.append(np.flatnonzero(is_candidate[proteins[sample_postings]]))
+        is_candidate[candidates] = False
+
+    return kept
+
+
+def _top_candidates(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        windows: np.ndarray,
+        query: np.ndarray,
+        proteins: np.ndarray,
+        source_indexes: np.ndarray,
+        database: HashIndex,
+        hash_counts: np.ndarray,
+        hash_count_levels: np.ndarray,
+        top_k: int,
+        min_rank_score: float
+        ) -> Union[np.ndarray, None]:
+    """
+    Returns the proteins which may be among the top k matches of a sample or
+    reach min_rank_score, or None if pruning doesn't pay off, see
+    prune_postings. query, proteins and source_indexes are the sample's
+    postings, the query indexing the sample's windows
+    """
+    sample_cardinality = len(starts)
+    if not sample_cardinality:
+        return None
+    order = np.argsort(ends - starts, kind="stable")
+    cumulative_lengths = np.cumsum((ends - starts)[order])
+
+    threshold = min_rank_score
+    if top_k:
+        # the JSI * Scores by the rarest hashes are lower bounds, and the
+        # proteins matching them best likely match best overall, so with
+        # their exact scores for small k the k-th best score found is a tight
+        # lower bound of the k-th best one
+        rarest = order[:max(1, np.searchsorted(cumulative_lengths, PRUNING_POSTINGS, side="right"))]
+        rarest_query, rarest_postings = database.posting_indexes(starts[rarest], ends[rarest])
+        match_proteins, rank_scores = _rank_scores(
+            database.proteins[rarest_postings],
+            windows[rarest][rarest_query],
+            database.windows[rarest_postings],
+            hash_counts,
+            sample_cardinality
+        )
+
+        if len(match_proteins) >= top_k and top_k <= PRUNING_CANDIDATES:
+            # the proteins are ascending, like the ones scored
+            candidate_count = min(PRUNING_CANDIDATES, len(rank_scores))
+            best = np.sort(np.argpartition(rank_scores, len(rank_scores) - candidate_count)[len(rank_scores) - candidate_count:])
+            is_best = np.zeros(len(database.protein_ids), dtype=bool)
+            is_best[match_proteins[best]] = True
+            is_best = np.flatnonzero(is_best[proteins])
+            _, rank_scores[best] = _rank_scores(proteins[is_best], windows[query[is_best]], source_indexes[is_best], hash_counts, sample_cardinality)
+        if len(match_proteins) >= top_k:
+            threshold = max(threshold, np.partition(rank_scores, len(rank_scores) - top_k)[len(rank_scores) - top_k])
+
+    expanded = _needed_hashes(threshold, sample_cardinality, hash_count_levels)
+    if not expanded:
+        # no protein can reach the threshold, even matching all hashes
+        return np.array([], dtype=np.int64)
+    if cumulative_lengths[expanded - 1] > cumulative_lengths[-1] * PRUNING_LIMIT:
+        return None
+
+    # the other proteins miss the threshold even matching all remaining
+    # hashes, of which each adds at most one match to a protein
+    rarest = order[:expanded]
+    rarest_query, rarest_postings = database.posting_indexes(starts[rarest], ends[rarest])
+    match_proteins, intersection_cardinality, max_frequencies = _offset_histogram(
+        database.proteins[rarest_postings],
+        windows[rarest][rarest_query],
+        database.windows[rarest_postings]
+    )
+    upper_bounds = _rank_score_bound(intersection_cardinality, max_frequencies, sample_cardinality - expanded, sample_cardinality, hash_counts[match_proteins])
+    return match_proteins[upper_bounds >= threshold]
+
+
+def _rank_scores(
+        proteins: np.ndarray,
+        sample_windows: np.ndarray,
+        match_windows: np.ndarray,
+        hash_counts: np.ndarray,
+        sample_cardinality: int
+        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the matched proteins and their JSI * Score by some postings of a
+    sample, which can only grow by further postings
+    """
+    match_proteins, intersection_cardinality, max_frequencies = _offset_histogram(proteins, sample_windows, match_windows)
+    union_cardinality = sample_cardinality + hash_counts[match_proteins] - intersection_cardinality
+    return match_proteins, intersection_cardinality / union_cardinality * max_frequencies
+
+
+def _needed_hashes(threshold: float, sample_cardinality: int, hash_count_levels: np.ndarray) -> int:
+    """
+    Returns the number of hashes to be expanded, so that no protein having
+    one of the hash counts can reach the threshold by the remaining ones
+    """
+    # the bound grows with the remaining hashes, so they are bisected
+    low, high = 0, sample_cardinality
+    while low < high:
+        remaining = (low + high + 1) // 2
+        if _rank_score_bound(0, 0, remaining, sample_cardinality, hash_count_levels).max() < threshold:
+            low = remaining
+        else:
+            high = remaining - 1
+
+    return sample_cardinality - low
+
+
+def _offset_histogram(proteins: np.ndarray, sample_windows: np.ndarray, match_windows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the matched proteins, their number of postings and the highest
+    count of postings at one offset
+    """
+    if not len(proteins):
+        return proteins, proteins, proteins
+
+    offsets = sample_windows.astype(np.int64) - match_windows
+    first_postings, _, counts = equal_runs(proteins, (offsets - offsets.min()).astype(np.uint32))
+    run_proteins = proteins[first_postings]
+    match_starts = np.flatnonzero(np.diff(run_proteins, prepend=-1))
+    return run_proteins[match_starts], np.add.reduceat(counts, match_starts), np.maximum.reduceat(counts, match_starts)
+
+
+def _rank_score_bound(
+        intersection_cardinality,
+        max_frequency,
+        remaining: int,
+        sample_cardinality: int,
+        match_cardinality
+        ) -> np.ndarray:
+    """
+    The upper bound of the JSI * Score of proteins having match_cardinality
+    hashes, of which intersection_cardinality matched so far with a score of
+    max_frequency, if at most the remaining hashes match further.
+    Rounding is compensated by a relative margin
+    """
+    match_cardinality = np.asarray(match_cardinality, dtype=np.int64)
+    additional = np.minimum(remaining, match_cardinality - intersection_cardinality)
+    intersection_cardinality = intersection_cardinality + additional
+    union_cardinality = sample_cardinality + match_cardinality - intersection_cardinality
+    return intersection_cardinality / np.maximum(union_cardinality, 1) * (max_frequency + additional) * (1 + 1e-9)
+
+
+def _score_postings(
+        samples: np.ndarray,
+        proteins: np.ndarray,
+        offsets: np.ndarray,
+        sample_cardinality: np.ndarray,
+        database: HashIndex,
+        protein_lookup: ProteinTable
+        ) -> List[ScoresMap]:
+    """
+    The segmented reduction of score_batch, scoring the postings of each
+    sample by histogramming their offsets per sample and protein
+    """
+
+    sample_count = len(sample_cardinality)
+    if not len(samples):
+        return [{} for _ in range(sample_count)]
+
+    # grouping by sample and protein keeps the samples apart
+    groups = samples * len(database.protein_ids) + proteins
+
+    # count the postings per sample, protein and offset
+    first_postings, _, counts = equal_runs(groups, (offsets - offsets.min()).astype(np.uint32))
+    run_groups = groups[first_postings]
+
+    # the runs are sorted by sample and protein, so each match forms a run
+    match_starts = np.flatnonzero(np.diff(run_groups, prepend=-1))
+    match_samples = samples[first_postings[match_starts]]
+    match_proteins = proteins[first_postings[match_starts]]
+    intersection_cardinality = np.add.reduceat(counts, match_starts)
+
+    # the most related offset is the first one found with the highest count,
+    # like get_max_offset takes it
+    max_frequencies = np.maximum.reduceat(counts, match_starts)
+    is_max = counts == np.repeat(max_frequencies, np.diff(np.append(match_starts, len(counts))))
+    max_offsets = offsets[np.minimum.reduceat(np.where(is_max, first_postings, len(offsets)), match_starts)]
+
+    union_cardinality = sample_cardinality[match_samples] + protein_lookup.hash_counts[match_proteins] - intersection_cardinality
+    jacc_sim_index = intersection_cardinality / union_cardinality
+
+    # order the matches by their first posting, which keeps them ordered by
+    # sample as well
+    order = np.argsort(np.minimum.reduceat(first_postings, match_starts))
+    sample_starts = np.searchsorted(match_samples[order], np.arange(sample_count + 1))
+    match_ids = database.protein_ids[match_proteins[order]].tolist()
+    scores = list(zip(max_offsets[order].tolist(), max_frequencies[order].tolist(), jacc_sim_index[order].tolist()))
+
+    return [
+        dict(zip(match_ids[start:end], scores[start:end]))
+        for start, end in zip(sample_starts[:-1].tolist(), sample_starts[1:].tolist())
+    ]
+
+
 def get_max_offset(prot_scores_by_offset: ScoresByOffset) -> Tuple[WindowIndex, Score]:
     max_ = (0, 0)
     for offset, frequency in prot_scores_by_offset.items():
@@ -208,6 +1186,20 @@ def get_matches_per_prot(hashes: Hashes, database: Database) -> MatchesPerProt:
     # stores all found hashes that exist for a known protein
     matches_per_prot: MatchesPerProt = {}
 
+    if isinstance(database, HashIndex):
+        # resolve the postings of all hashes at once, keeping their order
+        sample_indexes = np.fromiter((sample_index for sample_index, _ in hashes.values()), dtype=np.int64, count=len(hashes))
+        query, proteins, source_indexes = database.gather(np.fromiter(hashes, dtype=database.hashes.dtype, count=len(hashes)))
+        posting_offsets = (sample_indexes[query] - source_indexes).tolist()
+
+        for match_prot_id, offset in zip(database.protein_ids[proteins].tolist(), posting_offsets):
+            if (offsets := matches_per_prot.get(match_prot_id)) is None:
+                offsets = {}
+                matches_per_prot[match_prot_id] = offsets
+            offsets[offset] = offsets.get(offset, 0) + 1
+
+        return matches_per_prot
+
     # find the matches per protein
     for hash_, (sample_index, _) in hashes.items():
         if hash_ in database:
@@ -13,28 +13,30 @@ def match_family(
     db, hash_blacklist = get_filtered_db(db_in, filter_quantile)
     fam_data = pd.read_csv(family_file, sep=",", index_col="Protein_ID").squeeze()
 
-    fam_hashes = {f: {} for f in fam_data.unique()}
-    for hash_, prots in tqdm(db.db.items()):
-        fam = fam_data.loc[[prot for _, prot in prots]]
-        for f in fam:
-            fam_hashes[f][hash_] = fam_hashes[f].get(hash_, 0) + 1
+    # count for each hash how many members of a family have it, as product of
+    # the family x protein membership matrix with the incidence matrix
+    incidence = db.db.incidence()
+    fam_hashes = family_incidence(fam_data, db.lookup.ids) @ incidence
+    prots_per_hash = incidence.T.tocsr()
+    fam_member_counts = fam_data.value_counts()
 
     print("Family_ID", "F_Score", "Precision", "Recall", "Sharpness", "Member_Count", "Match_Count", "Hash_Intersec_Size", sep=",")
-    for fam in tqdm(fam_hashes):
-        fam_member_count = (fam_data == fam).sum()
+    for i, fam in enumerate(tqdm(fam_data.unique())):
+        fam_member_count = fam_member_counts[fam]
         if fam_member_count > 1:
-            hashes = set(hash_ for hash_, count in fam_hashes[fam].items() if count == fam_member_count)
+            counts = fam_hashes.getrow(i)
+            hashes = counts.indices[counts.data == fam_member_count]
             if len(hashes):
-                match_prots = {}
-                for hash_ in hashes:
-                    for _, match_prot in db.db.get(hash_):
-                        match_prots[match_prot] = match_prots.get(match_prot, 0) + 1
+                # the number of the hashes each protein has
+                match_counts = np.asarray(prots_per_hash[hashes].sum(axis=0)).ravel()
+                matched = np.flatnonzero(match_counts)
+                match_prots = dict(zip(db.lookup.ids[matched].tolist(), match_counts[matched].tolist()))
 
                 match_fams = fam_data.loc[sorted(match_prots, key=lambda x: match_prots[x] / len(hashes))]
 
                 fam_mask = (match_fams == fam).groupby(match_fams.index).max()
                 true_pos_cumsum = fam_mask.cumsum()
-                true_pos = true_pos_cumsum[-1]
+                true_pos = true_pos_cumsum.iloc[-1]
                 false_neg = fam_member_count - true_pos
                 assert false_neg == 0
                 positives = len(match_prots) - true_pos_cumsum.value_counts().get(0, 0)
@@ -58,3 +60,27 @@ def match_family(
                 eprint("No intersection hashes for", fam)
         else:
             eprint("Ignored family", fam, "with only", fam_member_count, "member")
+
+
+def family_incidence(families: pd.Series, protein_ids: np.ndarray) -> sparse.csr_matrix:
+    """
+    Returns the family x protein matrix counting how often a protein is
+    listed as member of a family, with the families in order of appearance
+    and the proteins of protein_ids
+
+    ...
+
+    Parameters
+    ----------
+    families : pd.Series
+        The family of each protein, indexed by the protein identifiers
+    protein_ids : np.ndarray
+        The identifiers of the proteins, e.g. ProteinTable.ids
+    """
+    fam_index = pd.Index(families.unique()).get_indexer(families.to_numpy())
+    prot_index = pd.Index(protein_ids).get_indexer(families.index)
+    listed = prot_index >= 0
+    return sparse.csr_matrix(
+        (np.ones(listed.sum(), dtype=np.int32), (fam_index[listed], prot_index[listed])),
+        shape=(len(families.unique()), len(protein_ids))
+    )
@@ -1,31 +1,30 @@
 from tools import *
+from .match_family import family_incidence
 import numpy as np
-from tqdm import tqdm
 import matplotlib.pyplot as plt
 import pandas as pd
-import pickle
 
 
 def plot_family_covering(db: str, mapman: str, plot_out: str):
-    with open(db, "rb") as f:
-        database = pickle.load(f).db
+    database = load_db(db).db
 
     proteins = pd.read_csv(mapman, sep="\t", quotechar="'", index_col=1, usecols=["IDENTIFIER", "BINCODE"])
     proteins = proteins[proteins.index.notna()]
     proteins = proteins["BINCODE"].apply(str)
 
-    family_covering = {i: {} for i in proteins.unique()}#
-    for hash_, prots in tqdm(database.items()):
-        fam = proteins.loc[[prot.lower() for _, prot in prots]]
-        for f in fam:
-            family_covering[f][hash_] = family_covering[f].get(hash_, 0) + 1
+    # count for each hash how many members of a family have it
+    families = proteins.unique()
+    protein_ids = np.char.lower(np.asarray(database.protein_ids, dtype=str))
+    family_covering = family_incidence(proteins, protein_ids) @ database.incidence()
+    fam_member_counts = proteins.value_counts()
 
     plt.figure(figsize=(200, 5))
 
     print("Index", "Family", "Member_Count", "Max_Covering", "Max_Covering_Hashes", sep=",")
-    for i, fam in enumerate(family_covering):
-        fam_member_count = (proteins == fam).sum()
-        counts = np.array(list(family_covering[fam].values()))
+    for i, fam in enumerate(families):
+        fam_member_count = fam_member_counts[fam]
+        covering = family_covering.getrow(i)
+        counts = covering.data
         plt.boxplot(counts / fam_member_count, positions=[i], widths=.8)
         max_cov = counts.max() if len(counts) else 0
         print(
@@ -33,11 +32,11 @@ def plot_family_covering(db: str, mapman: str, plot_out: str):
             fam,
             fam_member_count,
             round(max_cov / fam_member_count, 2),
-            ";".join(sorted(str(h) for h, c in family_covering[fam].items() if c == max_cov)),
+            ";".join(sorted(str(h) for h in database.hashes[covering.indices[counts == max_cov]].tolist())),
             sep=","
         )
 
-    plt.xticks(range(0, len(family_covering), 50), labels=range(0, len(family_covering), 50))
+    plt.xticks(range(0, len(families), 50), labels=range(0, len(families), 50))
     ymin, ymax = plt.ylim()
     plt.ylim(ymin, 1 - ymin)
     plt.xlabel("Mapman Bin Index")
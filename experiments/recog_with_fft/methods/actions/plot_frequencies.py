@@ -8,14 +8,16 @@ from scipy.fft import fftfreq
 
 
 def plot_frequencies(prot_file: str, out_file: str, cpu_count=1, **kwargs):
-    fasta = Fasta(prot_file)
+    fasta = Fasta(prot_file, persist_index=True)
     protein_count = len(fasta)
     db_config = DBConfig(**{k: v for k, v in kwargs.items() if k in DBConfig._fields})
 
     if cpu_count > 1:
+        # contiguous ranges of records, so each process reads its own part of the file
+        first, *others = fasta.split(cpu_count)
         with Pool(cpu_count - 1) as p:
-            subprocesses = p.map_async(_process, ((fasta, slice(i, None, cpu_count), db_config) for i in range(1, cpu_count)))
-            sel_freqs, freqs_per_win, quantiles_per_win_without_first_ones = _process((fasta, slice(0, None, cpu_count), db_config))
+            subprocesses = p.map_async(_process, ((fasta, slc, db_config) for slc in others))
+            sel_freqs, freqs_per_win, quantiles_per_win_without_first_ones = _process((fasta, first, db_config))
             for res_sel_freqs, res_freqs_per_win, res_quantiles_per_win_without_first_ones in subprocesses.get():
                 freqs_per_win.extend(res_freqs_per_win)
                 quantiles_per_win_without_first_ones.extend(res_quantiles_per_win_without_first_ones)
@@ -67,22 +69,18 @@ def _process(args) -> Dict[float, Tuple[int, int]]:
     quantiles_per_win_without_first_ones = []
 
     for _, _, seq in fasta[prot_slice]:
-        constellation_map = create_constellation(get_aa_vector(seq), config)
-        all_freqs = set()
-        for window in constellation_map:
-            freqs_per_win.append(len(window))
-            win_quantiles = []
-            for freq_idx, _, quantile in window:
-                if freq_idx > config.n_peaks - 1:
-                    win_quantiles.append(quantile)
-                freq = FREQS[freq_idx]
-                freq_count, prot_count = selected_freqs[freq]
-                selected_freqs[freq] = (freq_count + 1, prot_count)
-                all_freqs.add(freq)
-            quantiles_per_win_without_first_ones.append(win_quantiles)
+        constellation = create_constellation(get_aa_vector(seq), config)
+        windows, freq_idx, quantiles = (constellation.peaks[field] for field in ("window", "freq", "quantile"))
+        freqs_per_win.extend(np.bincount(windows, minlength=constellation.window_count).tolist())
 
-        for freq in all_freqs:
+        later_ones = freq_idx > config.n_peaks - 1
+        window_bounds = np.searchsorted(windows[later_ones], np.arange(1, constellation.window_count))
+        quantiles_per_win_without_first_ones.extend(np.split(quantiles[later_ones].astype(int), window_bounds))
+
+        freq_counts = np.bincount(freq_idx, minlength=len(FREQS))
+        for freq_i in np.flatnonzero(freq_counts).tolist():
+            freq = FREQS[freq_i]
             freq_count, prot_count = selected_freqs[freq]
-            selected_freqs[freq] = (freq_count, prot_count + 1)
+            selected_freqs[freq] = (freq_count + int(freq_counts[freq_i]), prot_count + 1)
 
     return selected_freqs, freqs_per_win, quantiles_per_win_without_first_ones
@@ -1,18 +1,20 @@
 from tools import *
-from .algorithm import get_aa_vector, create_constellation, create_hashes
+from .algorithm import get_aa_vector, create_constellation, create_hashes, hash_layout
 import numpy as np
 from matplotlib import pyplot as plt
 from multiprocessing import Pool
 
 
 def plot_hash_frequencies(fasta: str, outfile: str, cpu_count=1, **kwargs):
-    fasta = Fasta(fasta)
+    fasta = Fasta(fasta, persist_index=True)
     db_config = DBConfig(**kwargs)
 
     if cpu_count > 1:
+        # contiguous ranges of records, so each process reads its own part of the file
+        first, *others = fasta.split(cpu_count)
         with Pool(cpu_count - 1) as p:
-            subprocesses = p.map_async(_process, ((fasta, slice(i, None, cpu_count), db_config) for i in range(1, cpu_count)))
-            position_counts = _process((fasta, slice(0, None, cpu_count), db_config))
+            subprocesses = p.map_async(_process, ((fasta, slc, db_config) for slc in others))
+            position_counts = _process((fasta, first, db_config))
 
             for sub_counts in subprocesses.get():
                 for k, v in sub_counts.items():
@@ -34,10 +36,11 @@ def plot_hash_frequencies(fasta: str, outfile: str, cpu_count=1, **kwargs):
 
 def _process(args):
     fasta, slc, config = args
+    layout = hash_layout(config)
     position_counts = {}
     for prot_id, _, seq in fasta[slc]:
         for kf in range(10):
-            hashes, pos_counts = create_hashes(create_constellation(get_aa_vector(seq, kf), config), prot_id, kf)
+            hashes, pos_counts = create_hashes(create_constellation(get_aa_vector(seq, kf), config), prot_id, kf, layout)
             for pos in pos_counts.values():
                 position_counts[pos] = position_counts.get(pos, 0) + 1
 
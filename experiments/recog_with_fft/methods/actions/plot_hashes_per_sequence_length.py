@@ -1,11 +1,9 @@
-import pickle
+from tools import load_db
 import matplotlib.pyplot as plt
-from .algorithm.hash_gen import FREQUENCY_BITS, DIFFERENCE_BITS
 
 
 def plot_hashes_per_sequence_length(database: str, out_file: str):
-    with open(database, "rb") as f:
-        db = pickle.load(f)
+    db = load_db(database)
 
     hashes_per_seqlen = {}
     for seqlen, hash_count in db.lookup.values():
@@ -1,16 +1,17 @@
-import pickle
+from tools import load_db
 import matplotlib.pyplot as plt
-from .algorithm.hash_gen import FREQUENCY_BITS, DIFFERENCE_BITS
+import numpy as np
 
 
 def plot_prots_per_windist(database: str, out_file: str):
-    with open(database, "rb") as f:
-        database = pickle.load(f).db
+    db = load_db(database)
+
+    prot_counts = db.db.posting_counts()
+    windists = db.layout.unpack(db.db.hashes, "diff")
 
     prots_per_windist = {}
-    for hash_, prots in database.items():
-        windist = (hash_ >> 2*FREQUENCY_BITS) % 2**DIFFERENCE_BITS
-        prots_per_windist[windist] = prots_per_windist.get(windist, []) + [len(prots)]
+    for windist in np.unique(windists).tolist():
+        prots_per_windist[windist] = prot_counts[windists == windist].tolist()
 
     plt.figure(figsize=(20, 10))
     plt.boxplot(prots_per_windist.values(), positions=list(prots_per_windist.keys()))
@@ -1,9 +1,7 @@
-import pickle
+from tools import load_db
 
 
 def print_hash_counts(database: str):
-    with open(database, "rb") as f:
-        lookup = pickle.load(f).lookup
+    lookup = load_db(database).lookup
 
-    _, hash_counts = zip(*lookup.values())
-    print(*hash_counts, sep=",", end="")
+    print(*lookup.hash_counts.tolist(), sep=",", end="")
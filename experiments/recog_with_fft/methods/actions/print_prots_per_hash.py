@@ -1,8 +1,7 @@
-import pickle
+from tools import load_db
 
 
 def print_prots_per_hash(database: str):
-    with open(database, "rb") as f:
-        database = pickle.load(f).db
+    database = load_db(database).db
 
-    print(*(len(prots) for prots in database.values()), sep=",", end="")
+    print(*database.posting_counts().tolist(), sep=",", end="")
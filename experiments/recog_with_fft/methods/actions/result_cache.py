@@ -0,0 +1,131 @@
+from tools import *
+import sqlite3
+import time
+
+CACHE_SIZE = 1024  # MB of results kept by a ResultCache, the least recently used ones are evicted
+
+
+class ResultCache:
+    """
+    An on-disk cache of the ranked matches of samples, in a SQLite file.
+    The results are keyed by the digest of the sample's sequence and a
+    fingerprint of everything else they depend on, see db_fingerprint, so
+    repeated sequences are only scored once, across runs and databases. When
+    the results exceed max_size MB, the least recently used ones are evicted
+
+    ...
+
+    Attributes
+    ----------
+    fingerprint : str
+        The fingerprint of the database and options of the results
+    max_size : float
+        The maximal size of the results in MB
+    hits : int
+        The number of samples found in the cache
+    misses : int
+        The number of samples not found in the cache
+    evictions : int
+        The number of results evicted
+    """
+    def __init__(self, cache_file: str, fingerprint: str, max_size=CACHE_SIZE):
+        assert max_size > 0, "cache size must be positive"
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connection = sqlite3.connect(cache_file)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "fingerprint TEXT, digest TEXT, result BLOB, size INTEGER, last_used REAL, "
+                "PRIMARY KEY (fingerprint, digest))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def get(self, seqs: List[Union[str, bytes]]) -> list:
+        """
+        Returns the cached results of the sequences, each the result's fields
+        after the sample identifier, or None if it is not cached
+        """
+        digests = [sequence_digest(seq) for seq in seqs]
+        found: Dict[str, bytes] = {}
+        for i in range(0, len(digests), 500):  # stays below SQLite's parameter limit
+            chunk = digests[i:i + 500]
+            found.update(self._connection.execute(
+                "SELECT digest, result FROM results WHERE fingerprint = ? AND digest IN (%s)" % ",".join("?" * len(chunk)),
+                [self.fingerprint, *chunk]
+            ))
+
+        with self._connection:
+            self._connection.executemany(
+                "UPDATE results SET last_used = ? WHERE fingerprint = ? AND digest = ?",
+                ((time.time(), self.fingerprint, digest) for digest in found)
+            )
+        self.hits += sum(digest in found for digest in digests)
+        self.misses += sum(digest not in found for digest in digests)
+
+        return [pickle.loads(found[digest]) if digest in found else None for digest in digests]
+
+    def put(self, seqs: List[Union[str, bytes]], results: list):
+        """
+        Stores the results of the sequences, each the result's fields after
+        the sample identifier, and evicts the least recently used ones
+        exceeding max_size
+        """
+        rows = []
+        for seq, result in zip(seqs, results):
+            blob = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            rows.append((self.fingerprint, sequence_digest(seq), blob, len(blob), time.time()))
+
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+            self._evict()
+
+    def _evict(self):
+        excess = self._connection.execute("SELECT TOTAL(size) FROM results").fetchone()[0] - self.max_size * 2**20
+        if excess <= 0:
+            return
+
+        evicted = []
+        for rowid, size in self._connection.execute("SELECT rowid, size FROM results ORDER BY last_used"):
+            evicted.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.executemany("DELETE FROM results WHERE rowid = ?", evicted)
+        self.evictions += len(evicted)
+
+    def report(self):
+        """
+        Prints the hit and miss counts to stderr
+        """
+        lookups = self.hits + self.misses
+        eprint(
+            "Result cache: %d hits, %d misses (%.0f%% hit rate), %d evicted"
+            % (self.hits, self.misses, self.hits / lookups * 100 if lookups else 0, self.evictions)
+        )
+
+    def close(self):
+        self._connection.close()
+
+
+def sequence_digest(seq: Union[str, bytes]) -> str:
+    return hashlib.sha256(seq if isinstance(seq, bytes) else seq.encode()).hexdigest()
+
+
+def db_fingerprint(db_in: str, db: DB, **options) -> str:
+    """
+    Returns the fingerprint of the results found with a database: its
+    configuration, hash layout and checksum, and the options passed, like the
+    filter quantile
+    """
+    identity = {
+        "config": db.config._asdict(),
+        "layout": {"fields": db.layout.fields, "width": db.layout.width},
+        "checksum": db_checksum(db_in),
+        "options": options
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
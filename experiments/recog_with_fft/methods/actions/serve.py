@@ -0,0 +1,314 @@
+from tools import *
+from .find_matches import COLUMNS, BATCH_SIZE, BATCHES_AHEAD, get_filtered_db, share_db, init_worker, match_batch_rows, fasta_batches
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.client import HTTPConnection, IncompleteRead
+from socketserver import ThreadingUnixStreamServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+from multiprocessing import Pool
+from functools import partial
+from itertools import chain
+from collections import deque
+from threading import Lock
+import signal
+import socket
+import time
+import sys
+import io
+
+LATENCY_WINDOW = 1000  # recent requests the latency percentiles are taken from
+
+
+def serve(
+        address: str,
+        db_in: str,
+        filter_quantile=1.0,
+        cpu_count=1,
+        batch_size=BATCH_SIZE
+        ):
+    """
+    Keeps the database loaded and answers find-matches queries sent by
+    query_server, until interrupted
+
+    The server speaks HTTP: 'POST /matches' takes a FASTA file as body and
+    streams back the csv rows find_matches prints for it, the options top_k
+    and min_rank_score can be passed as query parameters. 'GET /stats'
+    returns the request counts and latencies as JSON. The queries are scored
+    by a pool of worker processes, which memory-map the database
+
+    The rows are sent in chunks once the first batch is scored, so failures
+    before are answered by an error status, and failures after break off the
+    response without its last chunk, which query_server raises
+
+    ...
+
+    Parameters
+    ----------
+    address : str
+        The address to listen on, a port or HOST:PORT for HTTP over TCP,
+        otherwise the path of a Unix socket
+    db_in : str
+        Name of the file storing the trained database
+    filter_quantile : float
+        Quantile of hashes to be kept in database
+    cpu_count : int, optional
+        The number of worker processes
+    batch_size : int, optional
+        The number of samples hashed and scored together
+    """
+    assert filter_quantile > 0 and filter_quantile <= 1
+    assert cpu_count > 0, "cpu count must be positive"
+    assert batch_size > 0, "batch size must be positive"
+
+    database, hash_blacklist = get_filtered_db(db_in, filter_quantile)
+    hash_blacklist = np.array(hash_blacklist, dtype=database.layout.dtype)
+
+    with TemporaryDirectory() as tmp_dir:
+        db_in = share_db(database, db_in, filter_quantile, tmp_dir)
+        del database
+
+        with Pool(cpu_count, init_worker, (db_in, hash_blacklist)) as pool:
+            if (tcp_address := _tcp_address(address)) is not None:
+                server = ThreadingHTTPServer(tcp_address, _MatchRequestHandler)
+            else:
+                server = _ThreadingUnixHTTPServer(address, _MatchRequestHandler)
+
+            server.pool = pool
+            server.tmp_dir = tmp_dir
+            server.batch_size = batch_size
+            server.batches_ahead = BATCHES_AHEAD * cpu_count
+            server.stats = LatencyStats()
+
+            # stop on SIGTERM as on interrupts, removing the socket
+            signal.signal(signal.SIGTERM, _interrupt)
+            eprint("Serving matches on", address)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                if tcp_address is None:
+                    os.remove(address)
+
+
+def query_server(fasta_file: str, address: str, top_k=0, min_rank_score=0.):
+    """
+    Finds matches for the proteins defined in the FASTA file by a server
+    started by serve, and prints them to stdout like find_matches does
+
+    ...
+
+    Parameters
+    ----------
+    fasta_file : str
+        The path to the FASTA formatted file containing all protein sequences
+        of interest
+    address : str
+        The address the server listens on, see serve
+    top_k : int, optional
+        The number of best matches to print per sample, see find_matches
+    min_rank_score : float, optional
+        The minimal JSI * Score of a match to be printed
+    """
+    assert top_k >= 0, "top k must not be negative"
+
+    connection = _connect(address)
+    try:
+        with open(fasta_file, "rb") as f:
+            connection.request(
+                "POST",
+                "/matches?" + urlencode({"top_k": top_k, "min_rank_score": min_rank_score}),
+                body=f,
+                headers={"Content-Length": str(os.path.getsize(fasta_file)), "Content-Type": "text/x-fasta"}
+            )
+        response = connection.getresponse()
+        assert response.status == 200, "Server failed with %s: %s" % (response.status, response.read().decode(errors="replace"))
+
+        # print the rows as they arrive
+        try:
+            for line in io.TextIOWrapper(response, encoding="utf-8", newline=""):
+                sys.stdout.write(line)
+        except IncompleteRead as e:
+            raise RuntimeError("Server failed while answering, the matches printed are incomplete") from e
+    finally:
+        connection.close()
+
+
+def server_stats(address: str) -> dict:
+    """
+    Returns the counters of a server started by serve
+    """
+    connection = _connect(address)
+    try:
+        connection.request("GET", "/stats")
+        response = connection.getresponse()
+        assert response.status == 200, "Server failed with %s" % response.status
+        return json.load(response)
+    finally:
+        connection.close()
+
+
+class LatencyStats:
+    """
+    Thread-safe counters of the requests a server answered, and their
+    latencies in seconds
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = 0
+        self.errors = 0
+        self.samples = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+        self._recent = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, latency: float, samples: int, failed=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+            self.samples += samples
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._recent.append(latency)
+
+    def summary(self) -> dict:
+        with self._lock:
+            recent = np.array(self._recent, dtype=np.float64)
+            p50, p95 = np.percentile(recent, (50, 95)).tolist() if len(recent) else (0., 0.)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "samples": self.samples,
+                "latency_mean": self.total_latency / self.requests if self.requests else 0.,
+                "latency_p50": p50,
+                "latency_p95": p95,
+                "latency_max": self.max_latency
+            }
+
+
+class _MatchRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # for chunked responses
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/stats":
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.stats.summary()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/matches":
+            self.send_error(404)
+            return
+
+        start = time.perf_counter()
+        params = parse_qs(url.query)
+        try:
+            top_k = int(params.get("top_k", [0])[0])
+            min_rank_score = float(params.get("min_rank_score", [0.])[0])
+            assert top_k >= 0, "top k must not be negative"
+        except (ValueError, AssertionError) as e:
+            self.send_error(400, str(e))
+            return
+
+        samples = 0
+        with NamedTemporaryFile(dir=self.server.tmp_dir, suffix=".fa") as fasta:
+            # the FASTA file is spooled to disk, to be parsed like any other
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining > 0 and (block := self.rfile.read(min(remaining, 2**20))):
+                fasta.write(block)
+                remaining -= len(block)
+            fasta.flush()
+
+            # the request is recorded before its response ends, so the stats
+            # count it once the client got it
+            match_rows = partial(match_batch_rows, top_k=top_k, min_rank_score=min_rank_score)
+            scored_batches = self._scored_batches(fasta.name, match_rows)
+            try:
+                first_batch = next(scored_batches, None)
+            except Exception as e:
+                self.server.stats.record(time.perf_counter() - start, samples, failed=True)
+                self.send_error(500, "%s: %s" % (type(e).__name__, e))
+                return
+
+            # the status is sent once the first batch is scored, and the rows
+            # in chunks, whose end tells the client all arrived
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            try:
+                self._write_chunk(",".join(COLUMNS) + "\n")
+                for batch_samples, rows in scored_batches if first_batch is None else chain([first_batch], scored_batches):
+                    self._write_chunk(rows)
+                    samples += batch_samples
+            except BaseException:
+                self.server.stats.record(time.perf_counter() - start, samples, failed=True)
+                raise
+
+            self.server.stats.record(time.perf_counter() - start, samples)
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _scored_batches(self, fasta_file: str, match_rows) -> Generator[Tuple[int, str], None, None]:
+        # the batches are read lazily and scored by the workers, at most
+        # batches_ahead of the ones written
+        pending = deque()
+        for batch in fasta_batches(fasta_file, self.server.batch_size):
+            pending.append((len(batch), self.server.pool.apply_async(match_rows, (batch,))))
+            if len(pending) >= self.server.batches_ahead:
+                batch_samples, rows = pending.popleft()
+                yield batch_samples, rows.get()
+
+        while pending:
+            batch_samples, rows = pending.popleft()
+            yield batch_samples, rows.get()
+
+    def _write_chunk(self, text: str):
+        # empty chunks would end the response
+        if text:
+            data = text.encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def log_message(self, format, *args):
+        pass  # answering queries is no news, failures are raised anyways
+
+
+class _ThreadingUnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def _tcp_address(address: str) -> Union[Tuple[str, int], None]:
+    """
+    Returns the host and port of PORT or HOST:PORT addresses, by default on
+    localhost, or None for paths of Unix sockets
+    """
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port)) if port.isdigit() else None
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path: str):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def _connect(address: str) -> HTTPConnection:
+    if (tcp_address := _tcp_address(address)) is not None:
+        return HTTPConnection(*tcp_address)
+    return _UnixHTTPConnection(address)
@@ -2,11 +2,20 @@ from test import TestCase
 from tools import *
 import pandas as pd
 import pickle
+from multiprocessing import Process
+import asyncio
+import time
 import sys
 import os
+import zlib
+import struct
 
 from .create_db import *
 from .find_matches import *
+from .algorithm import hashes_from_seq, hashes_from_seqs
+from .serve import serve, query_server, server_stats
+from .result_cache import ResultCache, db_fingerprint
+from .all_vs_all import all_vs_all
 
 
 class TestCreateDB(TestCase):
@@ -29,6 +38,7 @@ class TestCreateDB(TestCase):
             )
 
         self.assertEqual(len(db.lookup), 3, "Protein lookup is not complete")
+        self.assertEqual(db.layout, HASH_LAYOUT, "Hash layout not stored in database")
 
         for hash_, idx_prot_pairs in db.db.items():
 
@@ -43,6 +53,205 @@ class TestCreateDB(TestCase):
             description, hash_count = prot_info
             self.assertGreaterEqual(hash_count, 0, "Hash count in protein lookup below zero")
 
+    def test_hash_index(self):
+        db = load_db(self.db_out)
+        database = {hash_: occs for hash_, occs in db.db.items()}
+        lookup = dict(db.lookup.items())
+
+        index = self.create_valid(
+            HashIndex,
+            HashIndex.from_database(database, ProteinTable.from_lookup(lookup))
+        )
+        self.assertEqual(index, db.db, "Index differs from its dictionary form")
+        self.assertEqual(index.posting_counts().tolist(), [len(occs) for occs in database.values()], "Wrong posting counts")
+        for hash_, occs in database.items():
+            self.assertIn(hash_, index, "Missing hash in index")
+            self.assertEqual(index[hash_], occs, "Postings changed their order")
+        self.assertEqual(index.find([max(database) + 1]).tolist(), [-1], "Found hash not in index")
+
+        queries = list(database)[::-2] + [max(database) + 1, 0]
+        self.assertIsNotNone(index.direct_table(), "Expected direct addressing for narrow hashes")
+        direct_ranges = index.posting_ranges(queries)
+        index._direct_table = None
+        positions = index.find(queries)
+        for i, (start, end) in enumerate(zip(*direct_ranges)):
+            expected = (index.offsets[positions[i]], index.offsets[positions[i] + 1]) if positions[i] >= 0 else (0, 0)
+            self.assertEqual((start, end), expected, "Directly addressed postings differ")
+
+        query, proteins, windows = self.create_valid(
+            Tuple[np.ndarray, np.ndarray, np.ndarray],
+            index.gather(queries)
+        )
+        for i, hash_ in enumerate(queries):
+            postings = query == i
+            self.assertEqual(
+                list(zip(windows[postings].tolist(), index.protein_ids[proteins[postings]].tolist())),
+                database.get(hash_, []),
+                "Gathered postings differ"
+            )
+        for joined, gathered in zip(index.join(queries), (query, proteins, windows)):
+            self.assertTrue(np.array_equal(joined, gathered), "Joined postings differ")
+
+        old_db_file = self.db_out + ".dict"
+        with open(old_db_file, "wb") as f:
+            pickle.dump(DB(database, lookup, db.config), f, pickle.HIGHEST_PROTOCOL)
+        converted = load_db(old_db_file)
+        os.remove(old_db_file)
+        self.assertEqual(converted.db, db.db, "Dictionary database falsely converted")
+        self.assertEqual(converted.lookup, db.lookup, "Dictionary lookup falsely converted")
+
+    def test_incidence(self):
+        db = load_db(self.db_out)
+        self.assertIsNotNone(db.db._incidence, "Incidence matrix not built by create_db")
+        incidence = self.create_valid(
+            sparse.csr_matrix,
+            db.db.incidence()
+        )
+        self.assertEqual(incidence.shape, (len(db.lookup), len(db.db)))
+        self.assertEqual(incidence.getnnz(axis=1).tolist(), db.lookup.hash_counts.tolist(), "Row sums are no hash counts")
+        self.assertEqual(np.asarray(incidence.sum(axis=0)).ravel().tolist(), db.db.posting_counts().tolist(), "Column sums are no posting counts")
+        for i, (_, occs) in enumerate(db.db.items()):
+            prots = incidence.getcol(i).nonzero()[0]
+            self.assertEqual(db.lookup.ids[prots].tolist(), [prot for _, prot in occs], "Incidence differs from postings")
+
+        keep = np.arange(len(db.db)) % 3 == 0
+        selected = db.db.select(keep)
+        self.assertEqual((selected.incidence() != incidence[:, keep]).nnz, 0, "Incidence not selected with the hashes")
+        selected._incidence = None
+        self.assertEqual((selected.incidence() != incidence[:, keep]).nnz, 0, "Incidence differs from the selected postings")
+
+    def test_create_db_parallel(self):
+        db_out = self.db_out[:-len(".pickle")] + "_parallel.pickle"
+        create_db(self.protein_file, db_out, cpu_count=2)
+        try:
+            parallel = load_db(db_out)
+        finally:
+            os.remove(db_out)
+
+        db = load_db(self.db_out)
+        self.assertEqual(parallel.lookup, db.lookup, "Proteins not in file order")
+        self.assertEqual(parallel.db, db.db, "Database differs from the one of a single process")
+
+    def test_fasta_index(self):
+        fasta_file = "test/fasta_index.fa"
+        with open(fasta_file, "w") as f:
+            f.write("preamble\n>A first protein\nACDE\nFG\n>B\nHIK\n\n>C last\nLMN")
+        try:
+            Fasta(fasta_file)
+            self.assertFalse(os.path.exists(fasta_file + FASTA_INDEX_SUFFIX), "Index stored without persist_index")
+            fasta = Fasta(fasta_file, persist_index=True)
+            self.assertTrue(os.path.exists(fasta_file + FASTA_INDEX_SUFFIX), "Index not stored as sidecar file")
+            self.assertEqual(fasta.index.ids.tolist(), ["A", "B", "C"])
+            entries = list(fasta)
+            self.assertEqual(entries, [("A", "first protein", "ACDEFG"), ("B", "", "HIK"), ("C", "last", "LMN")])
+            self.assertEqual(entries, list(Fasta(fasta_file, check=False)), "Index changes the entries")
+            self.assertEqual(list(fasta[1::2]), entries[1::2], "Slice not seeked")
+            self.assertEqual(list(Fasta(fasta_file, check=False)[1:]), entries[1:], "Unchecked slice differs")
+            for undecoded in (Fasta(fasta_file, decode=False), Fasta(fasta_file, check=False, decode=False)):
+                self.assertEqual(
+                    list(undecoded), [(prot_id, desc, seq.encode()) for prot_id, desc, seq in entries], "Sequences not left as bytes"
+                )
+
+            for parts in range(1, 5):
+                slices = fasta.split(parts)
+                self.assertEqual(len(slices), parts)
+                self.assertEqual([entry for slc in slices for entry in fasta[slc]], entries, "Split not contiguous")
+
+            # reused while the file is unchanged, rebuilt once it's modified
+            fasta.index._replace(ids=np.array(["X", "Y", "Z"])).save(fasta_file + FASTA_INDEX_SUFFIX)
+            self.assertEqual(fasta_index(fasta_file, persist=True).ids.tolist(), ["X", "Y", "Z"], "Index of unchanged file not reused")
+            self.assertEqual(fasta_index(fasta_file).ids.tolist(), ["A", "B", "C"], "Sidecar used without persist")
+            with open(fasta_file, "a") as f:
+                f.write("\n>D\nPQ\n")
+            self.assertEqual(len(Fasta(fasta_file, persist_index=True)), 4, "Index of modified file reused")
+
+            # line breaks of other platforms are read like in text mode
+            for line_break in (b"\r\n", b"\r"):
+                with open(fasta_file, "rb") as f:
+                    text = f.read()
+                with open(fasta_file, "wb") as f:
+                    f.write(text.replace(b"\n", line_break))
+                self.assertEqual(list(Fasta(fasta_file)), [*entries, ("D", "", "PQ")], "Line breaks not removed")
+                with open(fasta_file, "wb") as f:
+                    f.write(text)
+
+            # only sequences of ASCII letters are left as bytes
+            with open(fasta_file, "a", encoding="utf-8") as f:
+                f.write(">E\nAΨ\nC\n")
+            self.assertEqual(list(Fasta(fasta_file, decode=False))[-2:], [("D", "", b"PQ"), ("E", "", "AΨC")], "Non-ASCII sequence not decoded")
+        finally:
+            for name in (fasta_file, fasta_file + FASTA_INDEX_SUFFIX):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def test_compressed_fasta(self):
+        with open(self.protein_file, "rb") as f:
+            text = f.read()
+        entries = list(Fasta(self.protein_file))
+
+        # BGZF blocks are gzip members of raw deflated data, here of 64 bytes
+        # each, with their size as extra field
+        bgzf = b""
+        block_offsets = []
+        for i in [*range(0, len(text), 64), len(text)]:
+            block_offsets.append((len(bgzf), i))
+            block = text[i:i + 64]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(block) + compressor.flush()
+            bgzf += b"\x1f\x8b\x08\x04" + bytes(6) + struct.pack("<HBBHH", 6, 66, 67, 2, len(deflated) + 25)
+            bgzf += deflated + struct.pack("<II", zlib.crc32(block), len(block))
+
+        for compression, data in (("gzip", gzip.compress(text)), ("bz2", bz2.compress(text)), ("bgzf", bgzf)):
+            fasta_file = self.protein_file + "." + compression
+            with open(fasta_file, "wb") as f:
+                f.write(data)
+            try:
+                fasta = Fasta(fasta_file)
+                self.assertEqual(fasta.compression, compression, "Compression not recognized")
+                self.assertEqual(list(fasta), entries, "Compressed file read differently")
+                self.assertEqual(list(Fasta(fasta_file, check=False)), entries, "Unchecked compressed file read differently")
+                self.assertEqual([entry for slc in fasta.split(2) for entry in fasta[slc]], entries, "Split not contiguous")
+                self.assertEqual(list(fasta[2:]), entries[2:], "Slice not seeked")
+                if compression == "bgzf":
+                    self.assertEqual(list(map(tuple, fasta.index.blocks.tolist())), block_offsets, "Wrong block offsets")
+            finally:
+                for name in (fasta_file, fasta_file + FASTA_INDEX_SUFFIX):
+                    if os.path.exists(name):
+                        os.remove(name)
+
+    def test_save_db(self):
+        db = load_db(self.db_out)
+        db.db.sketch(8)
+        db_dir = self.db_out[:-len(".pickle")]
+        save_db(db, db_dir)
+        try:
+            mapped = self.create_valid(
+                DB,
+                load_db(db_dir)
+            )
+
+            # the sketches of a selected index are left to lsh
+            selected = db.db.select(np.ones(len(db.db), dtype=bool))
+            save_db(DB(selected, *db[1:]), db_dir)
+            self.assertFalse(os.path.exists(os.path.join(db_dir, DB_SKETCHES + ".npy")), "Sketches computed for saving")
+            unsketched = load_db(db_dir).db
+            self.assertEqual((unsketched.sketches, unsketched.sketch_size), (None, 8), "Sketch size not saved")
+            unsketched.lsh(4)
+            self.assertTrue(np.array_equal(unsketched.sketches, db.db.sketches), "Sketches not computed by lsh")
+        finally:
+            for name in os.listdir(db_dir):
+                os.remove(os.path.join(db_dir, name))
+            os.rmdir(db_dir)
+
+        self.assertIsInstance(mapped.db.proteins, np.memmap, "Arrays are not memory-mapped")
+        self.assertIsInstance(mapped.db._incidence[1], np.memmap, "Incidence matrix not persisted")
+        self.assertEqual((mapped.db.incidence() != db.db.incidence()).nnz, 0, "Incidence matrix changed by saving")
+        self.assertTrue(np.array_equal(mapped.db.sketches, db.db.sketches), "Sketches changed by saving")
+        self.assertEqual(mapped.db, db.db, "Database changed by saving")
+        self.assertEqual(mapped.lookup, db.lookup, "Protein lookup changed by saving")
+        self.assertEqual(mapped.config, db.config, "Configuration changed by saving")
+        self.assertEqual(mapped.layout, db.layout, "Hash layout changed by saving")
+
 
 class TestFindMatches(TestCase):
     protein_file = "test/create_db.fa"
@@ -71,6 +280,59 @@ class TestFindMatches(TestCase):
             sys.stdout = f
             self.assertIsNone(find_matches(self.protein_file, self.db_in))
 
+    def test_find_matches_parallel(self):
+        outputs = []
+        for cpu_count in (1, 2):
+            with open(self.stdout_pipe, "w") as f:
+                sys.stdout = f
+                self.assertIsNone(find_matches(self.protein_file, self.db_in, filter_quantile=.8, batch_size=1, cpu_count=cpu_count))
+            sys.stdout = sys.__stdout__
+            with open(self.stdout_pipe) as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1], "Parallel output differs")
+
+    def test_stream_matches(self):
+        async def collect(limit=None, **kwargs):
+            results = []
+            async for result in stream_matches(self.protein_file, self.db_in, batch_size=1, **kwargs):
+                results.append(self.create_valid(MatchResult, result))
+                if len(results) == limit:
+                    break
+            return results
+
+        results = asyncio.run(collect(top_k=1))
+        self.assertEqual([result.input_id for result in results], [prot_id for prot_id, *_ in Fasta(self.protein_file)], "Samples missing or unordered")
+        for result in results:
+            self.assertEqual(result.matches.match_ids[0], result.input_id, "Sample not matched best with itself")
+
+        self.assertEqual(len(asyncio.run(collect(limit=1, cpu_count=2))), 1, "Stream not stoppable")
+
+    def test_result_cache(self):
+        cache_file = "test/find_matches.cache"
+        outputs = []
+        try:
+            for _ in range(2):
+                with open(self.stdout_pipe, "w") as f:
+                    sys.stdout = f
+                    self.assertIsNone(find_matches(self.protein_file, self.db_in, cache_file=cache_file))
+                sys.stdout = sys.__stdout__
+                with open(self.stdout_pipe) as f:
+                    outputs.append(f.read())
+            self.assertEqual(outputs[0], outputs[1], "Cached output differs")
+
+            cache = ResultCache(cache_file, db_fingerprint(self.db_in, load_db(self.db_in), filter_quantile=1., top_k=0, min_rank_score=0.))
+            seqs = [seq for *_, seq in Fasta(self.protein_file)]
+            self.assertNotIn(None, cache.get(seqs), "Results not cached")
+            self.assertEqual(cache.get(["A"]), [None], "Unknown sequence cached")
+            self.assertEqual((cache.hits, cache.misses), (len(seqs), 1), "Wrong cache statistics")
+
+            cache.max_size = 1e-6
+            cache.put(["A"], [(1, 0, rank_matches({}))])
+            self.assertEqual(cache.get(seqs + ["A"]), [None] * len(seqs) + [None], "Least recently used results not evicted")
+            cache.close()
+        finally:
+            os.remove(cache_file)
+
     def test_score_prots(self):
         with open(self.db_in, "rb") as f:
             db, lookup = pickle.load(f)[:2]
@@ -86,6 +348,99 @@ class TestFindMatches(TestCase):
         self.assertEqual(db, self.db, "Database has changed")
         self.assertEqual(lookup, self.lookup, "Database has changed")
 
+    def test_score_index(self):
+        db = load_db(self.db_in)
+        database = dict(db.db.items())
+        lookup = dict(db.lookup.items())
+
+        for i, (_, _, seq) in enumerate(Fasta(self.protein_file)):
+            hashes = hashes_from_seq(seq[i:], None, db.config)
+            scores: ScoresMap = self.create_valid(
+                ScoresMap,
+                score_index(hashes, db.db, db.lookup)
+            )
+            self.assertEqual(list(scores.items()), list(score_prots(hashes, database, lookup).items()), "Scores differ")
+
+    def test_score_batch(self):
+        db = load_db(self.db_in)
+        seqs = [seq[i:] for i, (_, _, seq) in enumerate(Fasta(self.protein_file))] + ["", "AC"]
+
+        hashes, windows, hash_offsets = hashes_from_seqs(seqs, db.config)
+        scored_batch: List[ScoresMap] = self.create_valid(
+            List[ScoresMap],
+            score_batch(hashes, windows, hash_offsets, db.db, db.lookup)
+        )
+        self.assertEqual(len(scored_batch), len(seqs), "Expected scores per sample")
+        for seq, scores in zip(seqs, scored_batch):
+            expected = score_index(hashes_from_seq(seq, None, db.config), db.db, db.lookup)
+            self.assertEqual(list(scores.items()), list(expected.items()), "Batch scores differ")
+
+        for top_k, min_rank_score in ((1, 0.), (2, 0.), (0, 1.), (3, 2.)):
+            pruned_batch = score_batch(hashes, windows, hash_offsets, db.db, db.lookup, top_k, min_rank_score)
+            for scores, pruned in zip(scored_batch, pruned_batch):
+                self.assertLessEqual(pruned.items(), scores.items(), "Pruned scores differ")
+                self.assertEqual(
+                    rank_matches(pruned, top_k, min_rank_score).match_ids,
+                    rank_matches(scores, top_k, min_rank_score).match_ids,
+                    "Pruned needed matches"
+                )
+        unreachable = score_batch(hashes, windows, hash_offsets, db.db, db.lookup, min_rank_score=np.inf)
+        self.assertEqual(unreachable, [{} for _ in seqs], "Scored proteins missing the threshold")
+
+        blacklist = hashes[::3]
+        kept_hashes, _, kept_offsets = remove_hashes(hashes, windows, hash_offsets, blacklist)
+        for i, seq in enumerate(seqs):
+            expected = [hash_ for hash_ in hashes_from_seq(seq, None, db.config) if hash_ not in blacklist]
+            self.assertEqual(kept_hashes[kept_offsets[i]:kept_offsets[i + 1]].tolist(), expected, "Falsely removed hashes")
+
+    def test_score_candidates(self):
+        db = load_db(self.db_in)
+        db.db.sketch(16)
+        entries = list(Fasta(self.protein_file))
+        seqs = [seq for _, _, seq in entries] + ["", "AC"]
+
+        hashes, windows, hash_offsets = hashes_from_seqs(seqs, db.config)
+        sketches = self.create_valid(
+            np.ndarray,
+            minhash_sketches(hashes, hash_offsets, 16)
+        )
+        self.assertTrue(np.array_equal(sketches[:len(entries)], db.db.sketches), "Sketches of samples and database differ")
+
+        selected = db.db.select(np.ones(len(db.db), dtype=bool))
+        self.assertIsNone(selected.sketches, "Sketches computed by select")
+        selected.lsh(4)
+        self.assertTrue(np.array_equal(selected.sketches, db.db.sketches), "Sketches not computed by lsh")
+
+        candidate_samples, candidate_proteins = db.db.lsh(4).candidates(sketches)
+        for i, (prot_id, *_) in enumerate(entries):
+            self.assertIn(prot_id, db.lookup.ids[candidate_proteins[candidate_samples == i]].tolist(), "Identical protein not found")
+
+        scored_batch = score_batch(hashes, windows, hash_offsets, db.db, db.lookup)
+        for candidate_batch in (
+                score_candidates(hashes, windows, hash_offsets, candidate_samples, candidate_proteins, db.db, db.lookup),
+                score_batch(hashes, windows, hash_offsets, db.db, db.lookup, lsh_bands=4)
+                ):
+            for i, (scores, candidate_scores) in enumerate(zip(scored_batch, candidate_batch)):
+                candidates = db.lookup.ids[candidate_proteins[candidate_samples == i]].tolist()
+                expected = [(prot_id, score) for prot_id, score in scores.items() if prot_id in candidates]
+                self.assertEqual(list(candidate_scores.items()), expected, "Candidate scores differ")
+
+    def test_rank_matches(self):
+        scores: ScoresMap = self.create_valid(
+            ScoresMap,
+            {"a": (0, 2, .5), "b": (0, 4, .5), "c": (0, 1, 1.), "d": (0, 1, .5)}
+        )
+        ranked = self.create_valid(
+            RankedMatches,
+            rank_matches(scores)
+        )
+        self.assertEqual(ranked.match_ids, ["b", "a", "c", "d"], "Matches not ordered by rank")
+        self.assertEqual(ranked.ranks.tolist(), [1, 2, 2, 3], "Expected dense ranks")
+
+        self.assertEqual(rank_matches(scores, top_k=2).match_ids, ["b", "a", "c"], "Ties of the k-th match dropped")
+        self.assertEqual(rank_matches(scores, min_rank_score=1.).match_ids, ["b", "a", "c"], "Low scores not dropped")
+        self.assertEqual(rank_matches({}, top_k=1).match_ids, [], "Expected no matches")
+
     def test_get_matches_per_prot(self):
         hashes: Hashes = self.create_valid(
             Hashes,
@@ -154,6 +509,119 @@ class TestFindMatches(TestCase):
             )
 
 
+class TestServe(TestCase):
+    protein_file = "test/create_db.fa"
+    db_in = "test/serve.pickle"
+    address = "test/serve.sock"
+    stdout_pipe = "test/serve.matches.tmp"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.assertIsNone(cls, create_db(cls.protein_file, cls.db_in))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.db_in)
+
+    def tearDown(self):
+        sys.stdout = sys.__stdout__
+        if os.path.exists(self.stdout_pipe):
+            os.remove(self.stdout_pipe)
+
+    def test_query_server(self):
+        server = Process(target=serve, args=(self.address, self.db_in), kwargs={"filter_quantile": .8})
+        server.start()
+        try:
+            while not os.path.exists(self.address):
+                self.assertTrue(server.is_alive(), "Server died")
+                time.sleep(.1)
+
+            outputs = []
+            for query in (lambda: find_matches(self.protein_file, self.db_in, filter_quantile=.8, top_k=1),
+                          lambda: query_server(self.protein_file, self.address, top_k=1)):
+                with open(self.stdout_pipe, "w") as f:
+                    sys.stdout = f
+                    self.assertIsNone(query())
+                sys.stdout = sys.__stdout__
+                with open(self.stdout_pipe) as f:
+                    outputs.append(f.read())
+            self.assertEqual(outputs[0], outputs[1], "Server answered differently")
+
+            # failing before any batch is scored is answered by an error status
+            with open(self.stdout_pipe, "wb") as f:
+                f.write(b">A\n\xff\xfe\n")
+            with self.assertRaises(AssertionError, msg="Failure not reported"):
+                query_server(self.stdout_pipe, self.address)
+
+            stats = server_stats(self.address)
+            self.assertEqual((stats["requests"], stats["errors"], stats["samples"]), (2, 1, 3), "Wrong request counters")
+            self.assertGreater(stats["latency_max"], 0, "Latency not measured")
+        finally:
+            server.terminate()
+            server.join()
+        self.assertFalse(os.path.exists(self.address), "Socket not removed")
+
+
+class TestAllVsAll(TestCase):
+    protein_file = "test/create_db.fa"
+    db_in = "test/all_vs_all.pickle"
+    stdout_pipe = "test/all_vs_all.edges.tmp"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.assertIsNone(cls, create_db(cls.protein_file, cls.db_in))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.db_in)
+
+    def tearDown(self):
+        sys.stdout = sys.__stdout__
+        if os.path.exists(self.stdout_pipe):
+            os.remove(self.stdout_pipe)
+
+    def test_all_vs_all(self):
+        db = load_db(self.db_in)
+        hashes_per_prot: Dict[int, set] = {}
+        for hash_, prot in zip(np.repeat(db.db.hashes, db.db.posting_counts()).tolist(), db.db.proteins.tolist()):
+            hashes_per_prot.setdefault(prot, set()).add(hash_)
+
+        expected = []
+        for a, b in ((a, b) for a in hashes_per_prot for b in hashes_per_prot if a < b):
+            intersection = len(hashes_per_prot[a] & hashes_per_prot[b])
+            if intersection:
+                jsi = intersection / len(hashes_per_prot[a] | hashes_per_prot[b])
+                expected.append((db.lookup.ids[a], db.lookup.ids[b], intersection, jsi))
+        expected.sort()
+
+        outputs = []
+        for cpu_count, tile_size in ((1, 256), (2, 1)):
+            with open(self.stdout_pipe, "w") as f:
+                sys.stdout = f
+                self.assertIsNone(all_vs_all(self.db_in, cpu_count=cpu_count, tile_size=tile_size))
+            sys.stdout = sys.__stdout__
+            with open(self.stdout_pipe) as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1], "Tiles or processes changed the edges")
+
+        edges = pd.read_csv(self.stdout_pipe)
+        self.assertListEqual(list(edges.columns), ["Protein_ID", "Match_Protein_ID", "Intersection", "JSI"])
+        found = sorted(edges.itertuples(index=False, name=None))
+        self.assertListEqual([edge[:3] for edge in found], [edge[:3] for edge in expected], "Wrong protein pairs")
+        for edge, expected_edge in zip(found, expected):
+            self.assertAlmostEqual(edge[3], expected_edge[3], places=5)
+
+        # the JSI threshold only drops pairs
+        min_jsi = float(np.median([edge[3] for edge in expected]))
+        with open(self.stdout_pipe, "w") as f:
+            sys.stdout = f
+            self.assertIsNone(all_vs_all(self.db_in, min_jsi=min_jsi))
+        sys.stdout = sys.__stdout__
+        edges = pd.read_csv(self.stdout_pipe)
+        self.assertTrue((edges["JSI"] >= min_jsi - 1e-6).all(), "Edges below the JSI threshold")
+        self.assertEqual(len(edges), sum(edge[3] >= min_jsi for edge in expected))
+
+
 class TestEvaluateProtfin(TestCase):
     ...
 
@@ -4,6 +4,7 @@ This module is to do some statistic analysis on the protfin results
 
 from actions import *
 from protfin import cli_dbconfig
+from actions.evaluate_lsh import LSH_BANDS
 import argparse
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)  # fixes weird python error, look: https://newbebweb.blogspot.com/2012/02/python-head-ioerror-errno-32-broken.html
@@ -35,6 +36,22 @@ def get_cli():
     eval_parser.add_argument("mapman-file")
     eval_parser.set_defaults(func=lambda args: evaluate_protfin(getattr(args, "protfin-out-file"), getattr(args, "mapman-file")))
 
+    # evaluation.py lsh-report [-d] <fasta-file>
+    eval_parser = sub_commands.add_parser("lsh-report", help="Compare recall and speed of 'find-matches --lsh-bands' to exhaustive scoring")
+    eval_parser.add_argument("fasta-file")
+    eval_parser.add_argument("-d", "--database", default="database")
+    eval_parser.add_argument("-f", "--filter", default=1., type=float)
+    eval_parser.add_argument("-b", "--bands", default=LSH_BANDS, nargs="+", type=int, help="numbers of bands to be evaluated")
+    eval_parser.add_argument("-t", "--top-k", default=10, type=int, help="number of best matches per sample the recall refers to")
+    eval_parser.set_defaults(func=lambda args:
+                             evaluate_lsh(
+                                getattr(args, "fasta-file"),
+                                args.database,
+                                bands=args.bands,
+                                filter_quantile=args.filter,
+                                top_k=args.top_k
+                             ))
+
     # evaluation.py select-samples [-s] <mapman-file> <protein-file>
     eval_parser = sub_commands.add_parser("select-samples", help="Select samples from reference")
     eval_parser.add_argument("mapman-file")
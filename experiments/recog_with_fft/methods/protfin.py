@@ -6,11 +6,13 @@ features of their amino acid sequences
 
 import argparse
 from tools import DBConfig
-from actions import create_db, find_matches, match_family
+from actions import create_db, convert_db, find_matches, stream_matches, match_family, serve, query_server, all_vs_all
+from actions.find_matches import BATCH_SIZE, CACHE_SIZE
+from actions.all_vs_all import TILE_SIZE
 from signal import signal, SIGPIPE, SIG_DFL
 signal(SIGPIPE, SIG_DFL)  # fixes weird python error, look: https://newbebweb.blogspot.com/2012/02/python-head-ioerror-errno-32-broken.html
 
-DB_DEFAULT = "database.pickle"
+DB_DEFAULT = "database"
 
 
 def main():
@@ -38,25 +40,90 @@ def get_cli():
     create_db_parser.add_argument("fasta-file")
     create_db_parser.add_argument("-p", "--path", default=DB_DEFAULT)
     create_db_parser.add_argument("-c", "--cpu", default=1, type=int)
+    create_db_parser.add_argument("--minhash", default=0, type=int, help="number of MinHash values sketching each protein for 'find-matches --lsh-bands'")
     create_db_parser, dbconfig = cli_dbconfig(create_db_parser)
     create_db_parser.set_defaults(func=lambda args:
                                   create_db(
                                       getattr(args, "fasta-file"),
                                       db_out=args.path,
                                       cpu_count=args.cpu,
+                                      sketch_size=args.minhash,
                                       **dbconfig(args)
                                   ))
 
+    # protfin.py convert-db [-p] <database>
+    convert_db_parser = sub_commands.add_parser("convert-db", help="Convert Database between pickle and memory-mapped format")
+    convert_db_parser.add_argument("database")
+    convert_db_parser.add_argument("-p", "--path", default=None, help="defaults to the database's name without '.pickle', or with it if there is none")
+    convert_db_parser.set_defaults(func=lambda args:
+                                   convert_db(
+                                       args.database,
+                                       db_out=args.path or converted_db_name(args.database)
+                                   ))
+
     # protfin.py find-matches [-d] <fasta-file>
     find_match_parser = sub_commands.add_parser("find-matches", help="Find Matches for Proteins")
     find_match_parser.add_argument("fasta-file")
     find_match_parser.add_argument("-d", "--database", default=DB_DEFAULT)
     find_match_parser.add_argument("-f", "--filter", default=1., type=float)
+    find_match_parser.add_argument("-t", "--top-k", default=0, type=int, help="print only the k best matches per sample, including ties; 0 prints all")
+    find_match_parser.add_argument("--min-rank-score", default=0., type=float, help="print only matches with at least this JSI * Score")
+    find_match_parser.add_argument("--batch-size", default=BATCH_SIZE, type=int, help="number of samples hashed and scored together")
+    find_match_parser.add_argument("--lsh-bands", default=0, type=int, help="score only the candidates found by this many bands of the MinHash sketches, see 'create-db --minhash'; 0 scores all")
+    find_match_parser.add_argument("-c", "--cpu", default=1, type=int)
+    find_match_parser.add_argument("--server", default=None, help="address of a running 'serve', which then finds the matches with its database and settings")
+    find_match_parser.add_argument("--cache", default=None, help="file caching the matches of scored sequences, which are printed again instead of scoring them")
+    find_match_parser.add_argument("--cache-size", default=CACHE_SIZE, type=float, help="MB of cached matches, the least recently used ones are evicted beyond")
     find_match_parser.set_defaults(func=lambda args:
                                    find_matches(
                                        getattr(args, "fasta-file"),
                                        db_in=args.database,
-                                       filter_quantile=args.filter
+                                       filter_quantile=args.filter,
+                                       top_k=args.top_k,
+                                       min_rank_score=args.min_rank_score,
+                                       batch_size=args.batch_size,
+                                       cpu_count=args.cpu,
+                                       cache_file=args.cache,
+                                       cache_size=args.cache_size,
+                                       lsh_bands=args.lsh_bands
+                                   ) if args.server is None else
+                                   query_server(
+                                       getattr(args, "fasta-file"),
+                                       args.server,
+                                       top_k=args.top_k,
+                                       min_rank_score=args.min_rank_score
+                                   ))
+
+    # protfin.py serve [-d] <address>
+    serve_parser = sub_commands.add_parser("serve", help="Keep the Database loaded to answer 'find-matches --server'")
+    serve_parser.add_argument("address", help="port or HOST:PORT to listen on by HTTP, otherwise the path of a Unix socket")
+    serve_parser.add_argument("-d", "--database", default=DB_DEFAULT)
+    serve_parser.add_argument("-f", "--filter", default=1., type=float)
+    serve_parser.add_argument("--batch-size", default=BATCH_SIZE, type=int, help="number of samples hashed and scored together")
+    serve_parser.add_argument("-c", "--cpu", default=1, type=int, help="number of worker processes")
+    serve_parser.set_defaults(func=lambda args:
+                              serve(
+                                  args.address,
+                                  db_in=args.database,
+                                  filter_quantile=args.filter,
+                                  cpu_count=args.cpu,
+                                  batch_size=args.batch_size
+                              ))
+
+    # protfin.py all-vs-all [-d]
+    all_vs_all_parser = sub_commands.add_parser("all-vs-all", help="Compare all Proteins of the Database with each other")
+    all_vs_all_parser.add_argument("-d", "--database", default=DB_DEFAULT)
+    all_vs_all_parser.add_argument("-f", "--filter", default=1., type=float)
+    all_vs_all_parser.add_argument("--min-jsi", default=0., type=float, help="print only pairs with at least this JSI")
+    all_vs_all_parser.add_argument("--tile-size", default=TILE_SIZE, type=int, help="number of proteins compared with all others at once")
+    all_vs_all_parser.add_argument("-c", "--cpu", default=1, type=int)
+    all_vs_all_parser.set_defaults(func=lambda args:
+                                   all_vs_all(
+                                       args.database,
+                                       filter_quantile=args.filter,
+                                       min_jsi=args.min_jsi,
+                                       cpu_count=args.cpu,
+                                       tile_size=args.tile_size
                                    ))
 
     # protfin.py match-family [-d] <fasta-file>
@@ -74,6 +141,11 @@ def get_cli():
     return parser
 
 
+def converted_db_name(db_in: str) -> str:
+    db_in = db_in.rstrip("/")
+    return db_in[:-len(".pickle")] if db_in.endswith(".pickle") else db_in + ".pickle"
+
+
 def cli_dbconfig(parser: argparse.ArgumentParser):
     default_config = DBConfig()
     parser.add_argument("-w", "--window-size", default=default_config.window_size, type=int)
@@ -82,13 +154,17 @@ def cli_dbconfig(parser: argparse.ArgumentParser):
     parser.add_argument("-s", "--significance", default=default_config.significance, type=float)
     parser.add_argument("-m", "--selection-method", default=default_config.selection_method, choices=("none", "absolute", "deviation"), type=str)
     parser.add_argument("-k", "--skip-first-k-freqs", default=default_config.skip_first_k_freqs, type=int)
+    parser.add_argument("-b", "--hash-width", default=default_config.hash_width, choices=(32, 64), type=int, help="the most bits per hash")
+    parser.add_argument("--amplitude-bits", default=default_config.amplitude_bits, type=int, help="compare the amplitudes of paired peaks in the hashes by this many bits; 0 doesn't")
     return parser, lambda args: {
         "window_size": args.window_size,
         "overlap": args.overlap,
         "n_peaks": args.npeaks,
         "selection_method": args.selection_method,
         "significance": args.significance,
-        "skip_first_k_freqs": args.skip_first_k_freqs
+        "skip_first_k_freqs": args.skip_first_k_freqs,
+        "hash_width": args.hash_width,
+        "amplitude_bits": args.amplitude_bits
     }
 
 
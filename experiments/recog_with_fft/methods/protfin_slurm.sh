@@ -17,10 +17,10 @@ function sbatch_script() {
 #SBATCH --error=../results/${exp}/_logs/%x%j_slurm.err
 
 echo createdb >&2
-python3 protfin.py create-db -s ${significance} -w ${window_size} -o ${overlap} -n ${peaks} -m ${selection_method} -k ${skip_k_freqs} -p ${result_name}.pickle $1
+python3 protfin.py create-db -s ${significance} -w ${window_size} -o ${overlap} -n ${peaks} -m ${selection_method} -k ${skip_k_freqs} -p ${result_name}.db $1
 
 echo findmatches >&2
-python3 protfin.py find-matches -d ${result_name}.pickle ../results/${exp}/_test_selection.fa > ${result_name}.matches
+python3 protfin.py find-matches -d ${result_name}.db ../results/${exp}/_test_selection.fa > ${result_name}.matches
 
 echo eval >&2
 python3 evaluation.py eval ${result_name}.matches $2 > ${result_name}.summary.csv
@@ -2,12 +2,21 @@
 Some essential and useful functions for the algorithm behind prot-fin
 """
 
-from typing import List, Dict, Tuple, Generator, TextIO, _GenericAlias, NamedTuple
+from typing import List, Dict, Tuple, Generator, TextIO, BinaryIO, _GenericAlias, NamedTuple, Union
 import pandas as pd
 from sys import stderr
 from tqdm import tqdm
 import numpy as np
+from scipy import sparse
+import pickle
+import hashlib
+import json
+import os
 import re
+import mmap
+import gzip
+import bz2
+from itertools import islice
 
 # type aliases
 Hash = int
@@ -23,6 +32,15 @@ Database = Dict[Hash, List[HashOccurence]]
 ProteinLookup = Dict[ProteinID, Tuple[int, int]]
 ConstellationMap = List[Tuple[Tuple[int, float, int], ...]]
 
+# a peak of a constellation: the STFT window it is found in, its frequency
+# index, its amplitude and the flag of the quantile tail it was selected for
+CONSTELLATION_DTYPE = np.dtype([
+    ("window", np.uint32),
+    ("freq", np.uint16),
+    ("amplitude", np.float32),
+    ("quantile", np.uint8)
+])
+
 
 class DBConfig(NamedTuple):
     window_size: int = 30
@@ -31,12 +49,819 @@ class DBConfig(NamedTuple):
     significance: float = 5.  # for quantile selection in percent
     selection_method: str = "none"
     skip_first_k_freqs: int = 0
+    hash_width: int = 32  # the most bits per hash, 32 or 64
+    amplitude_bits: int = 0  # for comparing the amplitudes of paired peaks, 0 for none
+
+
+class Constellation(NamedTuple):
+    """
+    The array form of a ConstellationMap
+
+    ...
+
+    Attributes
+    ----------
+    peaks : np.ndarray
+        A structured array of CONSTELLATION_DTYPE, ordered by window
+    window_count : int
+        The number of STFT windows, including the ones without peaks
+    """
+    peaks: np.ndarray
+    window_count: int
+
+    @classmethod
+    def from_map(cls, constellation_map: ConstellationMap) -> "Constellation":
+        peaks = np.array(
+            [(window, *peak) for window, window_peaks in enumerate(constellation_map) for peak in window_peaks],
+            dtype=CONSTELLATION_DTYPE
+        )
+        return cls(peaks, len(constellation_map))
+
+    def to_map(self) -> ConstellationMap:
+        peaks = list(zip(self.peaks["freq"].tolist(), self.peaks["amplitude"].tolist(), self.peaks["quantile"].tolist()))
+        bounds = np.searchsorted(self.peaks["window"], np.arange(self.window_count + 1)).tolist()
+        return [tuple(peaks[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class ConstellationBatch(NamedTuple):
+    """
+    The constellations of a batch of sequences in one array
+
+    ...
+
+    Attributes
+    ----------
+    peaks : np.ndarray
+        A structured array of CONSTELLATION_DTYPE, with the windows numbered
+        continuously through the whole batch
+    window_offsets : np.ndarray
+        The len(batch) + 1 offsets of the windows belonging to each sequence
+    """
+    peaks: np.ndarray
+    window_offsets: np.ndarray
+
+    def split(self) -> List[Constellation]:
+        bounds = np.searchsorted(self.peaks["window"], self.window_offsets)
+        constellations = []
+        for i, window_count in enumerate(np.diff(self.window_offsets).tolist()):
+            peaks = self.peaks[bounds[i]:bounds[i + 1]].copy()
+            peaks["window"] = peaks["window"] - self.window_offsets[i]
+            constellations.append(Constellation(peaks, window_count))
+        return constellations
+
+
+def as_constellation(constellation_map) -> Constellation:
+    if isinstance(constellation_map, Constellation):
+        return constellation_map
+    return Constellation.from_map(constellation_map)
+
+
+class HashLayout:
+    """
+    The bit layout of the combinatorial hashes, a declaration of named fields
+    from the most to the least significant bits, compiled to vectorized
+    packing and unpacking of hashes stored in NumPy arrays
+
+    ...
+
+    Attributes
+    ----------
+    fields : Tuple[Tuple[str, int], ...]
+        The names of the fields and their widths in bits
+    width : int
+        The width of a hash in bits, either 32 or 64, by default the narrowest
+        one holding the fields
+    dtype : np.dtype
+        The unsigned integer type holding a hash
+    """
+    def __init__(self, fields: Tuple[Tuple[str, int], ...], width: int = None):
+        self.fields = tuple((str(name), int(bits)) for name, bits in fields)
+        total_bits = sum(bits for _, bits in self.fields)
+        if width is None:
+            width = 32 if total_bits <= 32 else 64
+        assert width in (32, 64), "Hash width must be 32 or 64 bit, got %s" % width
+        self.width = width
+        self.dtype = np.dtype(np.uint32 if width == 32 else np.uint64)
+
+        names = [name for name, _ in self.fields]
+        assert len(set(names)) == len(names), "Duplicate field in hash layout"
+        assert total_bits <= width, "Hash exceeds %s bit" % width
+
+        # the position of each field's least significant bit
+        self._shifts = {}
+        for name, bits in self.fields:
+            total_bits -= bits
+            self._shifts[name] = self.dtype.type(total_bits)
+        self._masks = {name: self.dtype.type(2**bits - 1) for name, bits in self.fields}
+
+    def __reduce__(self):
+        return HashLayout, (self.fields, self.width)
+
+    def __eq__(self, other):
+        return isinstance(other, HashLayout) and (self.fields, self.width) == (other.fields, other.width)
+
+    def __repr__(self):
+        return "HashLayout(%r, width=%s)" % (self.fields, self.width)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._shifts
+
+    def bits(self, name: str = None) -> int:
+        """
+        Returns the bits of a field, or of all fields without a name
+        """
+        if name is None:
+            return sum(bits for _, bits in self.fields)
+        return int(self._masks[name]).bit_length()
+
+    def pack(self, **values) -> np.ndarray:
+        """
+        Packs the values of all fields into hashes, the values are broadcast
+        against each other like in any NumPy operation
+        """
+        assert set(values) == set(self._shifts), "Expected values for the fields %s" % ", ".join(self._shifts)
+
+        hashes = self.dtype.type(0)
+        for name, bits in self.fields:
+            val = np.asarray(values[name])
+            assert np.all(val < 2 ** bits), "%s too big for %s bit" % (val.max(), bits)
+            assert np.all(val >= 0), "negative value for hash: %s" % val.min()
+            hashes = hashes | (val.astype(self.dtype) << self._shifts[name])
+
+        return np.asarray(hashes, dtype=self.dtype)
+
+    def unpack(self, hashes, name: str) -> np.ndarray:
+        """
+        Extracts the values of a single field from the hashes
+        """
+        return (np.asarray(hashes, dtype=self.dtype) >> self._shifts[name]) & self._masks[name]
+
+    def unpack_all(self, hashes) -> Dict[str, np.ndarray]:
+        return {name: self.unpack(hashes, name) for name, _ in self.fields}
+
+
+# the hash layout of databases that don't store their own
+HASH_LAYOUT = HashLayout((
+    ("kidera_factor", 4),
+    ("quantile", 1),
+    ("other_quantile", 1),
+    ("diff", 3),  # the window distance
+    ("other_freq", 5),
+    ("freq", 5)
+))
+
+
+class ProteinTable:
+    """
+    The protein lookup of a database in columns, behaving like a
+    ProteinLookup dictionary of protein identifiers pointing to their
+    sequence length and hash count
+
+    ...
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        The protein identifiers, the position of an identifier is the
+        protein's index in the postings of a HashIndex
+    seq_lens : np.ndarray
+        The sequence length of each protein
+    hash_counts : np.ndarray
+        The number of distinct hashes of each protein
+    """
+    def __init__(self, ids: np.ndarray, seq_lens: np.ndarray, hash_counts: np.ndarray):
+        self.ids = np.asarray(ids, dtype=str)
+        self.seq_lens = np.asarray(seq_lens, dtype=np.int64)
+        self.hash_counts = np.asarray(hash_counts, dtype=np.int64)
+        self._positions = None
+
+    @classmethod
+    def from_lookup(cls, lookup: ProteinLookup) -> "ProteinTable":
+        seq_lens, hash_counts = zip(*lookup.values()) if lookup else ((), ())
+        return cls(list(lookup), seq_lens, hash_counts)
+
+    def __getstate__(self):
+        return self.ids, self.seq_lens, self.hash_counts
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __eq__(self, other):
+        return isinstance(other, ProteinTable) and all(
+            np.array_equal(a, b) for a, b in zip(self.__getstate__(), other.__getstate__())
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, prot_id: ProteinID) -> bool:
+        return prot_id in self.positions
+
+    def __getitem__(self, prot_id: ProteinID) -> Tuple[int, int]:
+        i = self.positions[prot_id]
+        return int(self.seq_lens[i]), int(self.hash_counts[i])
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.seq_lens.nbytes + self.hash_counts.nbytes
+
+    @property
+    def positions(self) -> Dict[ProteinID, int]:
+        if self._positions is None:
+            self._positions = {prot_id: i for i, prot_id in enumerate(self.ids.tolist())}
+        return self._positions
+
+    def keys(self) -> List[ProteinID]:
+        return self.ids.tolist()
+
+    def values(self) -> List[Tuple[int, int]]:
+        return list(zip(self.seq_lens.tolist(), self.hash_counts.tolist()))
+
+    def items(self) -> List[Tuple[ProteinID, Tuple[int, int]]]:
+        return list(zip(self.keys(), self.values()))
+
+
+# the maximum bits of hashes to address postings directly by hash value
+DIRECT_ADDRESS_BITS = 22
+MINHASH_SEED = 0x5EED  # seeds the hash functions of the MinHash sketches
+MINHASH_EMPTY = 2**32 - 1  # the sketch values of empty hash sets
+
+
+def mix_hashes(values: np.ndarray) -> np.ndarray:
+    """
+    Scrambles the bits of the values by the finalizer of SplitMix64,
+    returning them as 64 bit
+    """
+    mixed = np.asarray(values).astype(np.uint64)
+    mixed ^= mixed >> np.uint64(30)
+    mixed *= np.uint64(0xBF58476D1CE4E5B9)
+    mixed ^= mixed >> np.uint64(27)
+    mixed *= np.uint64(0x94D049BB133111EB)
+    mixed ^= mixed >> np.uint64(31)
+    return mixed
+
+
+def minhash_sketches(hashes: np.ndarray, offsets: np.ndarray, sketch_size: int, members: np.ndarray = None) -> np.ndarray:
+    """
+    Returns the MinHash sketches of the hash sets hashes[offsets[i]:offsets[i + 1]],
+    the 32 bit minimum of each of sketch_size hash functions over a set, or
+    MINHASH_EMPTY for empty sets. Two sets agree in a sketch value with the
+    probability of their Jaccard Similarity Index.
+    With members, the sets are hashes[members[offsets[i]:offsets[i + 1]]],
+    so each distinct hash is only hashed once
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sketches = np.full((len(offsets) - 1, sketch_size), MINHASH_EMPTY, dtype=np.uint32)
+    filled = np.flatnonzero(np.diff(offsets))
+    if not len(filled):
+        return sketches
+
+    hashes = np.asarray(hashes).astype(np.uint64)
+    for i, seed in enumerate(mix_hashes(np.arange(sketch_size) + MINHASH_SEED)):
+        values = (mix_hashes(hashes ^ seed) >> np.uint64(32)).astype(np.uint32)
+        if members is not None:
+            values = values[members]
+        sketches[filled, i] = np.minimum.reduceat(values, offsets[filled])
+    return sketches
+
+
+class LSHIndex:
+    """
+    The banded locality-sensitive hashing index of MinHash sketches. The
+    sketches are split into bands of rows values each, and the sets agreeing
+    with a query in all values of any band are its candidates. A set with the
+    Jaccard Similarity Index s to the query is found with the probability
+    1 - (1 - s^rows)^bands, so more bands find more and less similar sets
+
+    ...
+
+    Attributes
+    ----------
+    bands : int
+        The number of bands
+    rows : int
+        The number of sketch values per band
+    keys : List[np.ndarray]
+        The sorted keys of each band, hashing the values of the sets in it
+    sets : List[np.ndarray]
+        The sets of the keys of each band, empty ones aren't indexed
+    """
+    def __init__(self, sketches: np.ndarray, bands: int):
+        assert bands > 0 and sketches.shape[1] % bands == 0, "the sketch size must be a multiple of the bands"
+        self.bands = bands
+        self.rows = sketches.shape[1] // bands
+        self.set_count = len(sketches)
+
+        indexed = np.flatnonzero(sketches[:, 0] != MINHASH_EMPTY)
+        band_keys = self.band_keys(sketches[indexed])
+        self.keys: List[np.ndarray] = []
+        self.sets: List[np.ndarray] = []
+        for keys in band_keys.T:
+            order = np.argsort(keys, kind="stable")
+            self.keys.append(keys[order])
+            self.sets.append(indexed[order].astype(np.int32))
+
+    def band_keys(self, sketches: np.ndarray) -> np.ndarray:
+        """
+        Returns the 64 bit key of each band of the sketches
+        """
+        keys = np.zeros((len(sketches), self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            keys = mix_hashes(keys ^ sketches[:, row::self.rows])
+        return keys
+
+    def candidates(self, sketches: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up the sets agreeing with the query sketches in any band
+
+        Returns
+        -------
+        The query and the indexed set of each candidate pair, distinct and
+        ordered by query and set
+        """
+        band_keys = self.band_keys(sketches)
+        is_empty = sketches[:, 0] == MINHASH_EMPTY
+        pairs = [np.array([], dtype=np.int64)]
+        for keys, query_keys, sets in zip(self.keys, band_keys.T, self.sets):
+            starts = np.searchsorted(keys, query_keys)
+            ends = np.where(is_empty, starts, np.searchsorted(keys, query_keys, side="right"))
+            counts = ends - starts
+            queries = np.repeat(np.arange(len(sketches)), counts)
+            positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            pairs.append(queries * self.set_count + sets[positions])
+
+        pairs = np.unique(np.concatenate(pairs))
+        return pairs // self.set_count, pairs % self.set_count
+
+
+class HashIndex:
+    """
+    The inverted index of a database in columns, behaving like a Database
+    dictionary of hashes pointing to their occurrences
+
+    The postings of the hash hashes[i] are proteins[offsets[i]:offsets[i + 1]]
+    and windows[offsets[i]:offsets[i + 1]], in the order they were added.
+
+    If all hashes fit into DIRECT_ADDRESS_BITS, as with narrow hash layouts,
+    the postings of query hashes are addressed directly by the hash values,
+    using a dense table of offsets and a bitmap of the contained hashes, which
+    are built on first use.
+
+    The postings are also viewed as sparse protein x hash incidence matrix,
+    see incidence, which is built on first use unless it was persisted with
+    the index. Optionally, the index holds MinHash sketches of the hash sets
+    of the proteins, see sketch, to look up similar ones by an LSHIndex. The
+    sketches of a selected index are only recomputed once it is used by lsh.
+
+    ...
+
+    Attributes
+    ----------
+    hashes : np.ndarray
+        The sorted distinct hashes
+    offsets : np.ndarray
+        The len(hashes) + 1 offsets of the postings of each hash
+    proteins : np.ndarray
+        The protein of each posting as 32 bit index into protein_ids
+    windows : np.ndarray
+        The window index of each posting in 16 bit
+    protein_ids : np.ndarray
+        The protein identifiers, e.g. ProteinTable.ids
+    sketches : np.ndarray
+        The MinHash sketch of each protein, or None if there are none or they
+        are not computed yet
+    sketch_size : int
+        The number of values of each sketch, 0 for an index without sketches
+    """
+    def __init__(
+            self,
+            hashes: np.ndarray,
+            offsets: np.ndarray,
+            proteins: np.ndarray,
+            windows: np.ndarray,
+            protein_ids: np.ndarray,
+            incidence: Tuple[np.ndarray, np.ndarray] = None,
+            sketches: np.ndarray = None,
+            sketch_size: int = None
+            ):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.proteins = proteins
+        self.windows = windows
+        self.protein_ids = protein_ids
+        self._direct_table = None
+        self._ascending_proteins = None
+        self.sketches = sketches
+        if sketch_size is None:
+            sketch_size = 0 if sketches is None else sketches.shape[1]
+        self.sketch_size = sketch_size
+        # the row offsets and column indexes of the incidence matrix
+        self._incidence = incidence
+        self._protein_postings = None
+        self._lsh = None
+
+    @classmethod
+    def from_postings(cls, hashes: np.ndarray, proteins: np.ndarray, windows: np.ndarray, protein_ids: np.ndarray) -> "HashIndex":
+        """
+        Creates the index from unsorted postings, the postings of a hash keep
+        their order
+        """
+        assert len(windows) == 0 or windows.max() < 2**16, "window index exceeds 16 bit"
+        assert len(protein_ids) < 2**31, "protein count exceeds 32 bit"
+
+        order = np.argsort(hashes, kind="stable")
+        hashes = hashes[order]
+
+        is_new = np.ones(len(hashes), dtype=bool)
+        is_new[1:] = hashes[1:] != hashes[:-1]
+        offsets = np.append(np.flatnonzero(is_new), len(hashes)).astype(np.int64)
+
+        return cls(hashes[is_new], offsets, proteins[order].astype(np.int32), windows[order].astype(np.uint16), protein_ids)
+
+    @classmethod
+    def from_database(cls, database: Database, lookup: ProteinTable, layout: HashLayout = HASH_LAYOUT) -> "HashIndex":
+        """
+        Converts the dictionary form of a database
+        """
+        counts = np.fromiter(map(len, database.values()), dtype=np.int64, count=len(database))
+        hashes = np.repeat(np.fromiter(database.keys(), dtype=layout.dtype, count=len(database)), counts)
+        positions = lookup.positions
+        windows, proteins = np.empty(counts.sum(), dtype=np.int64), np.empty(counts.sum(), dtype=np.int64)
+        occurrences = (occ for occs in database.values() for occ in occs)
+        for i, (window, prot_id) in enumerate(occurrences):
+            windows[i], proteins[i] = window, positions[prot_id]
+
+        return cls.from_postings(hashes, proteins, windows, lookup.ids)
+
+    def __getstate__(self):
+        return self.hashes, self.offsets, self.proteins, self.windows, self.protein_ids, self._incidence, self.sketches, self.sketch_size
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __eq__(self, other):
+        # the incidence matrix is derived from the postings
+        return isinstance(other, HashIndex) and all(
+            np.array_equal(a, b) for a, b in zip(self.__getstate__()[:5], other.__getstate__()[:5])
+        )
+
+    def find(self, hashes) -> np.ndarray:
+        """
+        Returns the positions of the hashes in the index, -1 for the ones not
+        contained
+        """
+        hashes = np.asarray(hashes, dtype=self.hashes.dtype)
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        found = (self.hashes[positions] == hashes) if len(self.hashes) else np.zeros(len(positions), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def posting_ranges(self, hashes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the start and end offsets of the postings of each of the
+        hashes, empty ranges for the ones not contained
+        """
+        hashes = np.asarray(hashes, dtype=self.hashes.dtype)
+
+        if (direct_table := self.direct_table()) is not None:
+            dense_offsets, bitmap = direct_table
+            # reject absent hashes in bulk, the remaining ones are in range
+            present = hashes < len(dense_offsets) - 1
+            candidates = hashes[present]
+            present[present] = (bitmap[candidates >> 3] >> (candidates & 7).astype(np.uint8)) & 1 == 1
+            starts = np.zeros(len(hashes), dtype=np.int64)
+            ends = np.zeros(len(hashes), dtype=np.int64)
+            starts[present] = dense_offsets[hashes[present]]
+            ends[present] = dense_offsets[hashes[present] + 1]
+            return starts, ends
+
+        positions = self.find(hashes)
+        found = positions >= 0
+        starts = np.where(found, self.offsets[positions], 0)
+        ends = np.where(found, self.offsets[positions + 1], 0)
+        return starts, ends
+
+    def gather(self, hashes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Resolves the postings of all the hashes at once
+
+        Returns
+        -------
+        For each posting the index of its hash in hashes, its protein index
+        and its window index, ordered by hash like the hashes were passed
+        """
+        return self.expand(*self.posting_ranges(hashes))
+
+    def join(self, hashes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Resolves the postings of all the hashes like gather, but merge-joins
+        the sorted distinct hashes against the index, so hashes repeated
+        among many queries are looked up only once
+        """
+        return self.expand(*self.join_ranges(hashes))
+
+    def join_ranges(self, hashes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the posting ranges of the hashes like posting_ranges, looking
+        them up like join does
+        """
+        distinct, inverse = np.unique(np.asarray(hashes, dtype=self.hashes.dtype), return_inverse=True)
+        # for ascending hashes, each binary search starts from the position of
+        # the previous one, like a merge of both sorted arrays
+        starts, ends = self.posting_ranges(distinct)
+        inverse = inverse.reshape(-1)
+        return starts[inverse], ends[inverse]
+
+    def expand(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the postings of the ranges like gather does for the ranges of
+        the hashes
+        """
+        query, postings = self.posting_indexes(starts, ends)
+        return query, self.proteins[postings], self.windows[postings]
+
+    def posting_indexes(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns for each posting in the ranges the index of its range and its
+        index into proteins and windows
+        """
+        counts = ends - starts
+        query = np.repeat(np.arange(len(counts)), counts)
+        postings = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return query, postings
+
+    def direct_table(self) -> Union[Tuple[np.ndarray, np.ndarray], None]:
+        """
+        The dense offsets of the postings of every hash value up to the
+        biggest hash, and the bitmap of contained hashes, little endian per
+        byte, or None if the hashes don't fit into DIRECT_ADDRESS_BITS
+        """
+        if self._direct_table is None and len(self.hashes) and int(self.hashes[-1]) < 2**DIRECT_ADDRESS_BITS:
+            size = int(self.hashes[-1]) + 1
+            counts = np.zeros(size, dtype=np.int64)
+            counts[self.hashes] = self.posting_counts()
+            dense_offsets = np.zeros(size + 1, dtype=np.int64)
+            np.cumsum(counts, out=dense_offsets[1:])
+            self._direct_table = dense_offsets, np.packbits(counts > 0, bitorder="little")
+
+        return self._direct_table
+
+    def ascending_proteins(self) -> bool:
+        """
+        Whether the proteins of each hash's postings are strictly ascending,
+        as the proteins are added in order, so no protein has a hash twice.
+        Only proteins occurring multiple times in the FASTA file of the
+        database can have duplicate postings
+        """
+        if self._ascending_proteins is None:
+            is_ascending = np.ones(len(self.proteins), dtype=bool)
+            is_ascending[1:] = self.proteins[1:] > self.proteins[:-1]
+            is_ascending[self.offsets[:-1]] = True
+            self._ascending_proteins = bool(is_ascending.all())
+
+        return self._ascending_proteins
+
+    def incidence(self) -> sparse.csr_matrix:
+        """
+        The protein x hash incidence matrix of the postings, whose entry (i, j)
+        is 1 if the protein i has the hash hashes[j]. Its row sums are the
+        hash counts of the proteins and its column sums the posting counts,
+        the overlaps of proteins with a set of hashes are a product with it
+        """
+        if self._incidence is None:
+            hash_indexes = np.repeat(np.arange(len(self), dtype=np.int32), self.posting_counts())
+            matrix = sparse.csr_matrix(
+                (np.ones(len(hash_indexes), dtype=np.int32), (self.proteins, hash_indexes)),
+                shape=(len(self.protein_ids), len(self))
+            )
+            self._incidence = matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32)
+
+        protein_offsets, hash_indexes = self._incidence
+        # proteins occurring multiple times in the FASTA file have duplicate
+        # postings, summed up when building it, but they're still incident
+        return sparse.csr_matrix(
+            (np.ones(len(hash_indexes), dtype=np.int32), hash_indexes, protein_offsets),
+            shape=(len(self.protein_ids), len(self))
+        )
+
+    def protein_postings(self) -> np.ndarray:
+        """
+        The indexes of the postings ordered by protein and hash, which are the
+        ones of the entries of the incidence matrix if no protein has a hash
+        twice, see ascending_proteins
+        """
+        if self._protein_postings is None:
+            self._protein_postings = np.argsort(self.proteins, kind="stable")
+
+        return self._protein_postings
+
+    def sketch(self, sketch_size: int):
+        """
+        Computes the MinHash sketches of the hash sets of the proteins
+        """
+        incidence = self.incidence()
+        self.sketches = minhash_sketches(self.hashes, incidence.indptr, sketch_size, incidence.indices)
+        self.sketch_size = sketch_size
+        self._lsh = None
+
+    def lsh(self, bands: int) -> LSHIndex:
+        """
+        The LSHIndex of the sketches with the number of bands, built on first
+        use, along with the sketches if they are not computed yet
+        """
+        assert self.sketch_size, "the database has no MinHash sketches"
+        if self.sketches is None:
+            self.sketch(self.sketch_size)
+        if self._lsh is None or self._lsh.bands != bands:
+            self._lsh = LSHIndex(self.sketches, bands)
+
+        return self._lsh
+
+    @property
+    def nbytes(self) -> int:
+        return self.hashes.nbytes + self.offsets.nbytes + self.proteins.nbytes + self.windows.nbytes
+
+    def posting_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def select(self, keep: np.ndarray) -> "HashIndex":
+        """
+        Returns the index of only the hashes marked by the boolean mask,
+        with the selected columns of the incidence matrix if it was built.
+        The sketches of the remaining hash sets are computed by lsh on use
+        """
+        counts = self.posting_counts()[keep]
+        postings = np.repeat(keep, self.posting_counts())
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        incidence = None
+        if self._incidence is not None:
+            matrix = self.incidence()[:, np.asarray(keep)]
+            incidence = matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32)
+
+        return HashIndex(
+            self.hashes[keep], offsets, self.proteins[postings], self.windows[postings], self.protein_ids, incidence,
+            sketch_size=self.sketch_size
+        )
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __iter__(self):
+        return iter(self.hashes.tolist())
+
+    def __contains__(self, hash_: Hash) -> bool:
+        return self.find([hash_])[0] >= 0
+
+    def __getitem__(self, hash_: Hash) -> List[HashOccurence]:
+        i = self.find([hash_])[0]
+        if i < 0:
+            raise KeyError(hash_)
+        return self._occurrences(i)
+
+    def get(self, hash_: Hash, default=None) -> List[HashOccurence]:
+        i = self.find([hash_])[0]
+        return self._occurrences(i) if i >= 0 else default
+
+    def keys(self) -> List[Hash]:
+        return self.hashes.tolist()
+
+    def values(self) -> Generator[List[HashOccurence], None, None]:
+        return (self._occurrences(i) for i in range(len(self)))
+
+    def items(self) -> Generator[Tuple[Hash, List[HashOccurence]], None, None]:
+        return zip(self.keys(), self.values())
+
+    def _occurrences(self, i: int) -> List[HashOccurence]:
+        postings = slice(self.offsets[i], self.offsets[i + 1])
+        return list(zip(self.windows[postings].tolist(), self.protein_ids[self.proteins[postings]].tolist()))
 
 
 class DB(NamedTuple):
-    db: Database
-    lookup: ProteinLookup
+    db: HashIndex
+    lookup: ProteinTable
     config: DBConfig
+    layout: HashLayout = HASH_LAYOUT
+
+
+# the files of a database directory
+DB_VERSION = 2
+DB_META_FILE = "meta.json"
+DB_ARRAYS = ("hashes", "offsets", "proteins", "windows", "protein_ids", "seq_lens", "hash_counts")
+# the incidence matrix, missing in databases of previous versions
+DB_INCIDENCE_ARRAYS = ("incidence_offsets", "incidence_hashes")
+DB_SKETCHES = "sketches"  # only written for databases with computed sketches
+
+
+def load_db(db_in: str) -> DB:
+    """
+    Loads a database, either a pickled one or a directory written by save_db,
+    whose arrays are memory-mapped instead of read, so opening it is
+    independent of its size and only the pages of touched hashes get loaded.
+    The dictionaries of pickled databases written by previous versions are
+    converted into a HashIndex and ProteinTable
+    """
+    if os.path.isdir(db_in):
+        with open(os.path.join(db_in, DB_META_FILE)) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(db_in, name + ".npy"), mmap_mode="r") for name in DB_ARRAYS}
+
+        incidence = None
+        if all(os.path.exists(os.path.join(db_in, name + ".npy")) for name in DB_INCIDENCE_ARRAYS):
+            incidence = tuple(np.load(os.path.join(db_in, name + ".npy"), mmap_mode="r") for name in DB_INCIDENCE_ARRAYS)
+
+        sketches = None
+        if os.path.exists(os.path.join(db_in, DB_SKETCHES + ".npy")):
+            sketches = np.load(os.path.join(db_in, DB_SKETCHES + ".npy"), mmap_mode="r")
+
+        lookup = ProteinTable(arrays["protein_ids"], arrays["seq_lens"], arrays["hash_counts"])
+        database = HashIndex(
+            arrays["hashes"], arrays["offsets"], arrays["proteins"], arrays["windows"], lookup.ids, incidence, sketches,
+            meta.get("sketch_size")
+        )
+        layout = HashLayout(meta["layout"]["fields"], meta["layout"]["width"])
+        return DB(database, lookup, DBConfig(**meta["config"]), layout)
+
+    with open(db_in, "rb") as f:
+        db: DB = pickle.load(f)
+
+    if isinstance(db.db, dict):
+        lookup = ProteinTable.from_lookup(db.lookup)
+        db = DB(HashIndex.from_database(db.db, lookup, db.layout), lookup, *db[2:])
+
+    return db
+
+
+def save_db(db: DB, db_out: str):
+    """
+    Writes a database, pickled if the file name ends with '.pickle',
+    otherwise as a directory of NumPy arrays to be memory-mapped by load_db.
+    The incidence matrix of the index is built and written along, the
+    sketches only if they are computed, otherwise lsh computes them on use
+    """
+    db.db.incidence()
+
+    if db_out.endswith(".pickle"):
+        with open(db_out, "wb") as f:
+            pickle.dump(db, f, pickle.HIGHEST_PROTOCOL)
+        return
+
+    os.makedirs(db_out, exist_ok=True)
+    arrays = {
+        "hashes": db.db.hashes,
+        "offsets": db.db.offsets,
+        "proteins": db.db.proteins,
+        "windows": db.db.windows,
+        "protein_ids": db.lookup.ids,
+        "seq_lens": db.lookup.seq_lens,
+        "hash_counts": db.lookup.hash_counts
+    }
+    arrays["incidence_offsets"], arrays["incidence_hashes"] = db.db._incidence
+    for name in DB_ARRAYS + DB_INCIDENCE_ARRAYS:
+        np.save(os.path.join(db_out, name + ".npy"), arrays[name])
+    if db.db.sketches is not None:
+        np.save(os.path.join(db_out, DB_SKETCHES + ".npy"), db.db.sketches)
+    elif os.path.exists(os.path.join(db_out, DB_SKETCHES + ".npy")):
+        os.remove(os.path.join(db_out, DB_SKETCHES + ".npy"))
+
+    checksum = hashlib.sha256()
+    for name in DB_ARRAYS:
+        checksum.update(np.ascontiguousarray(arrays[name]).data)
+
+    meta = {
+        "version": DB_VERSION,
+        "config": db.config._asdict(),
+        "layout": {"fields": db.layout.fields, "width": db.layout.width},
+        "sketch_size": db.db.sketch_size,
+        "checksum": checksum.hexdigest()
+    }
+    with open(os.path.join(db_out, DB_META_FILE), "w") as f:
+        json.dump(meta, f, indent=4)
+
+
+def db_checksum(db_in: str) -> str:
+    """
+    Returns the checksum of a database identifying its build, the one save_db
+    stored for directories, otherwise the SHA-256 of its files
+    """
+    files = [db_in]
+    if os.path.isdir(db_in):
+        with open(os.path.join(db_in, DB_META_FILE)) as f:
+            meta = json.load(f)
+        if "checksum" in meta:
+            return meta["checksum"]
+        files = [os.path.join(db_in, name + ".npy") for name in DB_ARRAYS]
+
+    checksum = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as f:
+            while block := f.read(2**20):
+                checksum.update(block)
+    return checksum.hexdigest()
 
 
 def pd_read_chunkwise(csv_file: str, chunksize=10_000) -> Generator[pd.DataFrame, None, None]:
@@ -98,10 +923,271 @@ def verify_type(var, ty) -> bool:
     return True
 
 
+FASTA_INDEX_SUFFIX = ".index.npz"  # the sidecar file of a FASTA file's FastaIndex
+FASTA_CHUNK_SIZE = 1024 ** 2  # bytes read at once when streaming a FASTA file
+
+# the compressions of FASTA files read transparently, opening the compressed
+# file or file object given
+FASTA_DECOMPRESSORS = {
+    "gzip": gzip.open,
+    "bgzf": gzip.open,  # blocked gzip, the one of bgzip
+    "bz2": bz2.open
+}
+
+
+class FastaIndex(NamedTuple):
+    """
+    The index of the records of a FASTA file, like a samtools .fai index,
+    which is stored as sidecar file next to it, see fasta_index
+
+    ...
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        The identifier of each record
+    offsets : np.ndarray
+        The byte offsets of the records, whose header starts there, and of the
+        end of the last one, so the records' lengths are their differences.
+        For compressed files, they are the offsets in the decompressed file
+    blocks : np.ndarray
+        The compressed and decompressed offset of each block of a BGZF file,
+        like a bgzip .gzi index, empty for other files
+    mtime : int
+        The modification time of the indexed file in ns
+    size : int
+        The size of the indexed file in bytes
+    """
+    ids: np.ndarray
+    offsets: np.ndarray
+    blocks: np.ndarray
+    mtime: int
+    size: int
+
+    @classmethod
+    def build(cls, file_name: str) -> "FastaIndex":
+        """
+        Indexes the file in one pass over its headers, decompressing it if
+        it's compressed
+        """
+        stat = os.stat(file_name)
+        ids: List[ProteinID] = []
+        offsets: List[int] = []
+        with open_fasta(file_name) as f:
+            for start, record in fasta_stream(f):
+                offsets.append(start)
+                ids.append(fasta_header(record[:header_end(record, 0, len(record))])[0])
+            offsets.append(f.tell())
+
+        blocks = bgzf_blocks(file_name) if fasta_compression(file_name) == "bgzf" else np.zeros((0, 2), dtype=np.int64)
+        return cls(np.array(ids, dtype=str), np.array(offsets, dtype=np.int64), blocks, stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def load(cls, index_file: str) -> "FastaIndex":
+        with np.load(index_file) as arrays:
+            return cls(arrays["ids"], arrays["offsets"], arrays["blocks"], int(arrays["mtime"]), int(arrays["size"]))
+
+    def save(self, index_file: str):
+        # written aside and moved, so concurrent readers never see it partially
+        tmp_file = "%s.%d.tmp.npz" % (index_file, os.getpid())
+        np.savez(tmp_file, **self._asdict())
+        os.replace(tmp_file, index_file)
+
+    def matches(self, file_name: str) -> bool:
+        """
+        Whether the index is still the one of the file, which is unmodified
+        since
+        """
+        stat = os.stat(file_name)
+        return (self.mtime, self.size) == (stat.st_mtime_ns, stat.st_size)
+
+
+def fasta_index(file_name: str, persist=False) -> FastaIndex:
+    """
+    Returns the index of a FASTA file. With persist, it's the one of its
+    sidecar file if the FASTA file wasn't modified since, otherwise it is
+    built and stored to the sidecar file, if possible
+    """
+    if not persist:
+        return FastaIndex.build(file_name)
+
+    index_file = file_name + FASTA_INDEX_SUFFIX
+    if os.path.exists(index_file):
+        try:
+            index = FastaIndex.load(index_file)
+            if index.matches(file_name):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass  # rebuilt below
+
+    index = FastaIndex.build(file_name)
+    try:
+        index.save(index_file)
+    except OSError as e:
+        warn("Can't store the index of %s: %s" % (file_name, e))
+    return index
+
+
+def parse_fasta_header(prot_desc: str) -> Tuple[ProteinID, str]:
+    """
+    Returns the identifier and description of a header line, including its
+    line break
+    """
+    header = prot_desc.split(" ", 1)
+    if len(header) == 2:
+        prot_id, description = header
+    else:
+        prot_id, description = header[0][:-1], "\n"
+
+    # remove '>' from identifier and '\n' from description
+    return prot_id[1:], description[:-1]
+
+
+def fasta_compression(file_name: str) -> Union[str, None]:
+    """
+    Returns the compression of a FASTA file, one of FASTA_DECOMPRESSORS
+    recognized by its magic bytes, or None if it's uncompressed
+    """
+    with open(file_name, "rb") as f:
+        magic = f.read(14)
+
+    if magic.startswith(b"\x1f\x8b"):
+        # BGZF blocks are gzip members with the block size as extra field 'BC'
+        return "bgzf" if len(magic) == 14 and magic[3] & 4 and magic[12:14] == b"BC" else "gzip"
+    if magic.startswith(b"BZh"):
+        return "bz2"
+    return None
+
+
+def open_fasta(file_name: str) -> BinaryIO:
+    """
+    Opens a FASTA file for reading its bytes, decompressed if it's compressed
+    """
+    compression = fasta_compression(file_name)
+    return open(file_name, "rb") if compression is None else FASTA_DECOMPRESSORS[compression](file_name, "rb")
+
+
+def bgzf_blocks(file_name: str) -> np.ndarray:
+    """
+    Returns the compressed and decompressed offset of each block of a BGZF
+    file, read from the blocks' headers and sizes without decompressing them
+    """
+    blocks: List[Tuple[int, int]] = []
+    offset = decompressed_offset = 0
+    with open(file_name, "rb") as f:
+        while (header := f.read(12)):
+            assert header[:4] == b"\x1f\x8b\x08\x04", "No BGZF block at byte %d of %s" % (offset, file_name)
+            extra = f.read(int.from_bytes(header[10:12], "little"))
+
+            # the size of the block minus 1 is stored in the subfield 'BC'
+            block_size = i = 0
+            while i + 4 <= len(extra):
+                field_size = int.from_bytes(extra[i + 2:i + 4], "little")
+                if extra[i:i + 2] == b"BC":
+                    block_size = int.from_bytes(extra[i + 4:i + 6], "little") + 1
+                i += 4 + field_size
+            assert block_size, "No BGZF block size at byte %d of %s" % (offset, file_name)
+
+            # the block ends with the size of its decompressed data
+            f.seek(offset + block_size - 4)
+            blocks.append((offset, decompressed_offset))
+            decompressed_offset += int.from_bytes(f.read(4), "little")
+            offset += block_size
+
+    return np.array(blocks, dtype=np.int64).reshape(-1, 2)
+
+
+def fasta_stream(f: BinaryIO, chunk_size=FASTA_CHUNK_SIZE) -> Generator[Tuple[int, bytes], None, None]:
+    """
+    Yields the offset and bytes of each record of a FASTA file read as stream,
+    e.g. while it's decompressed, in chunks of chunk_size bytes
+    """
+    buffer = b""
+    position = 0  # the offset of the buffer in the file
+    while (chunk := f.read(chunk_size)):
+        buffer += chunk
+        records = list(fasta_records(buffer))
+
+        # the last record may continue in the next chunk
+        for start, end in records[:-1]:
+            yield position + start, buffer[start:end]
+        if records:
+            position += records[-1][0]
+            buffer = buffer[records[-1][0]:]
+
+    for start, end in fasta_records(buffer):
+        yield position + start, buffer[start:end]
+
+
+def fasta_records(buffer) -> Generator[Tuple[int, int], None, None]:
+    """
+    Yields the start and end offsets of the records in the buffer of a FASTA
+    file, each starting with a '>' at the beginning of a line
+    """
+    starts = _header_starts(buffer)
+    if (start := next(starts, None)) is None:
+        return
+    for end in starts:
+        yield start, end
+        start = end
+    yield start, len(buffer)
+
+
+def _header_starts(buffer) -> Generator[int, None, None]:
+    start = buffer.find(b">")
+    while start >= 0:
+        if start == 0 or buffer[start - 1] in b"\r\n":
+            yield start
+        start = buffer.find(b">", start + 1)
+
+
+def header_end(buffer, start: int, end: int) -> int:
+    """
+    Returns the offset after the header line of the record from start to end
+    in the buffer of a FASTA file, including its line break, '\n', '\r' or
+    both
+    """
+    line_end = buffer.find(b"\n", start, end)
+    cr = buffer.find(b"\r", start, end if line_end < 0 else line_end)
+    if cr >= 0:
+        return cr + 2 if buffer[cr + 1:cr + 2] == b"\n" else cr + 1
+    return end if line_end < 0 else line_end + 1
+
+
+def fasta_record(buffer, start: int, end: int, decode=True) -> Tuple[ProteinID, str, Union[str, bytes]]:
+    """
+    Returns the identifier, description and sequence of the record from start
+    to end in the buffer of a FASTA file. Without decode, sequences of ASCII
+    letters are returned as bytes, e.g. for get_aa_vectors, and only others
+    are decoded
+    """
+    seq_start = header_end(buffer, start, end)
+
+    # the sequence's lines joined by removing their line breaks, while
+    # copying them out of the buffer
+    seq = buffer[seq_start:end].translate(None, b"\r\n")
+    return (*fasta_header(buffer[start:seq_start]), seq if not decode and seq.isascii() else seq.decode())
+
+
+def fasta_header(line: bytes) -> Tuple[ProteinID, str]:
+    """
+    Returns the identifier and description of a header line read from the
+    file, like parse_fasta_header, with its line break if it has one
+    """
+    text = line.rstrip(b"\r\n")
+    return parse_fasta_header(text.decode() + "\n" * (len(text) < len(line)))
+
+
 class Fasta:
     """
     A class used for convenient iteration over a FASTA file's contents.
 
+    The records are parsed from the memory-mapped file, or while
+    decompressing it for gzip, BGZF and bz2 compressed files. Checked files
+    are indexed by their FastaIndex, so slices seek to their records
+    directly, and split divides them into contiguous ranges of records for
+    parallel jobs. The index is only kept in a sidecar file for persist_index.
+
     ...
 
     Attributes
@@ -110,83 +1196,107 @@ class Fasta:
         The name of the FASTA formatted file
     protein_count : int
         The number of sequences stored in the FASTA file
+    compression : str
+        The compression of the file, one of FASTA_DECOMPRESSORS, or None
+    index : FastaIndex
+        The index of the file, None if it's unchecked
+    decode : bool
+        Whether all sequences are decoded into str
     """
-    def __init__(self, file_name: str, check=True):
+    def __init__(self, file_name: str, check=True, persist_index=False, decode=True):
         """
         Parameters
         ----------
         file_name : str
             The name of the FASTA formatted file
+        check : bool
+            Whether to index the file
+        persist_index : bool
+            Whether to reuse and store the index in a sidecar file, for files
+            read repeatedly
+        decode : bool
+            Whether to decode all sequences into str, otherwise the ones of
+            ASCII letters are bytes, see fasta_record
         """
-        with open(file_name) as f:
-            self.file_name = file_name
-            if check:
-                self.protein_count = count_appearances_in_file("^>", f)
+        self.file_name = file_name
+        self.decode = decode
+        self.compression = fasta_compression(file_name)
+        if check:
+            self.index = fasta_index(file_name, persist_index)
+            self.protein_count = len(self.index.ids)
 
-                # validate ... TODO or validate during iteration like (re.match("^[A-Z]+$", seq) is not None)
+            # validate ... TODO or validate during iteration like (re.match("^[A-Z]+$", seq) is not None)
 
-            else:
-                self.protein_count = None
+        else:
+            self.index = None
+            self.protein_count = None
 
     def __len__(self):
         if self.protein_count is None:
             raise TypeError("Can't predict protein count of unchecked Fasta")
         return self.protein_count
 
-    def __iter__(self) -> Generator[Tuple[ProteinID, str, str], None, None]:
+    def __iter__(self) -> Generator[Tuple[ProteinID, str, Union[str, bytes]], None, None]:
         return self[:]
 
-    def __getitem__(self, key) -> Generator[Tuple[ProteinID, str, str], None, None]:
+    def __getitem__(self, key) -> Generator[Tuple[ProteinID, str, Union[str, bytes]], None, None]:
         assert type(key) is slice
-        if self.protein_count is None:
-            start, _, step = key.indices(0)
-            stop = key.stop
+        if self.index is None:
+            # unchecked files are searched for their records while reading
+            assert key.step is None or key.step > 0, "negative steps currently not supported"
+            return islice(self._scan(), key.start, key.stop, key.step)
 
-            def open_range(start, step=1):
-                while True:
-                    yield start
-                    start += step
-
-            pbar = tqdm(open_range(start, step))
-        else:
-            start, stop, step = key.indices(self.protein_count)
-            pbar = tqdm(range(start, stop, step))
+        start, stop, step = key.indices(self.protein_count)
         assert step > 0, "negative steps currently not supported"
+        starts = self.index.offsets[start:stop:step].tolist()
+        ends = self.index.offsets[start + 1:stop + 1:step].tolist()
+        return self._read(starts, ends)
+
+    def split(self, parts: int) -> List[slice]:
+        """
+        Divides the records into parts contiguous slices of about the same
+        size in bytes, e.g. for parallel jobs
+        """
+        assert parts > 0, "parts must be positive"
+        offsets = self.index.offsets
+        bounds = np.searchsorted(offsets[:-1], np.linspace(offsets[0], offsets[-1], parts + 1)[1:-1]).tolist()
+        bounds = [0, *bounds, self.protein_count]
+        return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def _read(self, starts: List[int], ends: List[int]) -> Generator[Tuple[ProteinID, str, Union[str, bytes]], None, None]:
+        # the records are read given their start and end offsets, the ones
+        # in the decompressed file for compressed files
+        if not starts:
+            return
+
+        if self.compression is None:
+            with open(self.file_name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                # create a progress bar and parse the records of the memory-mapped file
+                for start, end in tqdm(zip(starts, ends), total=len(starts)):
+                    yield fasta_record(buffer, start, end, self.decode)
+            return
+
+        with open(self.file_name, "rb") as compressed:
+            # BGZF files are decompressed from the block of the first record
+            # on, so parallel jobs decompress their own ranges of blocks
+            base = 0
+            if len(self.index.blocks):
+                block = np.searchsorted(self.index.blocks[:, 1], starts[0], side="right") - 1
+                compressed.seek(self.index.blocks[block, 0])
+                base = int(self.index.blocks[block, 1])
+
+            with FASTA_DECOMPRESSORS[self.compression](compressed, "rb") as f:
+                # create a progress bar and parse the records while decompressing
+                for start, end in tqdm(zip(starts, ends), total=len(starts)):
+                    f.seek(start - base)
+                    record = f.read(end - start)
+                    yield fasta_record(record, 0, len(record), self.decode)
 
-        with open(self.file_name) as f:
-            # create a progress bar and iterate over the FASTA file
-            current_prot = 0
-            for i in pbar:
-
-                # find line of sequence description
-                while current_prot <= i and (prot_desc := f.readline()):
-                    current_prot += prot_desc[0] == ">"
-                if not prot_desc:
-                    break  # because EOF
-
-                # read sequence
-                seq = ""
-                while (seq_segment := f.readline()) and seq_segment[0] != ">":
-                    pointer = f.tell()
-                    seq += seq_segment
-                seq = seq.replace("\n", "")
-
-                # go to last line -> readline returns header of next protein
-                f.seek(pointer)
-
-                # extract information from describing line
-                header = prot_desc.split(" ", 1)
-                if len(header) == 2:
-                    prot_id, description = header
-                else:
-                    prot_id, description = header[0][:-1], "\n"
-
-                # yield the extracted values, remove '>' from identifier and
-                # '\n' from description
-                yield prot_id[1:], description[:-1], seq
-
-        if stop is not None:
-            assert current_prot == max(start, stop - (stop - start - 1) % step)
+    def _scan(self) -> Generator[Tuple[ProteinID, str, Union[str, bytes]], None, None]:
+        with open_fasta(self.file_name) as f:
+            # create a progress bar and parse the records of the file's stream
+            for _, record in tqdm(fasta_stream(f)):
+                yield fasta_record(record, 0, len(record), self.decode)
 
 
 def count_appearances_in_file(pattern, file: TextIO):